@@ -172,6 +172,7 @@ Recommends:			python3-avahi
 Recommends:			python3-dns
 Recommends:			python3-paramiko
 #Recommends:			python3-lzo
+Recommends:			python3-zstandard
 Recommends:         python3-kerberos
 Recommends:         python3-gssapi
 Recommends:         python3-ldap
@@ -942,6 +942,7 @@ def clean():
                    "xpra/server/cystats.c",
                    "xpra/rectangle.c",
                    "xpra/server/window/motion.c",
+                   "xpra/server/shadow/tile_hash.c",
                    "xpra/server/pam.c",
                    "etc/xpra/xpra.conf",
                    #special case for the generated xpra conf files in build (see #891):
@@ -1948,6 +1949,10 @@ if server_ENABLED or shadow_ENABLED:
     cython_add(Extension("xpra.server.window.motion",
                 ["xpra/server/window/motion.pyx"],
                 **O3_pkgconfig))
+if shadow_ENABLED:
+    cython_add(Extension("xpra.server.shadow.tile_hash",
+                ["xpra/server/shadow/tile_hash.pyx"],
+                **O3_pkgconfig))
 
 if sd_listen_ENABLED:
     sdp = pkgconfig("libsystemd")
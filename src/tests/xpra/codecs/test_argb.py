@@ -5,9 +5,10 @@
 # later version. See the file COPYING for details.
 
 import time
+from functools import partial
 
 from tests.xpra.codecs.test_codec import get_source_data
-from xpra.codecs.argb.argb import argb_to_rgba, argb_to_rgb, bgra_to_rgb, bgra_to_rgba, unpremultiply_argb_in_place, unpremultiply_argb, r210_to_rgba, r210_to_rgb #@UnresolvedImport
+from xpra.codecs.argb.argb import argb_to_rgba, argb_to_rgb, bgra_to_rgb, bgra_to_rgba, unpremultiply_argb_in_place, unpremultiply_argb, r210_to_rgba, r210_to_rgb, alpha_fill #@UnresolvedImport
 
 N = 10
 
@@ -32,9 +33,14 @@ def test_argb():
     #1 frame of 4k 32bpp:
     _test_functions(argb_to_rgba, argb_to_rgb, bgra_to_rgb, bgra_to_rgba, r210_to_rgba, r210_to_rgb)
 
+def test_alpha_fill():
+    print("test_alpha_fill()")
+    _test_functions(partial(alpha_fill, index=3))
+
 def main():
     test_premultiply()
     test_argb()
+    test_alpha_fill()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# This file is part of Xpra.
+# Copyright (C) 2020 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+import sys
+import time
+
+from xpra.net.compression import get_enabled_compressors, get_compressor, use, ZstdContext
+from xpra.net.packet_encoding import get_enabled_encoders, get_encoder
+
+
+#some of the most common packets, using their real names rather than aliases:
+PACKETS = (
+    ("hello", {
+        "version" : "4.0", "uuid" : "8643124ce701ee68dbb6b7a8c4eb13a5f6409494",
+        "platform" : "linux", "platform.release" : "5.6.13-300.fc32.x86_64",
+        "encodings" : ["rgb", "png", "png/L", "png/P", "jpeg", "webp", "h264", "vp8", "vp9"],
+        "encodings.core" : ["rgb24", "rgb32", "png", "png/L", "png/P", "jpeg", "webp", "h264", "vp8", "vp9"],
+        "encodings.with_quality" : ["jpeg", "webp", "h264", "vp8", "vp9"],
+        "encodings.with_speed" : ["png", "png/L", "png/P", "jpeg", "h264"],
+        "desktop_size" : (3840, 2160), "root_window_size" : (3840, 2160),
+        "clipboard" : True, "clipboards" : ["CLIPBOARD", "PRIMARY", "SECONDARY"],
+        "sound.receive" : True, "sound.send" : True,
+        "sound.decoders" : ["opus", "vorbis", "flac", "mp3", "wav"],
+        "sound.encoders" : ["opus", "vorbis", "flac", "mp3", "wav"],
+        "key_repeat" : (500, 30), "cursors" : True, "bell" : True, "notifications" : True,
+        "modifier_keycodes" : {
+            "control" : [("Control_L", "Control_L"), ("Control_R", "Control_R")],
+            "mod1" : [(64, "Alt_L"), ("Alt_L", "Alt_L"), ("Meta_L", "Meta_L")],
+            "shift" : [("Shift_L", "Shift_L"), ("Shift_R", "Shift_R")],
+            "lock" : [("Caps_Lock", "Caps_Lock")],
+            },
+        }),
+    ("draw", 1, 0, 0, 499, 316, "rgb24", b"", 1, 1497, {"lz4" : True, "rgb_format" : "RGB"}),
+    ("ping", 1386771573608),
+    ("damage-sequence", 17, 1, 12, 13, 333),
+    ("ping_echo", 1386771673124, 830, 880, 890, 4),
+    ("pointer-position", 1, (204, 279), ["mod2"], []),
+    ("key-action", 1, "s", True, ["mod2"], 115, "s", 39, 0),
+    ("new-window", 2, 0, 0, 499, 316, {
+        "size-constraints" : {"minimum-size" : (25, 17), "base-size" : (19, 4), "increment" : (6, 13)},
+        "fullscreen" : False, "has-alpha" : False, "title" : "xterm", "pid" : 13773,
+        "client-machine" : "desktop", "icon-title" : "xterm", "window-type" : ["NORMAL"],
+        "modal" : False, "maximized" : False, "class-instance" : ["xterm", "XTerm"],
+        }, {}),
+    )
+
+
+def get_compressors(level):
+    compressors = {}
+    for name in get_enabled_compressors():
+        if name=="none":
+            continue
+        compress = get_compressor(name)
+        compressors[name] = lambda data, compress=compress: compress(data, level)[1]
+    if use("zstd"):
+        context = ZstdContext(builtin=True)
+        compressors["zstd-dict"] = lambda data: context.compress(data, level)[1]
+    return compressors
+
+
+def test_compress(compressors, data, N):
+    results = {}
+    for name, compress in compressors.items():
+        start = time.monotonic()
+        for _ in range(N):
+            compress(data)
+        elapsed = time.monotonic()-start
+        ratio = len(data)/len(compress(data))
+        results[name] = (elapsed, ratio)
+    return results
+
+
+def main(args):
+    N = int(args[1]) if len(args)>1 else 10000
+    level = int(args[2]) if len(args)>2 else 1
+    compressors = get_compressors(level)
+    print("compressors: %s, level=%i" % (", ".join(compressors.keys()), level))
+    for encoder in get_enabled_encoders():
+        if encoder=="none":
+            continue
+        encode = get_encoder(encoder)
+        times = dict((name, 0) for name in compressors)
+        ratios = dict((name, []) for name in compressors)
+        for packet in PACKETS:
+            data = encode(packet)[0]
+            for name, (elapsed, ratio) in test_compress(compressors, data, N).items():
+                print("%-16s encoded with %-8s compressed %6i times with %-10s in %.3f seconds, ratio=%.2f" % (
+                    packet[0], encoder, N, name, elapsed, ratio))
+                times[name] += elapsed
+                ratios[name].append(ratio)
+        print("summary for %s:" % encoder)
+        for name in compressors:
+            print("  %-10s total time: %.3f seconds, average ratio: %.2f" % (
+                name, times[name], sum(ratios[name])/len(ratios[name])))
+        print("")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
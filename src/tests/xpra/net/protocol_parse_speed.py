@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2020 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+"""
+Measures how fast the protocol parse thread can extract packets
+from the network buffers, for large and small packet mixes.
+"""
+
+import os
+import sys
+from queue import Queue
+
+from xpra.os_util import monotonic_time
+from xpra.net.protocol import Protocol
+from xpra.net.bytestreams import Connection
+from xpra.net.compression import Compressed
+from xpra.net import packet_encoding, compression
+from xpra.queue_scheduler import QueueScheduler
+
+
+def make_protocol(process_packet_cb=None):
+    conn = Connection("local", "tcp", {})
+    p = Protocol(QueueScheduler(), conn, process_packet_cb or (lambda *_args : None))
+    for e in ("rencode", "bencode"):
+        if e in packet_encoding.ENCODERS:
+            p.enable_encoder(e)
+            break
+    for c in ("lz4", "zlib"):
+        if compression.use(c):
+            p.enable_compressor(c)
+            break
+    return p
+
+def make_packets(pixel_data_size, count):
+    packets = []
+    for i in range(count):
+        packets.append(("ping", 100, 200, 300, i))
+        if pixel_data_size:
+            pixel_data = os.urandom(pixel_data_size)
+            packets.append(("draw", 100, 100, 640, 480, Compressed("pixel-data", pixel_data), {}))
+        else:
+            packets.append(("pointer-position", 1, (100, 200), ["mod1"], [1]))
+    return packets
+
+def encode_packets(packets):
+    p = make_protocol()
+    data = []
+    def raw_write(_packet_type, items, *_args):
+        data.extend(items)
+    p.raw_write = raw_write
+    for packet in packets:
+        p._add_packet_to_queue(packet)
+    return b"".join(data)
+
+def parse(data, read_size, npackets):
+    parsed = []
+    def process_packet_cb(_proto, packet):
+        parsed.append(packet[0])
+    p = make_protocol(process_packet_cb)
+    p.idle_add = lambda *_args : None
+    #split the data like the network layer would:
+    p._read_queue = Queue()
+    for i in range(0, len(data), read_size):
+        p._read_queue.put(data[i:i+read_size])
+    p._read_queue.put(None)
+    start = monotonic_time()
+    p.do_read_parse_thread_loop()
+    elapsed = monotonic_time()-start
+    assert len(parsed)==npackets, "expected %i packets but got %i" % (npackets, len(parsed))
+    return elapsed
+
+def test_mix(name, pixel_data_size, count, runs=5):
+    packets = make_packets(pixel_data_size, count)
+    data = encode_packets(packets)
+    print("* %s: %i packets, %iKB" % (name, len(packets), len(data)//1024))
+    for read_size in (4096, 65536, 1024*1024):
+        elapsed = min(parse(data, read_size, len(packets)) for _ in range(runs))
+        print(" - %8i bytes per read: %8iMB/s" % (read_size, len(data)/elapsed//1024//1024))
+
+def main():
+    print("packet encoder=%s, compressor=%s" % (make_protocol().encoder, make_protocol().compressor))
+    test_mix("small packets", 0, 5000)
+    test_mix("large packets", 1024*1024, 20)
+    test_mix("mixed packets", 16*1024, 500)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
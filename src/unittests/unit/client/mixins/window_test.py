@@ -31,6 +31,7 @@ class WindowManagerTest(ClientMixinTest):
 			opts.min_size = "100x100"
 			opts.max_size = "2000x2000"
 			opts.pixel_depth = 24
+			opts.decode_threads = 2
 			opts.windows = True
 			opts.window_close = "forward"
 			opts.modal_windows = True
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2020 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+import os
+import unittest
+
+from xpra.codecs.argb.argb import alpha_fill  #@UnresolvedImport
+
+
+class ARGBTest(unittest.TestCase):
+
+    def test_alpha_fill(self):
+        pixels = os.urandom(4*1024)
+        for index in range(4):
+            for value in (0, 0x80, 0xff):
+                filled = bytes(alpha_fill(pixels, index, value))
+                assert len(filled)==len(pixels)
+                for i in range(4):
+                    if i==index:
+                        assert filled[i::4]==bytes((value, ))*1024
+                    else:
+                        #the other channels are unchanged:
+                        assert filled[i::4]==pixels[i::4]
+        #the default value is opaque, and the input is not modified:
+        src = bytearray(b"\1\2\3\4\5\6\7\x08")
+        assert bytes(alpha_fill(src, 3))==b"\1\2\3\xff\5\6\7\xff"
+        assert src==bytearray(b"\1\2\3\4\5\6\7\x08")
+        assert bytes(alpha_fill(memoryview(bytes(src)), 0, 0))==b"\0\2\3\4\0\6\7\x08"
+
+    def test_alpha_fill_invalid(self):
+        assert alpha_fill(b"", 3) is None
+        for index in (-1, 4, 100):
+            with self.assertRaises(AssertionError):
+                alpha_fill(b"\0"*8, index)
+        #not a multiple of 4:
+        with self.assertRaises(AssertionError):
+            alpha_fill(b"\0"*7, 0)
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2020 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+import time
+import unittest
+
+from xpra.codecs.video_pool import VideoPool, get_pool_class
+
+
+class FakeInstance:
+    def __init__(self, can_restart=True):
+        self.closed = False
+        self.can_restart = can_restart
+        self.restarts = 0
+
+    def is_closed(self):
+        return self.closed
+
+    def clean(self):
+        self.closed = True
+
+class FakeEncoder(FakeInstance):
+    def restart(self):
+        self.restarts += 1
+        return self.can_restart
+
+
+class TestVideoPool(unittest.TestCase):
+
+    def test_reuse(self):
+        pool = VideoPool(4, 10)
+        key = ("encoder", "x264", "h264", "YUV420P", 640, 480)
+        assert pool.get(key) is None
+        ve = FakeEncoder()
+        pool.add(key, ve)
+        assert pool.release(ve)
+        assert ve.restarts==1 and not ve.closed
+        #only for the same key:
+        assert pool.get(key[:-1]+(482,)) is None
+        assert pool.get(key) is ve
+        assert pool.get(key) is None
+        info = pool.get_info()
+        assert info["hits"]==1 and info["misses"]==3
+        assert info["in-use"]==1 and info["idle"]==0
+        #converters don't need to be restarted:
+        csce = FakeInstance()
+        pool.add(("csc", ), csce)
+        assert pool.release(csce)
+        #not pooled, the caller cleans them:
+        assert not pool.release(FakeEncoder())
+        broken = FakeEncoder(False)
+        pool.add(key, broken)
+        assert not pool.release(broken)
+        closed = FakeInstance()
+        pool.add(key, closed)
+        closed.clean()
+        assert not pool.release(closed)
+        pool.cleanup()
+        assert csce.closed
+        assert not pool.release(ve)
+
+    def test_limits(self):
+        pool = VideoPool(2, 0.1)
+        instances = []
+        for i in range(3):
+            ve = FakeEncoder()
+            pool.add(i, ve)
+            instances.append(ve)
+        for ve in instances:
+            assert pool.release(ve)
+        #the oldest one was evicted:
+        assert instances[0].closed
+        assert pool.get(0) is None
+        time.sleep(0.2)
+        pool.expire()
+        assert all(ve.closed for ve in instances)
+        assert pool.get_info()["expired"]==2
+        assert pool.get(1) is None
+
+    def test_pool_class(self):
+        assert get_pool_class(0)==get_pool_class(1)
+        assert get_pool_class(0)!=get_pool_class(100)
+        assert get_pool_class(150)==get_pool_class(100)
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
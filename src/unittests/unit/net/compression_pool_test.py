@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2020 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+import os
+import unittest
+
+from xpra.net import compression
+from xpra.net.compression_pool import CompressionPool
+
+
+class TestCompressionPool(unittest.TestCase):
+
+    def test_blocks(self):
+        pool = CompressionPool(threads=2, block_size=1024)
+        try:
+            compress = compression.get_compressor("zlib")
+            data = os.urandom(1000)*10
+            blocks = pool.compress_blocks(compress, data, 1)
+            assert len(blocks)==10, "expected 10 blocks but got %i" % len(blocks)
+            #the blocks are independent, the peer decompresses and concatenates them:
+            assert b"".join(compression.decompress(cdata, level) for level, cdata in blocks)==data
+            #small payloads are compressed in one go:
+            assert len(pool.compress_blocks(compress, data[:1024], 1))==1
+            assert pool.get_info()
+        finally:
+            pool.cleanup()
+
+    def test_error(self):
+        pool = CompressionPool(threads=1, block_size=16)
+        def fail(_data, _level):
+            raise ValueError("test")
+        try:
+            pool.compress_blocks(fail, b"0"*64, 1)
+        except ValueError:
+            pass
+        else:
+            raise Exception("compression error should have been raised")
+        finally:
+            pool.cleanup()
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
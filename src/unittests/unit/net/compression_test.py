@@ -4,6 +4,7 @@
 # Xpra is released under the terms of the GNU GPL v2, or, at your option, any
 # later version. See the file COPYING for details.
 
+import struct
 import unittest
 
 from xpra.net import compression
@@ -60,7 +61,7 @@ class TestCompression(unittest.TestCase):
             pass
         else:
             raise Exception("should not be able to use the wrapper without enabling a compressor")
-        for x in ("lz4", "lzo", "brotli", "zlib", "none"):
+        for x in ("lz4", "lzo", "brotli", "zlib", "zstd", "none"):
             if not compression.use(x):
                 continue
             kwargs = {x : True}
@@ -90,6 +91,89 @@ class TestCompression(unittest.TestCase):
                         print("error decompressing %s - generated with settings: %s" % (v, kwargs))
                         raise
 
+    def test_zstd_dictionary(self):
+        if not compression.use("zstd"):
+            return
+        packet = b"pointer-position" + b"mod2"*4 + b"button-action"
+        #packets compressed without a dictionary can always be decompressed:
+        level, data = compression.get_compressor("zstd")(packet, 1)
+        assert compression.get_compression_type(level)=="zstd"
+        assert compression.decompress(data, level)==packet
+        #using the built-in dictionary:
+        builtin = compression.ZstdContext(builtin=True)
+        level, data = builtin.compress(packet, 1)
+        assert compression.decompress(data, level)==packet
+        assert compression.ZstdContext().decompress(data)==packet
+
+    def test_zstd_size(self):
+        if not compression.use("zstd"):
+            return
+        #a frame header declaring a content size larger than the limit:
+        data = b"\x28\xb5\x2f\xfd\xe0" + struct.pack(b"<Q", compression.MAX_SIZE+1) + b"\x01\x00\x00"
+        level = compression.ZSTD_FLAG | 1
+        with self.assertRaises(compression.InvalidCompressionException):
+            compression.decompress(data, level)
+
+    def test_zstd_training(self):
+        if not compression.use("zstd"):
+            return
+        sender = compression.ZstdContext(train_samples=200)
+        receiver = compression.ZstdContext(receive=True)
+        packets = [b"damage-sequence %i window=%i size=%ix%i" % (i, i%5, i*3, i*7) for i in range(200)]
+        for packet in packets:
+            assert not sender.should_train()
+            sender.compress(packet, 1)
+        assert sender.should_train()
+        dictionary = sender.train()
+        if not dictionary:
+            #not enough samples for this version of zstd
+            return
+        assert not sender.should_train()
+        #packets sent before the peer has the dictionary:
+        level, data = sender.compress(packets[0], 1)
+        assert receiver.decompress(data)==packets[0]
+        receiver.add_dictionary(dictionary)
+        sender.use_trained()
+        assert sender.get_info()["dictionary"].startswith("trained")
+        level, data = sender.compress(packets[1], 1)
+        assert receiver.decompress(data)==packets[1]
+        #without the dictionary, we can't decompress it:
+        try:
+            compression.ZstdContext().decompress(data)
+        except compression.InvalidCompressionException:
+            pass
+        else:
+            raise Exception("trained dictionary should be required")
+        #only accepted when negotiated:
+        with self.assertRaises(AssertionError):
+            compression.ZstdContext().add_dictionary(dictionary)
+        #and we only keep the most recent ones:
+        for i in range(4):
+            sender = compression.ZstdContext(train_samples=len(packets))
+            for packet in packets:
+                sender.compress(b"%s %i" % (packet, i), 1)
+            dictionary = sender.train()
+            if not dictionary:
+                return
+            receiver.add_dictionary(dictionary)
+        assert len(receiver.dictionaries)==compression.ZSTD_MAX_DICTIONARIES
+
+    def test_stream(self):
+        for x in compression.STREAM_COMPRESSORS:
+            if not compression.use(x):
+                continue
+            compress = compression.get_stream_compressor(x, 1)
+            decompress = compression.get_stream_decompressor(x)
+            packet = b"window-metadata title=xterm class-instance=xterm,XTerm pid=1234"
+            sizes = []
+            for i in range(5):
+                level, data = compress(packet, 1)
+                assert compression.get_compression_type(level)==x
+                sizes.append(len(data))
+                assert decompress(data)==packet, "%s stream failed at packet %i" % (x, i)
+            #the repeated packets should only reference the first one:
+            assert sizes[-1]<sizes[0], "%s stream did not use the previous packets: %s" % (x, sizes)
+
 def main():
     unittest.main()
 
@@ -5,11 +5,14 @@
 # later version. See the file COPYING for details.
 
 import os
+import time
+import hashlib
 import unittest
+import tempfile
 
 from xpra.util import typedict
 from xpra.net.file_transfer import (
-    basename, safe_open_download_file,
+    basename, safe_open_download_file, file_digest,
     FileTransferAttributes, FileTransferHandler,
     )
 
@@ -53,6 +56,75 @@ class TestVersionUtilModule(unittest.TestCase):
         assert fth.get_info()
         fth.cleanup()
 
+    def test_file_digest(self):
+        data = os.urandom(100*1000)
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(data)
+            f.flush()
+            assert file_digest(f.name).hexdigest()==hashlib.sha1(data).hexdigest()
+
+    def test_send_file_chunks(self):
+        packets = []
+        class Handler(FileTransferHandler):
+            def send(self, *parts):
+                packets.append(parts)
+            def compressed_wrapper(self, _datatype, data, level=5):
+                return data
+            def idle_add(self, fn, *args):
+                fn(*args)
+            def timeout_add(self, *_args):
+                return 0
+            def source_remove(self, *_args):
+                pass
+        data = os.urandom(10*1000+500)
+        for window in (0, 4):
+            fth = Handler()
+            fth.init_attributes("yes", "1G")
+            fth.file_chunks = 1000
+            caps = {
+                "file-transfer" : True,
+                "max-file-size" : 1024*1024*1024,
+                "file-chunks"   : 1000,
+                }
+            if window:
+                caps["file-chunks-window"] = window
+            fth.parse_file_transfer_caps(typedict(caps))
+            with tempfile.NamedTemporaryFile() as f:
+                f.write(data)
+                f.flush()
+                for file_data in (None, data):
+                    packets[:] = []
+                    assert fth.send_file(f.name, "", file_data, len(data))
+                    #the digest may be calculated from a separate thread:
+                    for _ in range(100):
+                        if packets:
+                            break
+                        time.sleep(0.1)
+                    packet = packets[0]
+                    assert packet[0]=="send-file"
+                    options = packet[7]
+                    assert options["sha1"]==hashlib.sha1(data).hexdigest()
+                    chunk_id = options["file-chunk-id"]
+                    #ack the chunks in the order they are received:
+                    received = b""
+                    chunk = 0
+                    acks = [0]
+                    max_in_flight = 0
+                    while acks:
+                        count = len(packets)
+                        fth._process_ack_file_chunk(["ack-file-chunk", chunk_id, True, "", acks.pop(0)])
+                        for packet in packets[count:]:
+                            chunk += 1
+                            assert packet[:3]==("send-file-chunk", chunk_id, chunk)
+                            received += packet[3]
+                            acks.append(chunk)
+                        max_in_flight = max(max_in_flight, len(acks))
+                    assert received==data
+                    assert chunk==11
+                    assert max_in_flight==(window or 1), "expected %i chunks in flight but got %i" % (window or 1, max_in_flight)
+                    assert not fth.send_chunks_in_progress
+            fth.cleanup()
+
 
 def main():
     unittest.main()
@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2020 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+import os
+import mmap
+import unittest
+from ctypes import c_uint32
+
+from xpra.net.mmap_pipe import mmap_write, mmap_read
+
+
+class TestMmapPipe(unittest.TestCase):
+
+    def test_write_read(self):
+        size = 4096
+        area = mmap.mmap(-1, size)
+        try:
+            #enough writes to wrap around the end of the area:
+            for i in range(20):
+                data = os.urandom(300+i*37)
+                chunks, free = mmap_write(area, size, data)
+                assert chunks, "failed to write %i bytes" % len(data)
+                assert free>0
+                assert bytes(mmap_read(area, *chunks))==data
+            #the pixel buffers we get from the images are not bytes:
+            pixels = (c_uint32*100)(*range(100))
+            chunks = mmap_write(area, size, pixels)[0]
+            assert bytes(mmap_read(area, *chunks))==bytes(pixels)
+            #too big for the area:
+            assert mmap_write(area, size, b"0"*size)[0] is None
+        finally:
+            area.close()
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -6,14 +6,18 @@
 
 import os
 import time
+import socket
 import unittest
+from threading import Event
 from gi.repository import GLib
 
 from xpra.util import csv, envint, envbool
-from xpra.os_util import monotonic_time
+from xpra.os_util import monotonic_time, bytestostr
 from xpra.net.protocol import Protocol, verify_packet
-from xpra.net.bytestreams import Connection
-from xpra.net.compression import Compressed
+from xpra.net.bytestreams import Connection, SocketConnection
+from xpra.net.compression import Compressed, Compressible
+from xpra.net.compression_pool import COMPRESS_BLOCK_SIZE
+from xpra.net.header import FLAGS_STREAM, FLAGS_STREAM_RESET
 from xpra.log import Logger
 
 log = Logger("network")
@@ -249,6 +253,94 @@ class ProtocolTest(unittest.TestCase):
         print("%-9s packets formatted per second:\t\t%i" % (protocol.TYPE, int(n_packets/elapsed)))
         assert conn.write_data
 
+    def test_stream_reset(self):
+        sender = self.make_memory_protocol()
+        receiver = self.make_memory_protocol()
+        sender.compression_level = 1
+        packet = ("window-metadata", "title=xterm class-instance=xterm,XTerm pid=1234"*10)
+        for _ in range(2):
+            #ie: the caps are applied again, so the sender starts a new stream:
+            sender.enable_compressor("zlib", True)
+            for i in range(3):
+                chunks = sender.encode(packet)
+                assert len(chunks)==1
+                proto_flags, _, level, data = chunks[0]
+                assert proto_flags & FLAGS_STREAM
+                #only the first chunk of each stream resets the decompressor:
+                reset = proto_flags & FLAGS_STREAM_RESET
+                assert bool(reset)==(i==0)
+                assert receiver.stream_decompress(data, level, reset)
+
+    def test_bulk_order(self):
+        p = self.make_memory_protocol()
+        p.enable_compressor("zlib")
+        p.compression_level = 1
+        p.compression_blocks = True
+        sent = []
+        def raw_write(packet_type, *_args):
+            sent.append(bytestostr(packet_type))
+        p.raw_write = raw_write
+        #hold the bulk thread until all the packets are queued:
+        release = Event()
+        encode = p.encode
+        def slow_encode(packet):
+            if packet[0]=="bulk":
+                release.wait(TIMEOUT)
+            return encode(packet)
+        p.encode = slow_encode
+        bulk = ("bulk", Compressible("bulk", os.urandom(COMPRESS_BLOCK_SIZE*2)))
+        assert p.is_bulk(bulk)
+        p._add_packet_to_queue(bulk)
+        p._add_packet_to_queue(("cursor", 1))
+        #only the latency sensitive packet can overtake the bulk packet:
+        assert sent==["cursor"], "unexpected packets sent: %s" % (sent,)
+        p._add_packet_to_queue(("new-window", 1))
+        p._add_packet_to_queue(("draw", 1))
+        p._add_packet_to_queue(("window-metadata", 1))
+        #but not the packets queued behind it:
+        assert sent==["cursor"], "unexpected packets sent: %s" % (sent,)
+        release.set()
+        start = monotonic_time()
+        while len(sent)<5 and monotonic_time()-start<TIMEOUT:
+            time.sleep(0.01)
+        assert sent==["cursor", "bulk", "new-window", "draw", "window-metadata"], "invalid packet order: %s" % (sent,)
+        #nothing pending, so packets are sent directly again:
+        p._add_packet_to_queue(("lost-window", 2))
+        assert sent[-1]=="lost-window"
+        p.close()
+
+    def test_write_batch(self):
+        s1, s2 = socket.socketpair()
+        try:
+            conn = SocketConnection(s1, "local", "remote", "test", "socket")
+            p = self.protocol_class(GLib, conn, noop)
+            positions = []
+            def start_cb(pos):
+                positions.append(("start", pos))
+            def end_cb(pos):
+                positions.append(("end", pos))
+            batch = (
+                ((b"a"*10, b"b"*20), start_cb, end_cb, None, True, False),
+                ((memoryview(b"c"*30), ), start_cb, end_cb, None, True, False),
+                ((b"d"*40, b"", b"e"*50), start_cb, end_cb, None, True, False),
+                )
+            assert p.write_batch_items(batch)
+            expected = b"a"*10+b"b"*20+b"c"*30+b"d"*40+b"e"*50
+            data = b""
+            while len(data)<len(expected):
+                data += s2.recv(4096)
+            assert data==expected
+            assert positions==[("start", 0), ("start", 30), ("start", 60),
+                               ("end", 30), ("end", 60), ("end", 150)], "invalid positions: %s" % (positions,)
+            assert p.output_packetcount==3
+            if conn.vectored_writes:
+                #all the buffers were sent using a single call:
+                assert conn.output_writecount==1
+            assert p.get_info()["output"]["syscalls-per-packet"]<=2
+        finally:
+            s1.close()
+            s2.close()
+
 
 try:
     from xpra.net.websockets.protocol import WebSocketProtocol
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2020 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+import os
+import unittest
+
+from xpra.os_util import monotonic_time
+from xpra.net.bytestreams import Connection
+from xpra.net.udp_protocol import (
+    UDPProtocol, PacingController, _header_struct, _header_size,
+    fec_parity, fec_recover, fec_group_size, gso_batches,
+    FEC_MIN_LOSS, GSO_MAX_SEGMENTS,
+    )
+
+
+class FakeScheduler:
+    def timeout_add(self, *_args):
+        return 0
+    def idle_add(self, *_args):
+        return 0
+    def source_remove(self, *_args):
+        pass
+
+
+class MemoryConnection(Connection):
+    def __init__(self):
+        super().__init__("local", "udp", {})
+        self.write_data = []
+
+    def write(self, buf):
+        self.write_data.append(buf)
+        return len(buf)
+
+
+def noop(*_args):
+    pass
+
+
+class TestUDPProtocol(unittest.TestCase):
+
+    def test_fec_helpers(self):
+        chunks = [os.urandom(100), os.urandom(100), os.urandom(37)]
+        parity = fec_parity(chunks, 100, 4)
+        for i, chunk in enumerate(chunks):
+            others = [x for j, x in enumerate(chunks) if j!=i]
+            assert fec_recover(parity, others)==chunk
+        assert fec_group_size(0)==0
+        assert fec_group_size(FEC_MIN_LOSS)>0
+        assert fec_group_size(1000)>0
+
+    def test_gso_batches(self):
+        datagrams = [b"0"*100]*(GSO_MAX_SEGMENTS+10) + [b"1"*50] + [b"2"*120]*3
+        batches = list(gso_batches(datagrams))
+        assert sum(batches, [])==datagrams
+        for batch in batches:
+            assert len(batch)<=GSO_MAX_SEGMENTS
+            assert all(len(x)==len(batch[0]) for x in batch[:-1])
+            assert len(batch[-1])<=len(batch[0])
+
+    def test_fec_repair(self):
+        conn = MemoryConnection()
+        sender = UDPProtocol(FakeScheduler(), conn, noop)
+        sender.fec = True
+        sender.loss = 100
+        data = os.urandom(10000)
+        sender.write_buf(0, data, None, True)
+        datagrams = conn.write_data
+        assert sender.fec_sent>0
+        #drop one of the data chunks:
+        chunks = _header_struct.unpack_from(datagrams[0])[-1]
+        assert len(datagrams)>chunks
+        received = []
+        receiver = UDPProtocol(FakeScheduler(), MemoryConnection(), noop)
+        receiver._read_queue_put = received.append
+        for i, udp_data in enumerate(datagrams):
+            if i==1:
+                continue
+            values = _header_struct.unpack_from(udp_data)
+            receiver.process_udp_data(*values, udp_data[_header_size:], None)
+        assert received==[data]
+        assert receiver.fec_recovered==1
+        sender.close()
+        receiver.close()
+
+    def test_pacing(self):
+        pacer = PacingController()
+        #nothing measured yet, so no pacing:
+        assert not pacer.update(0)
+        assert pacer.rate==0
+        pacer.wait(1000000)
+        for i in range(5):
+            pacer.record_rtt(0.010, i)
+            pacer.record_delivery(i*1000000, i)
+        assert pacer.bandwidth==1000000
+        #no congestion, no pacing:
+        assert not pacer.update(0)
+        assert pacer.rate==0
+        #the round trip time goes up:
+        for i in range(10):
+            pacer.record_rtt(0.100, 5)
+        assert pacer.update(0)
+        assert 0<pacer.rate<pacer.bandwidth
+        #loss:
+        pacer.record_rtt(0.010, 6)
+        pacer.srtt = pacer.min_rtt
+        assert pacer.update(1000)
+        #spread the chunks over time:
+        start = monotonic_time()
+        for _ in range(10):
+            pacer.wait(pacer.rate//200)
+        assert monotonic_time()-start>=0.04
+        #recovery: ramp up until we stop pacing
+        rates = []
+        while pacer.rate and len(rates)<100:
+            rates.append(pacer.rate)
+            assert not pacer.update(0)
+        assert pacer.rate==0
+        assert rates==sorted(rates)
+
+    def test_pacing_bursty(self):
+        pacer = PacingController()
+        now = 0
+        delivered = 0
+        def ack(nbytes, duration, inflight):
+            nonlocal now, delivered
+            app_limited = pacer.is_app_limited(inflight)
+            now += duration
+            delivered += nbytes
+            pacer.record_rtt(0.010, now)
+            pacer.record_delivery(delivered, now, app_limited)
+            return pacer.update(0)
+        #a busy period measures the link at 10MB/s:
+        for _ in range(5):
+            assert not ack(1000000, 0.1, 1000000)
+        assert pacer.bandwidth==10000000
+        #then an idle terminal, acking 40KB/s for a long time:
+        for _ in range(100):
+            assert not ack(4000, 0.1, 1000)
+        #which must not lower the bandwidth estimate:
+        assert pacer.bandwidth==10000000
+        assert pacer.rate==0
+        #a 4MB burst goes out without any pacing:
+        start = monotonic_time()
+        for _ in range(4*1024*1024//65536):
+            pacer.wait(65536)
+        assert monotonic_time()-start<0.1
+        #congestion paces close to the real bandwidth, not the idle rate:
+        pacer.record_rtt(1, now)
+        assert pacer.update(0)
+        assert pacer.rate>=pacer.bandwidth//2
+        #even at a very low rate, each wait only sleeps for a few ms:
+        pacer.rate = 1024
+        for _ in range(5):
+            start = monotonic_time()
+            pacer.wait(65536)
+            assert monotonic_time()-start<0.05
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2020 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+import os
+import zlib
+import unittest
+
+from xpra.net.bytestreams import Connection
+from xpra.queue_scheduler import QueueScheduler
+from xpra.net.websockets.header import encode_hybi_header
+from xpra.net.websockets.common import negotiate_deflate, get_deflate_response
+try:
+    from xpra.net.websockets.protocol import WebSocketProtocol, OPCODE_BINARY, OPCODE_CONTINUE
+    from xpra.codecs.xor.cyxor import hybi_mask
+except ImportError:
+    WebSocketProtocol = None
+
+
+def make_frame(opcode, payload, mask=False, fin=True, rsv1=False):
+    header = encode_hybi_header(opcode, len(payload), mask, fin, rsv1)
+    if not mask:
+        return header+payload
+    key = os.urandom(4)
+    return header+key+bytes(hybi_mask(key, payload))
+
+def deflate(data):
+    c = zlib.compressobj(1, zlib.DEFLATED, -15)
+    data = c.compress(data)+c.flush(zlib.Z_SYNC_FLUSH)
+    assert data.endswith(b"\0\0\xff\xff")
+    return data[:-4]
+
+
+class WebSocketProtocolTest(unittest.TestCase):
+
+    def make_protocol(self, deflate_bits=0):
+        conn = Connection("local", "ws", {}, {"permessage-deflate" : deflate_bits})
+        p = WebSocketProtocol(QueueScheduler(), conn, None)
+        received = []
+        p._read_queue_put = lambda buf : received.append(bytes(buf))
+        return p, received
+
+    def check_parse(self, frames, expected, deflate_bits=0):
+        data = b"".join(frames)
+        #feed the data using various read sizes:
+        for read_size in (1, 3, 7, 100, 4096, len(data)):
+            p, received = self.make_protocol(deflate_bits)
+            for i in range(0, len(data), read_size):
+                p.parse_ws_frame(data[i:i+read_size])
+            assert received==expected, "read size %i: expected %s but got %s" % (read_size, expected, received)
+            assert not p.ws_data
+
+    def test_frames(self):
+        payloads = [os.urandom(size) for size in (0, 1, 125, 126, 1000, 70000)]
+        for mask in (False, True):
+            frames = [make_frame(OPCODE_BINARY, payload, mask) for payload in payloads]
+            self.check_parse(frames, [bytes(payload) for payload in payloads])
+
+    def test_fragmented(self):
+        payload = os.urandom(10000)
+        for mask in (False, True):
+            frames = [
+                make_frame(OPCODE_BINARY, payload[:1], mask, False),
+                make_frame(OPCODE_CONTINUE, payload[1:4000], mask, False),
+                make_frame(OPCODE_CONTINUE, b"", mask, False),
+                make_frame(OPCODE_CONTINUE, payload[4000:], mask, True),
+                make_frame(OPCODE_BINARY, b"after", mask),
+                ]
+            self.check_parse(frames, [payload, b"after"])
+
+    def test_deflate(self):
+        payload = b"hello"*1000
+        compressed = deflate(payload)
+        frames = [
+            make_frame(OPCODE_BINARY, compressed, True, rsv1=True),
+            make_frame(OPCODE_BINARY, compressed[:10], False, False, rsv1=True),
+            make_frame(OPCODE_CONTINUE, compressed[10:], False, True),
+            make_frame(OPCODE_BINARY, b"plain", True),
+            ]
+        self.check_parse(frames, [payload, payload, b"plain"], 15)
+        #compressed frames are invalid if deflate was not negotiated:
+        p = self.make_protocol(0)[0]
+        with self.assertRaises(Exception):
+            p.parse_ws_frame(frames[0])
+
+    def test_deflate_round_trip(self):
+        sender = self.make_protocol(15)[0]
+        receiver, received = self.make_protocol(15)
+        for packet_type, data in (
+            ("hello", b"x"*1000),
+            ("draw", b"y"*1000),
+            ("ping", b"z"*10),
+            ):
+            items = [data[:100], data[100:]]
+            header = sender.make_wsframe_header(packet_type, items)
+            receiver.parse_ws_frame(header+b"".join(bytes(item) for item in items))
+            assert received[-1]==data
+        assert sender.ws_deflated==1
+        assert receiver.ws_inflated==1
+
+    def test_negotiation(self):
+        assert negotiate_deflate(None)==(0, None)
+        assert negotiate_deflate("x-webkit-deflate-frame")==(0, None)
+        bits, response = negotiate_deflate("permessage-deflate; client_max_window_bits")
+        assert bits==15
+        assert get_deflate_response(response)==15
+        bits, response = negotiate_deflate("permessage-deflate; unknown, permessage-deflate; server_max_window_bits=10")
+        assert bits==10
+        assert "server_max_window_bits=10" in response
+        assert negotiate_deflate("permessage-deflate; server_max_window_bits=8")==(0, None)
+        assert negotiate_deflate("permessage-deflate; server_max_window_bits=16")==(0, None)
+        assert get_deflate_response(None)==0
+        with self.assertRaises(Exception):
+            get_deflate_response("permessage-deflate")
+
+
+def main():
+    if WebSocketProtocol:
+        unittest.main()
+
+if __name__ == '__main__':
+    main()
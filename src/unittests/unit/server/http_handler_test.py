@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2020 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+import os
+import gzip
+import socket
+import shutil
+import tempfile
+import unittest
+
+from xpra.server.http_handler import HTTPRequestHandler
+
+
+def http_request(web_root, path, headers=None):
+    s1, s2 = socket.socketpair()
+    try:
+        request = "GET %s HTTP/1.1\r\n" % path
+        for k,v in (headers or {}).items():
+            request += "%s: %s\r\n" % (k, v)
+        request += "\r\n"
+        s1.sendall(request.encode())
+        #the request is handled from the constructor:
+        HTTPRequestHandler(s2, ("127.0.0.1", 10000), web_root=web_root, http_headers_dir="/nonexistent")
+        s2.close()
+        response = b""
+        while True:
+            data = s1.recv(65536)
+            if not data:
+                break
+            response += data
+    finally:
+        s1.close()
+    head, body = response.split(b"\r\n\r\n", 1)
+    lines = head.decode().split("\r\n")
+    code = int(lines[0].split(" ")[1])
+    response_headers = {}
+    for line in lines[1:]:
+        k, v = line.split(": ", 1)
+        response_headers[k.lower()] = v
+    return code, response_headers, body
+
+
+class TestHTTPHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.web_root = tempfile.mkdtemp()
+        HTTPRequestHandler.content_cache.clear()
+        HTTPRequestHandler.content_cache_size = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.web_root)
+
+    def test_compressed_cache(self):
+        content = b"var foo = 'bar';\n"*1000
+        with open(os.path.join(self.web_root, "client.js"), "wb") as f:
+            f.write(content)
+        code, headers, body = http_request(self.web_root, "/client.js", {"Accept-Encoding" : "gzip, deflate"})
+        assert code==200
+        assert headers.get("content-encoding")=="gzip"
+        assert gzip.decompress(body)==content
+        etag = headers.get("etag")
+        assert etag
+        assert len(HTTPRequestHandler.content_cache)==1
+        #same request, served from the cache:
+        code, headers, body2 = http_request(self.web_root, "/client.js", {"Accept-Encoding" : "gzip"})
+        assert code==200 and body2==body and headers.get("etag")==etag
+        assert len(HTTPRequestHandler.content_cache)==1
+        #without compression:
+        code, headers, body = http_request(self.web_root, "/client.js")
+        assert code==200 and body==content
+        assert "content-encoding" not in headers
+        assert headers.get("etag")!=etag
+        assert len(HTTPRequestHandler.content_cache)==2
+        #conditional request:
+        code, headers, body = http_request(self.web_root, "/client.js",
+                                           {"Accept-Encoding" : "gzip", "If-None-Match" : etag})
+        assert code==304 and not body
+        assert headers.get("etag")==etag
+        #modified file:
+        with open(os.path.join(self.web_root, "client.js"), "wb") as f:
+            f.write(content+b"//")
+        os.utime(os.path.join(self.web_root, "client.js"), (0, 0))
+        code, headers, body = http_request(self.web_root, "/client.js",
+                                           {"Accept-Encoding" : "gzip", "If-None-Match" : etag})
+        assert code==200
+        assert gzip.decompress(body)==content+b"//"
+        #the stale entries have been removed:
+        assert len(HTTPRequestHandler.content_cache)==1
+
+    def test_not_found(self):
+        code = http_request(self.web_root, "/notfound.html")[0]
+        assert code==404
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -23,6 +23,7 @@ class EncodingMixinTest(ServerMixinTest):
         opts.speed = 0
         opts.min_speed = 20
         opts.video_scaling = "auto"
+        opts.encode_threads = 2
         opts.video_encoders = []
         opts.csc_modules = []
         self._test_mixin_class(EncodingServer, opts, {
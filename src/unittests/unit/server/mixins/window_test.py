@@ -17,6 +17,7 @@ class WebcamMixinTest(ServerMixinTest):
         opts = AdHocStruct()
         opts.min_size = "10x10"
         opts.max_size = "16384x8192"
+        opts.sharing = None
         def load_existing_windows():
             pass
         def _WindowServer():
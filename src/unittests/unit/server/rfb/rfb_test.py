@@ -5,16 +5,56 @@
 # later version. See the file COPYING for details.
 
 
+import zlib
+import struct
 import unittest
 
 from xpra.util import AdHocStruct
+from xpra.os_util import memoryview_to_bytes
 from xpra.codecs.image_wrapper import ImageWrapper
-from xpra.server.rfb.rfb_source import RFBSource
+from xpra.server.rfb.rfb_const import RFBEncoding
+from xpra.server.rfb import rfb_source
+from xpra.server.rfb.rfb_source import RFBSource, ZRLE_TILE_SIZE
 
 def noop(*_args):
     pass
 
 
+class Timers:
+
+    def __init__(self):
+        self.timers = {}
+        self.counter = 0
+
+    def timeout_add(self, _delay, fn, *args):
+        self.counter += 1
+        self.timers[self.counter] = (fn, args)
+        return self.counter
+
+    def source_remove(self, tid):
+        self.timers.pop(tid, None)
+
+    def run(self):
+        timers = self.timers
+        self.timers = {}
+        for fn, args in timers.values():
+            fn(*args)
+
+
+def make_window(get_image, w=1024, h=768):
+    window = AdHocStruct()
+    window.get_image = get_image
+    window.get_dimensions = lambda : (w, h)
+    window.acknowledge_changes = noop
+    return window
+
+def make_protocol(sent, queue_size=0):
+    p = AdHocStruct()
+    p.send = lambda v : sent.append(memoryview_to_bytes(v))
+    p.queue_size = lambda : queue_size
+    return p
+
+
 class TestRFB(unittest.TestCase):
 
     def test_rfb_source(self):
@@ -23,15 +63,14 @@ class TestRFB(unittest.TestCase):
         p.send = noop
         p.queue_size = lambda : 1
         #fake window:
-        window = AdHocStruct()
         def get_image(x, y, w, h):
             stride = (w+8)*4
             pixels = b"0"*stride*h
             return ImageWrapper(x, y, w, h, pixels, "BGRX", 24, stride, 4)
-        window.get_image = get_image
-        window.acknowledge_changes = noop
+        window = make_window(get_image)
+        timers = Timers()
         for protocol in (p, None):
-            s = RFBSource(protocol, True)
+            s = RFBSource(protocol, timers.timeout_add, timers.source_remove, True)
             assert s.get_info()
             s.get_window_info(())
             s.ping()
@@ -42,6 +81,8 @@ class TestRFB(unittest.TestCase):
             s.update_mouse()
             s.damage(1, window, 0, 0, 1024, 768, {"polling" : protocol is None})
             s.damage(1, window, 0, 0, 2, 2, {"polling" : protocol is None})
+            s.request_update()
+            timers.run()
             s.send_clipboard("foo")
             s.bell()
             assert not s.is_closed()
@@ -50,6 +91,209 @@ class TestRFB(unittest.TestCase):
             s.damage(1, window, 0, 0, 2, 2, {"polling" : protocol is None})
             assert s.is_closed()
 
+    def test_zrle(self):
+        sent = []
+        p = make_protocol(sent)
+        W, H = 150, 70
+        #left half is solid, the right half is not:
+        pixels = bytearray(W*H*4)
+        for y in range(H):
+            for x in range(W//2, W):
+                i = (y*W+x)*4
+                pixels[i:i+4] = bytes((x%256, y%256, (x+y)%256, 0xff))
+        pixels = bytes(pixels)
+        window = make_window(lambda x, y, w, h : ImageWrapper(x, y, w, h, pixels, "BGRX", 24, W*4, 4), W, H)
+        timers = Timers()
+        s = RFBSource(p, timers.timeout_add, timers.source_remove)
+        s.set_encodings((RFBEncoding.ZRLE, RFBEncoding.RAW, RFBEncoding.DESKTOPSIZE))
+        assert s.encoding==RFBEncoding.ZRLE
+        assert s.get_info()["encoding"]=="ZRLE"
+        decompressor = zlib.decompressobj()
+        for _ in range(2):
+            sent[:] = []
+            s.damage(1, window, 0, 0, W, H)
+            s.request_update()
+            timers.run()
+            data = b"".join(sent)
+            _, _, nrects = struct.unpack(b"!BBH", data[:4])
+            assert nrects==1
+            x, y, w, h, encoding, l = struct.unpack(b"!HHHHiI", data[4:20])
+            assert (x, y, w, h, encoding)==(0, 0, W, H, RFBEncoding.ZRLE)
+            assert len(data)==20+l
+            #decode the tiles and compare with the source pixels:
+            tiles = decompressor.decompress(data[20:])
+            pos = 0
+            T = ZRLE_TILE_SIZE
+            for ty in range(0, H, T):
+                th = min(T, H-ty)
+                for tx in range(0, W, T):
+                    tw = min(T, W-tx)
+                    subencoding = tiles[pos]
+                    pos += 1
+                    if subencoding==1:
+                        tile = tiles[pos:pos+3]*(tw*th)
+                        pos += 3
+                    else:
+                        assert subencoding==0
+                        tile = tiles[pos:pos+tw*th*3]
+                        pos += tw*th*3
+                    for row in range(th):
+                        start = ((ty+row)*W+tx)*4
+                        expected = bytearray(tw*3)
+                        for i in range(3):
+                            expected[i::3] = pixels[start+i:start+tw*4:4]
+                        assert tile[row*tw*3:(row+1)*tw*3]==expected
+            assert pos==len(tiles)
+        #fallback to raw:
+        s.set_encodings((RFBEncoding.HEXTILE, RFBEncoding.RAW))
+        assert s.encoding==RFBEncoding.RAW
+        sent[:] = []
+        s.damage(1, window, 0, 0, 8, 8)
+        s.request_update()
+        timers.run()
+        data = b"".join(sent)
+        assert struct.unpack(b"!HHHHi", data[4:16])==(0, 0, 8, 8, RFBEncoding.RAW)
+        assert len(data)==16+8*8*4
+
+    def test_copyrect(self):
+        if not rfb_source.ScrollData:
+            print("skipped copyrect test: no scroll detection")
+            return
+        sent = []
+        p = make_protocol(sent)
+        W, H = 200, 200
+        def lines(offset):
+            return b"".join(struct.pack(b"!I", (y+offset)*7919)*W for y in range(H))
+        frame = [lines(0)]
+        window = make_window(lambda x, y, w, h : ImageWrapper(x, y, w, h, frame[0], "BGRX", 24, W*4, 4), W, H)
+        timers = Timers()
+        s = RFBSource(p, timers.timeout_add, timers.source_remove)
+        s.set_encodings((RFBEncoding.COPYRECT, RFBEncoding.RAW))
+        assert s.copyrect
+        s.damage(1, window, 0, 0, W, H)
+        s.request_update()
+        timers.run()
+        #scroll up by 10 lines:
+        frame[0] = lines(10)
+        sent[:] = []
+        s.damage(1, window, 0, 0, W, H)
+        s.request_update()
+        timers.run()
+        data = b"".join(sent)
+        _, _, nrects = struct.unpack(b"!BBH", data[:4])
+        assert nrects==2
+        assert struct.unpack(b"!HHHHiHH", data[4:20])==(0, 0, W, H-10, RFBEncoding.COPYRECT, 0, 10)
+        assert struct.unpack(b"!HHHHi", data[20:32])==(0, H-10, W, 10, RFBEncoding.RAW)
+
+    def test_scroll_data(self):
+        instances = []
+        class FakeScrollData:
+            def __init__(self):
+                self.updates = []
+                self.invalidated = []
+                self.freed = 0
+                instances.append(self)
+            def update(self, _pixels, x, y, w, h, _rowstride, _bpp):
+                self.updates.append((x, y, w, h))
+            def calculate(self, _max_distance):
+                pass
+            def get_best_match(self):
+                return 0, 0
+            def invalidate(self, x, y, w, h):
+                self.invalidated.append((x, y, w, h))
+            def free(self):
+                self.freed += 1
+        saved = rfb_source.ScrollData
+        rfb_source.ScrollData = FakeScrollData
+        try:
+            sent = []
+            p = make_protocol(sent)
+            W, H = 400, 400
+            def get_image(x, y, w, h):
+                return ImageWrapper(x, y, w, h, b"\0"*w*h*4, "BGRX", 24, w*4, 4)
+            window = make_window(get_image, W, H)
+            timers = Timers()
+            s = RFBSource(p, timers.timeout_add, timers.source_remove)
+            s.set_encodings((RFBEncoding.COPYRECT, RFBEncoding.RAW))
+            for _ in range(3):
+                #the scrolled area and another region sent with it:
+                s.damage(1, window, 0, 0, W, 300)
+                s.damage(1, window, 0, 310, 200, 90)
+                s.request_update()
+                timers.run()
+            #the same instance keeps tracking the scrolled area:
+            assert len(instances)==1
+            sd = instances[0]
+            assert sd.updates==[(0, 0, W, 300)]*3
+            assert sd.invalidated==[(0, 310, 200, 90)]*3
+            assert sd.freed==0
+            #tracking a different area resets the reference checksums:
+            s.damage(1, window, 0, 100, W, 300)
+            s.request_update()
+            timers.run()
+            assert len(instances)==1 and sd.freed==1
+            s.close()
+        finally:
+            rfb_source.ScrollData = saved
+
+    def test_batching(self):
+        sent = []
+        queue_size = [0]
+        p = make_protocol(sent)
+        p.queue_size = lambda : queue_size[0]
+        def get_image(x, y, w, h):
+            return ImageWrapper(x, y, w, h, b"\0"*w*h*4, "BGRX", 24, w*4, 4)
+        window = make_window(get_image)
+        timers = Timers()
+        s = RFBSource(p, timers.timeout_add, timers.source_remove)
+        def get_rects():
+            data = b"".join(sent)
+            sent[:] = []
+            nrects = struct.unpack(b"!BBH", data[:4])[2]
+            rects = []
+            pos = 4
+            for _ in range(nrects):
+                x, y, w, h, encoding = struct.unpack(b"!HHHHi", data[pos:pos+12])
+                assert encoding==RFBEncoding.RAW
+                rects.append((x, y, w, h))
+                pos += 12+w*h*4
+            assert pos==len(data)
+            return rects
+        #nothing is sent until the client requests it:
+        s.damage(1, window, 0, 0, 10, 10)
+        s.damage(1, window, 500, 500, 10, 10)
+        timers.run()
+        assert not sent
+        s.request_update()
+        timers.run()
+        #two distant regions are sent as two rectangles in the same update:
+        assert sorted(get_rects())==[(0, 0, 10, 10), (500, 500, 10, 10)]
+        #regions close to each other are merged:
+        s.request_update()
+        s.damage(1, window, 0, 0, 20, 20)
+        s.damage(1, window, 10, 10, 20, 20)
+        s.damage(1, window, 20, 0, 10, 10)
+        assert len(timers.timers)==1
+        timers.run()
+        assert get_rects()==[(0, 0, 30, 30)]
+        #no request pending:
+        s.damage(1, window, 0, 0, 10, 10)
+        timers.run()
+        assert not sent
+        #the client is busy, so the damage accumulates:
+        queue_size[0] = 10
+        s.request_update()
+        s.damage(1, window, 100, 100, 10, 10)
+        timers.run()
+        assert not sent and len(timers.timers)==1
+        queue_size[0] = 0
+        timers.run()
+        assert sorted(get_rects())==[(0, 0, 10, 10), (100, 100, 10, 10)]
+        info = s.get_info()
+        assert info["damage"]["updates"]==3
+        s.close()
+        assert not timers.timers
+
 
 def main():
     unittest.main()
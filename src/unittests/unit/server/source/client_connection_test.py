@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2020 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+import os
+import time
+import mmap
+import unittest
+import threading
+
+from xpra.util import AdHocStruct
+from xpra.net.mmap_pipe import mmap_write, mmap_read
+
+
+class ClientConnectionTest(unittest.TestCase):
+
+    def _make_connection(self, encode_threads):
+        from xpra.server.source.client_connection import ClientConnection
+        protocol = AdHocStruct()
+        protocol.set_packet_source = lambda *_args : None
+        protocol.source_has_more = lambda : None
+        cc = ClientConnection(protocol, None, "test",
+                              None,
+                              "", (), False, 0, False)
+        cc.init_state()
+        cc.encode_threads = encode_threads
+        cc.run()
+        return cc
+
+    def test_encode_threads(self):
+        for n in (1, 2, 3):
+            cc = self._make_connection(n)
+            calls = {}
+            def record(wid, i):
+                #give the other threads a chance to run:
+                time.sleep(0.001)
+                calls.setdefault(wid, []).append((i, threading.current_thread()))
+            wids = (0, 1, 2, 5, 8)
+            for i in range(20):
+                for wid in wids:
+                    cc.call_in_encode_thread(True, record, wid, i, wid=wid)
+            cc.queue_encode(None)
+            for t in cc.encode_workers:
+                t.join(10)
+            assert len(cc.encode_workers)==n
+            assert cc.encode_queue_size()==0
+            for wid in wids:
+                wcalls = calls.get(wid)
+                #all calls were made, in order:
+                assert [i for i, _ in wcalls]==list(range(20)), "invalid order for wid %i: %s" % (wid, wcalls)
+                #all from the same thread:
+                assert len(set(t for _, t in wcalls))==1
+            cc.cleanup()
+
+    def test_mmap_encode_threads(self):
+        size = 1024*1024
+        area = mmap.mmap(-1, size)
+        try:
+            cc = self._make_connection(4)
+            cc.mmap_size = size
+            sent = []
+            def mmap_encode(wid, data):
+                time.sleep(0.001)
+                chunks = mmap_write(area, size, data)[0]
+                assert chunks
+                #the packet is queued from the same thread, right after writing:
+                sent.append((wid, data, chunks, threading.current_thread()))
+            wids = (1, 2)
+            for i in range(20):
+                for wid in wids:
+                    cc.call_in_encode_thread(True, mmap_encode, wid, os.urandom(1000+i), wid=wid)
+            cc.queue_encode(None)
+            for t in cc.encode_workers:
+                t.join(10)
+            assert len(sent)==40
+            #a single thread wrote to the mmap area:
+            assert len(set(t for _, _, _, t in sent))==1
+            #the packets are in ring order and none of the data was overwritten:
+            end = 0
+            for wid, data, chunks, _ in sent:
+                offset = chunks[0][0]
+                assert offset>=end, "packet for window %i at offset %i overlaps %i" % (wid, offset, end)
+                end = offset+len(data)
+                assert bytes(mmap_read(area, *chunks))==data
+            cc.cleanup()
+        finally:
+            area.close()
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
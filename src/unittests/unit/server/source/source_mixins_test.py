@@ -133,6 +133,7 @@ class SourceMixinsTest(unittest.TestCase):
             "default_min_quality"   : 10,
             "default_speed"     : 50,
             "default_min_speed"     : 10,
+            "encode_threads"    : 2,
             },
         {
             "encodings.core"     : ("rgb32", "rgb24"),
@@ -206,6 +207,9 @@ class SourceMixinsTest(unittest.TestCase):
             "get_window_id"     : get_window_id,
             "window_filters"    : (),
             "readonly"          : False,
+            "encode_cache"      : None,
+            "cursor_cache"      : None,
+            "icon_cache"        : None,
             }
 
     def test_windows(self):
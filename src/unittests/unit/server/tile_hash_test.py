@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2020 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+import unittest
+
+try:
+    from xpra.server.shadow.tile_hash import TileHash
+except ImportError:
+    TileHash = None
+
+
+def make_pixels(width, height, value=0):
+    return bytearray([value])*(width*height*4)
+
+def paint(pixels, width, x, y, w, h, value):
+    for row in range(y, y+h):
+        start = (row*width+x)*4
+        pixels[start:start+w*4] = bytes([value])*(w*4)
+
+def geoms(regions):
+    return sorted(r.get_geometry() for r in regions)
+
+
+class TestTileHash(unittest.TestCase):
+
+    def test_unchanged(self):
+        th = TileHash(64)
+        W, H = 200, 100
+        pixels = make_pixels(W, H)
+        #first update is always a full update:
+        assert geoms(th.update(pixels, W, H, W*4))==[(0, 0, W, H)]
+        assert th.update(pixels, W, H, W*4)==[]
+        #new size:
+        assert geoms(th.update(make_pixels(W, 50), W, 50, W*4))==[(0, 0, W, 50)]
+        th.invalidate()
+        assert geoms(th.update(pixels, W, H, W*4))==[(0, 0, W, H)]
+        info = th.get_info()
+        assert info["tiles"]==8 and info["updates"]==4
+
+    def test_changes(self):
+        th = TileHash(64)
+        W, H = 300, 200
+        pixels = make_pixels(W, H)
+        th.update(pixels, W, H, W*4)
+        #single pixel, in the last partial tile:
+        paint(pixels, W, 299, 199, 1, 1, 1)
+        assert geoms(th.update(pixels, W, H, W*4))==[(256, 192, 44, 8)]
+        #two tiles side by side are merged:
+        paint(pixels, W, 60, 10, 10, 10, 2)
+        assert geoms(th.update(pixels, W, H, W*4))==[(0, 0, 128, 64)]
+        #vertically adjacent runs are merged:
+        paint(pixels, W, 130, 10, 60, 100, 3)
+        assert geoms(th.update(pixels, W, H, W*4))==[(128, 0, 64, 128)]
+        #disjoint areas:
+        paint(pixels, W, 0, 0, 1, 1, 4)
+        paint(pixels, W, 200, 150, 1, 1, 4)
+        assert geoms(th.update(pixels, W, H, W*4))==[(0, 0, 64, 64), (192, 128, 64, 64)]
+        assert th.update(pixels, W, H, W*4)==[]
+
+    def test_rowstride(self):
+        th = TileHash(16)
+        W, H = 40, 40
+        stride = 48*4
+        pixels = make_pixels(48, H)
+        th.update(pixels, W, H, stride)
+        #changes in the padding are ignored:
+        paint(pixels, 48, 40, 0, 8, H, 9)
+        assert th.update(pixels, W, H, stride)==[]
+        paint(pixels, 48, 39, 39, 1, 1, 9)
+        assert geoms(th.update(pixels, W, H, stride))==[(32, 32, 8, 8)]
+
+
+def main():
+    if TileHash:
+        unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -7,6 +7,8 @@
 import unittest
 
 from xpra.util import AdHocStruct
+from xpra.os_util import monotonic_time
+from xpra.codecs.video_helper import VideoHelper
 from xpra.server.window.video_scoring import (
     get_quality_score, get_speed_score,
     get_pipeline_score, get_encoder_dimensions,
@@ -134,6 +136,77 @@ class TestVideoScoring(unittest.TestCase):
         w, h = get_encoder_dimensions(encoder_spec, 102, 102, (1, 2))
         assert w==50 and h==50
 
+    def test_pipeline_selection_cost(self):
+        #a helper with as many specs as a server with all the codecs loaded:
+        vh = VideoHelper(init=True)
+        def spec(codec_type, **kwargs):
+            s = AdHocStruct()
+            s.codec_type = codec_type
+            s.codec_class = AdHocStruct
+            s.width_mask = s.height_mask = 0xfffe
+            s.min_w = s.min_h = 16
+            s.max_w, s.max_h = 4096, 4096
+            s.quality = s.speed = 50
+            s.size_efficiency = 60
+            s.setup_cost = 20
+            s.score_boost = s.gpu_cost = 0
+            s.cpu_cost = 10
+            s.can_scale = False
+            s.has_lossless_mode = False
+            s.max_instances = 0
+            s.get_runtime_factor = lambda : 1
+            s.__dict__.update(kwargs)
+            return s
+        csc_formats = ("YUV420P", "YUV422P", "YUV444P", "NV12", "RGB")
+        for csc_type in ("swscale", "libyuv", "cython"):
+            for fmt in csc_formats:
+                vh.add_csc_spec("BGRX", fmt, spec(csc_type, can_scale=True))
+        for encoding in ("h264", "vp8", "vp9", "h265"):
+            for encoder_type in ("x264", "vpx", "ffmpeg", "nvenc"):
+                for fmt in csc_formats+("BGRX", ):
+                    vh.add_encoder_spec(encoding, fmt, spec(encoder_type))
+        def score_all():
+            scores = []
+            for encoding in vh.get_encodings():
+                encoder_specs = vh.get_encoder_specs(encoding)
+                def add_scores(csc_spec, enc_in_format):
+                    for encoder_spec in encoder_specs.get(enc_in_format, ()):
+                        v = get_pipeline_score(enc_in_format, csc_spec, encoder_spec, 1920, 1080, (1, 1),
+                                               80, 0, 50, 0, None, None, 0, 10, True)
+                        if v:
+                            scores.append(v)
+                add_scores(None, "BGRX")
+                for out_csc, csc_specs in vh.get_csc_specs("BGRX").items():
+                    for csc_spec in csc_specs:
+                        add_scores(csc_spec, out_csc)
+            return sorted(scores, key=lambda x : -x[0])
+        N = 20
+        start = monotonic_time()
+        for _ in range(N):
+            scores = score_all()
+        score_time = (monotonic_time()-start)/N
+        assert scores
+        key = ("h264", 1920, 1080, "BGRX", 80, 0, 50, 0)
+        assert vh.get_cached_scores(key) is None
+        vh.set_cached_scores(key, scores)
+        start = monotonic_time()
+        for _ in range(N):
+            assert vh.get_cached_scores(key) is scores
+        cache_time = (monotonic_time()-start)/N
+        print("pipeline selection for %i options: %.1fus, from cache: %.1fus" % (
+            len(scores), score_time*1000*1000, cache_time*1000*1000))
+        assert cache_time<score_time
+        assert vh.scores_hits==N and vh.scores_misses==1
+        #runtime factors invalidate the scores:
+        limited = spec("nvenc", max_instances=2)
+        limited.get_runtime_factor = lambda : 0.5
+        vh.add_encoder_spec("h264", "BGRX", limited)
+        assert vh.get_cached_scores(key) is None
+        vh.set_cached_scores(key, scores)
+        assert vh.get_cached_scores(key) is scores
+        limited.get_runtime_factor = lambda : 0
+        assert vh.get_cached_scores(key) is None
+
 
 def main():
     unittest.main()
@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2020 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+import unittest
+
+from xpra.server.window.cursor_cache import CursorCache, get_cursor_hash
+
+
+class TestCursorCache(unittest.TestCase):
+
+    def test_hash(self):
+        pixels = b"\0"*16*16*4
+        assert get_cursor_hash(16, 16, pixels)==get_cursor_hash(16, 16, bytearray(pixels))
+        assert get_cursor_hash(16, 16, pixels)!=get_cursor_hash(8, 32, pixels)
+
+    def test_get_set(self):
+        cc = CursorCache(max_items=2)
+        assert cc.get("a", "png") is None
+        cc.set("a", "png", b"A")
+        cc.set("b", "png", b"B")
+        assert cc.get("a", "png")==b"A"
+        assert cc.get("a", "raw") is None
+        #"b" is now the least recently used:
+        cc.set("c", "png", b"C")
+        assert cc.get("b", "png") is None
+        assert cc.get("a", "png")==b"A"
+        info = cc.get_info()
+        assert info["items"]==2
+        assert info["hits"]==2 and info["misses"]==3
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2020 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+import unittest
+
+from xpra.server.window.encode_cache import EncodeCache
+
+
+def make_value(size=100):
+    return "png", b"0"*size, {"quality" : 100}, 10, 10, 40, 32
+
+
+class TestEncodeCache(unittest.TestCase):
+
+    def test_damage_sequence(self):
+        ec = EncodeCache()
+        assert ec.get_damage_sequence(1)==0
+        ec.damage(1)
+        ec.damage(1)
+        assert ec.get_damage_sequence(1)==2
+        assert ec.get_damage_sequence(2)==0
+        ec.remove_window(1)
+        assert ec.get_damage_sequence(1)==0
+
+    def test_get_set(self):
+        ec = EncodeCache()
+        ec.set_enabled(True)
+        key = (1, 0, 0, 0, 10, 10, "BGRX", "png")
+        assert ec.get(key) is None
+        ec.set(key, make_value())
+        v = ec.get(key)
+        assert v
+        #the client options are copied:
+        v[2]["flush"] = 1
+        assert "flush" not in ec.get(key)[2]
+        info = ec.get_info()
+        assert info["hits"]==2 and info["misses"]==1
+        assert info["items"]==1 and info["size"]==100
+        ec.remove_window(1)
+        assert ec.get(key) is None
+        assert ec.get_info()["size"]==0
+
+    def test_eviction(self):
+        ec = EncodeCache(max_items=4, max_size=1000)
+        ec.set_enabled(True)
+        for i in range(6):
+            ec.set((1, i), make_value())
+        #the oldest items are gone:
+        assert ec.get((1, 0)) is None
+        assert ec.get((1, 1)) is None
+        assert ec.get((1, 2))
+        #(1, 2) is now the most recently used:
+        ec.set((1, 6), make_value())
+        assert ec.get((1, 2))
+        assert ec.get((1, 3)) is None
+        #too big:
+        ec.set((2, 0), make_value(300))
+        assert ec.get((2, 0)) is None
+        #evicted by size:
+        for i in range(4):
+            ec.set((3, i), make_value(240))
+        info = ec.get_info()
+        assert info["size"]<=1000
+        assert info["evictions"]>0
+        ec.set_enabled(False)
+        assert ec.get_info()["items"]==0
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2020 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+import unittest
+
+from xpra.server.window.icon_cache import IconCache, ClientIcons, get_icon_hash
+
+
+class TestIconCache(unittest.TestCase):
+
+    def test_hash(self):
+        pixels = b"\0"*16*16*4
+        assert get_icon_hash(16, 16, "BGRA", pixels)==get_icon_hash(16, 16, "BGRA", memoryview(pixels))
+        assert get_icon_hash(16, 16, "BGRA", pixels)!=get_icon_hash(16, 16, "RGBA", pixels)
+
+    def test_get_set(self):
+        ic = IconCache(max_items=2)
+        assert ic.get("a") is None
+        ic.set("a", 16, 16, b"A")
+        ic.set("b", 32, 32, b"B")
+        assert ic.get("a")==(16, 16, b"A")
+        ic.set("c", 48, 48, b"C")
+        assert ic.get("b") is None
+        assert ic.get_info()["items"]==2
+
+    def test_client_icons(self):
+        ci = ClientIcons(2)
+        assert not ci.use("a")
+        ci.add("a")
+        ci.add("b")
+        assert ci.use("a")
+        #"b" is now the oldest one, so the client will have dropped it:
+        ci.add("c")
+        assert not ci.use("b")
+        assert ci.use("a") and ci.use("c")
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
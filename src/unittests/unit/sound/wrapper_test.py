@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2020 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+import unittest
+
+from xpra.sound import wrapper
+from xpra.sound.wrapper import start_sending_sound, shared_sources
+
+
+class FakeSourceWrapper:
+    """ records what the shared source does with the subprocess """
+    instances = []
+
+    def __init__(self, plugin, options, codecs, volume, element_options):
+        self.plugin = plugin
+        self.codecs = codecs
+        self.volume = volume
+        self.signal_callbacks = {}
+        self.started = False
+        self.cleaned = False
+        self.info = {"buffer_count" : 0}
+        self.idle = []
+        self.codec_description = "fake"
+        FakeSourceWrapper.instances.append(self)
+
+    def connect(self, signal, cb, *args):
+        self.signal_callbacks.setdefault(signal, []).append((cb, args))
+
+    def emit(self, signal, *args):
+        for cb, cb_args in self.signal_callbacks.get(signal, ()):
+            cb(self, *(cb_args+args))
+
+    def idle_add(self, fn, *args):
+        #not run until the test calls run_idle:
+        self.idle.append((fn, args))
+
+    def run_idle(self):
+        idle = self.idle
+        self.idle = []
+        for fn, args in idle:
+            fn(*args)
+
+    def start(self):
+        self.started = True
+
+    def cleanup(self):
+        self.cleaned = True
+
+    def set_volume(self, v):
+        self.volume = v
+
+    def get_state(self):
+        return "active" if self.started else "stopped"
+
+    def get_info(self):
+        return {}
+
+
+class FakeClient:
+    def __init__(self, codec="opus", volume=1.0):
+        self.stream = []
+        self.buffers = []
+        self.source = start_sending_sound(None, "test", None, codec, volume, True, [codec], None, None, True)
+        assert self.source
+        self.source.connect("new-stream", self.new_stream)
+        self.source.connect("new-buffer", self.new_buffer)
+
+    def new_stream(self, sound_source, codec):
+        assert sound_source is self.source
+        self.stream.append(codec)
+
+    def new_buffer(self, sound_source, data, metadata, packet_metadata):
+        assert sound_source is self.source
+        #the audio mixin adds its own sequence number:
+        metadata["sequence"] = id(self)
+        self.buffers.append((data, metadata, packet_metadata))
+
+
+class TestSharedSource(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = wrapper.source_subprocess_wrapper, wrapper.parse_sound_source
+        wrapper.source_subprocess_wrapper = FakeSourceWrapper
+        def parse_sound_source(_plugins, _plugin, _device, _want_monitor_device, _remote):
+            return "fakesrc", {}
+        wrapper.parse_sound_source = parse_sound_source
+        FakeSourceWrapper.instances = []
+        shared_sources.clear()
+
+    def tearDown(self):
+        wrapper.source_subprocess_wrapper, wrapper.parse_sound_source = self.saved
+        shared_sources.clear()
+
+    def test_shared(self):
+        c1 = FakeClient()
+        c1.source.start()
+        assert len(FakeSourceWrapper.instances)==1
+        w = FakeSourceWrapper.instances[0]
+        assert w.started
+        w.emit("new-stream", "opus")
+        headers = [b"header"]
+        w.emit("new-buffer", b"data1", {"timestamp" : 1}, headers)
+        assert c1.stream==["opus"]
+        assert c1.buffers==[(b"data1", {"timestamp" : 1, "sequence" : id(c1)}, headers)]
+        #a second client shares the same subprocess:
+        c2 = FakeClient()
+        c2.source.start()
+        assert len(FakeSourceWrapper.instances)==1
+        #it gets the new-stream signal it missed, before any buffer:
+        assert c2.stream==["opus"] and not c2.buffers
+        w.emit("new-buffer", b"data2", {"timestamp" : 2}, [])
+        w.run_idle()
+        assert c2.stream==["opus"]
+        #and the headers with its first buffer:
+        assert c2.buffers==[(b"data2", {"timestamp" : 2, "sequence" : id(c2)}, headers)]
+        assert c1.buffers[-1]==(b"data2", {"timestamp" : 2, "sequence" : id(c1)}, [])
+        w.emit("new-buffer", b"data3", {"timestamp" : 3}, [])
+        assert c2.buffers[-1][2]==[]
+        #buffer counts are per client:
+        assert c1.source.info["buffer_count"]==4
+        assert c2.source.info["buffer_count"]==3
+        #a different codec uses a different subprocess:
+        c3 = FakeClient("mp3")
+        c3.source.start()
+        assert len(FakeSourceWrapper.instances)==2
+        assert not c3.buffers
+        #the subprocess is stopped once the last client is gone:
+        c1.source.cleanup()
+        assert not w.cleaned
+        w.emit("new-buffer", b"data4", {}, [])
+        assert len(c1.buffers)==3 and len(c2.buffers)==3
+        c2.source.cleanup()
+        assert w.cleaned
+        assert len(shared_sources)==1
+
+    def test_volume(self):
+        c1 = FakeClient()
+        c1.source.start()
+        c2 = FakeClient()
+        c2.source.start()
+        w = FakeSourceWrapper.instances[0]
+        #changing the volume does not affect the other client:
+        c2.source.set_volume(0.5)
+        assert w.volume==1.0 and not w.cleaned
+        assert len(FakeSourceWrapper.instances)==2
+        w2 = FakeSourceWrapper.instances[1]
+        assert w2.volume==0.5 and w2.started
+        #new clients still get the default volume:
+        c3 = FakeClient()
+        c3.source.start()
+        assert c3.source.source.wrapper is w
+        #the only client can modify the volume in place:
+        c2.source.set_volume(0.8)
+        assert w2.volume==0.8 and not w2.cleaned
+        assert len(FakeSourceWrapper.instances)==2
+        c2.source.cleanup()
+        assert w2.cleaned
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -514,12 +514,16 @@ class GTKXpraClient(GObjectXpraClient, UIXpraClient):
         filelog("file_upload_dialog_response: filename=%s", filename)
         try:
             filesize = os.stat(filename).st_size
-        except OSError:
+        except (OSError, TypeError):
             pass
         else:
             if not self.check_file_size("upload", filename, filesize):
                 self.close_file_upload_dialog()
                 return
+            #local file: read it as it is being sent
+            self.close_file_upload_dialog()
+            self.send_file(filename, "", None, filesize=filesize, openit=v==Gtk.ResponseType.ACCEPT)
+            return
         gfile = dialog.get_file()
         self.close_file_upload_dialog()
         filelog("load_contents: filename=%s, response=%s", filename, v)
@@ -11,9 +11,10 @@ import os
 import errno
 import signal
 import datetime
-from collections import deque
+from collections import deque, OrderedDict
 from time import sleep, time
 from queue import Queue
+from threading import Lock
 from gi.repository import GLib
 
 from xpra.platform.gui import (
@@ -52,6 +53,7 @@ MOUSE_SHOW = envbool("XPRA_MOUSE_SHOW", True)
 PAINT_FAULT_RATE = envint("XPRA_PAINT_FAULT_INJECTION_RATE")
 PAINT_FAULT_TELL = envbool("XPRA_PAINT_FAULT_INJECTION_TELL", True)
 PAINT_DELAY = envint("XPRA_PAINT_DELAY", 0)
+MAX_DECODE_THREADS = envint("XPRA_MAX_DECODE_THREADS", 8)
 
 WM_CLASS_CLOSEEXIT = os.environ.get("XPRA_WM_CLASS_CLOSEEXIT", "Xephyr").split(",")
 TITLE_CLOSEEXIT = os.environ.get("XPRA_TITLE_CLOSEEXIT", "Xnest").split(",")
@@ -73,6 +75,8 @@ ICON_OVERLAY = envint("XPRA_ICON_OVERLAY", 50)
 ICON_SHRINKAGE = envint("XPRA_ICON_SHRINKAGE", 75)
 SAVE_WINDOW_ICONS = envbool("XPRA_SAVE_WINDOW_ICONS", False)
 SAVE_CURSORS = envbool("XPRA_SAVE_CURSORS", False)
+CURSOR_CACHE = envint("XPRA_CURSOR_CACHE", 32)
+WINDOW_ICON_CACHE = envint("XPRA_WINDOW_ICON_CACHE", 64)
 SIGNAL_WATCHER = envbool("XPRA_SIGNAL_WATCHER", True)
 
 FAKE_SUSPEND_RESUME = envint("XPRA_FAKE_SUSPEND_RESUME", 0)
@@ -96,10 +100,15 @@ class WindowClient(StubClientMixin):
         self.min_window_size = 0, 0
         self.max_window_size = 0, 0
 
-        #draw thread:
-        self._draw_queue = None
-        self._draw_thread = None
+        #draw threads:
+        #(one queue per thread, windows are assigned to a thread by their id)
+        self.decode_threads = 1
+        self._draw_queues = ()
+        self._draw_threads = []
         self._draw_counter = 0
+        #number of draw packets queued for each window:
+        self._draw_pending = {}
+        self._draw_pending_lock = Lock()
 
         #statistics and server info:
         self.pixel_counter = deque(maxlen=1000)
@@ -127,6 +136,11 @@ class WindowClient(StubClientMixin):
         self.client_supports_bell = False
         self.cursors_enabled = False
         self.default_cursor_data = None
+        self.server_cursor_cache = False
+        #recent cursors, indexed by the hash the server sends:
+        self.cursor_cache = OrderedDict()
+        #same for window icons:
+        self.window_icon_cache = OrderedDict()
         self.server_bell = False
         self.bell_enabled = False
 
@@ -228,8 +242,15 @@ class WindowClient(StubClientMixin):
                     log.error("Error: failed to load overlay icon '%s':", icon_filename, exc_info=True)
                     log.error(" %s", e)
         traylog("overlay_image=%s", self.overlay_image)
-        self._draw_queue = Queue()
-        self._draw_thread = make_thread(self._draw_thread_loop, "draw")
+        self.decode_threads = opts.decode_threads
+        if self.decode_threads<=0:
+            #auto: one thread per core, up to MAX_DECODE_THREADS
+            self.decode_threads = max(1, min(MAX_DECODE_THREADS, os.cpu_count() or 1))
+        drawlog("decode threads=%i", self.decode_threads)
+        self._draw_queues = tuple(Queue() for _ in range(self.decode_threads))
+        for i, draw_queue in enumerate(self._draw_queues):
+            name = "draw" if self.decode_threads==1 else "draw-%i" % i
+            self._draw_threads.append(make_thread(self._draw_thread_loop, name, args=(draw_queue,)))
 
 
     def parse_border(self):
@@ -238,8 +259,9 @@ class WindowClient(StubClientMixin):
 
 
     def run(self):
-        #we decode pixel data in this thread
-        self._draw_thread.start()
+        #we decode pixel data in these threads
+        for t in self._draw_threads:
+            t.start()
         if FAKE_SUSPEND_RESUME:
             self.timeout_add(FAKE_SUSPEND_RESUME*1000, self.suspend)
             self.timeout_add(FAKE_SUSPEND_RESUME*1000*2, self.resume)
@@ -247,15 +269,15 @@ class WindowClient(StubClientMixin):
 
     def cleanup(self):
         log("WindowClient.cleanup()")
-        #tell the draw thread to exit:
-        dq = self._draw_queue
-        if dq:
+        #tell the draw threads to exit:
+        dqs = self._draw_queues
+        for dq in dqs:
             dq.put(None)
         #the protocol has been closed, it is now safe to close all the windows:
         #(cleaner and needed when we run embedded in the client launcher)
         self.destroy_all_windows()
         self.cancel_lost_focus_timer()
-        if dq:
+        for dq in dqs:
             dq.put(None)
         log("WindowClient.cleanup() done")
 
@@ -280,6 +302,10 @@ class WindowClient(StubClientMixin):
             "min-size"      : self.min_window_size,
             "max-size"      : self.max_window_size,
             "draw-counter"  : self._draw_counter,
+            "draw"          : {
+                "threads"   : self.decode_threads,
+                "queue"     : dict(self._draw_pending),
+                },
             "read-only"     : self.readonly,
             "wheel" : {
                 "delta-x"   : self.wheel_deltax,
@@ -305,6 +331,7 @@ class WindowClient(StubClientMixin):
             "mouse.initial-position"    : self.get_mouse_position(),
             "named_cursors"             : False,
             "cursors"                   : self.client_supports_cursors,
+            "cursor.cache"              : CURSOR_CACHE,
             "double_click.time"         : get_double_click_time(),
             "double_click.distance"     : get_double_click_distance(),
             #features:
@@ -319,6 +346,7 @@ class WindowClient(StubClientMixin):
         updict(caps, "window", self.get_window_caps())
         updict(caps, "encoding", {
             "eos"                       : True,
+            "icons.cache"               : WINDOW_ICON_CACHE,
             })
         return caps
 
@@ -336,6 +364,7 @@ class WindowClient(StubClientMixin):
         self.server_cursors = c.boolget("cursors", True)    #added in 0.5, default to True!
         self.cursors_enabled = self.server_cursors and self.client_supports_cursors
         self.default_cursor_data = c.tupleget("cursor.default", None)
+        self.server_cursor_cache = CURSOR_CACHE>0 and c.boolget("cursor.cache")
         self.server_bell = c.boolget("bell")          #added in 0.5, default to True!
         self.bell_enabled = self.server_bell and self.client_supports_bell
         if c.boolget("windows", True):
@@ -452,6 +481,14 @@ class WindowClient(StubClientMixin):
     ######################################################################
     # cursor:
     def _process_cursor(self, packet):
+        if self.server_cursor_cache and len(packet)>2:
+            #the server appends the hash of the cursor pixels,
+            #we have to keep our cache in sync with the server's view of it,
+            #even if we don't use the cursors:
+            packet = list(packet)
+            cursor_hash = packet.pop()
+            if not self.cache_cursor(packet, cursor_hash):
+                return
         if not self.cursors_enabled:
             return
         if len(packet)==2:
@@ -490,6 +527,28 @@ class WindowClient(StubClientMixin):
                 return
         self.set_windows_cursor(self._id_to_window.values(), new_cursor)
 
+    def cache_cursor(self, packet, cursor_hash):
+        """
+            store the cursor we just received,
+            or replace the reference with the cursor we already have
+        """
+        if not cursor_hash:
+            return True
+        cache = self.cursor_cache
+        if packet[1]==b"cached":
+            cached = cache.get(cursor_hash)
+            if not cached:
+                cursorlog.warn("Warning: cursor %s is missing from the cache", bytestostr(cursor_hash))
+                return False
+            cache.move_to_end(cursor_hash)
+            packet[1], packet[9] = cached
+            cursorlog("using cached %s cursor %s", bytestostr(packet[1]), bytestostr(cursor_hash))
+        else:
+            cache[cursor_hash] = packet[1], packet[9]
+            while len(cache)>CURSOR_CACHE:
+                cache.popitem(last=False)
+        return True
+
     def reset_cursor(self):
         self.set_windows_cursor(self._id_to_window.values(), [])
 
@@ -1042,6 +1101,21 @@ class WindowClient(StubClientMixin):
 
     def _process_window_icon(self, packet):
         wid, w, h, coding, data = packet[1:6]
+        cache = self.window_icon_cache
+        if bytestostr(coding)=="cached":
+            icon_hash = data
+            cached = cache.get(icon_hash)
+            if not cached:
+                iconlog.warn("Warning: window icon %s is missing from the cache", bytestostr(icon_hash))
+                return
+            cache.move_to_end(icon_hash)
+            w, h, coding, data = cached
+            iconlog("using cached window icon %s for window %i", bytestostr(icon_hash), wid)
+        elif len(packet)>=7:
+            #the server wants us to keep it:
+            cache[packet[6]] = (w, h, coding, data)
+            while len(cache)>WINDOW_ICON_CACHE:
+                cache.popitem(last=False)
         img = self._window_icon_image(wid, w, h, coding, data)
         window = self._id_to_window.get(wid)
         iconlog("_process_window_icon(%s, %s, %s, %s, %s bytes) image=%s, window=%s",
@@ -1380,21 +1454,39 @@ class WindowClient(StubClientMixin):
     # painting windows:
     def _process_draw(self, packet):
         if PAINT_DELAY>0:
-            self.timeout_add(PAINT_DELAY, self._draw_queue.put, packet)
+            self.timeout_add(PAINT_DELAY, self.queue_draw, packet)
         else:
-            self._draw_queue.put(packet)
+            self.queue_draw(packet)
 
     def _process_eos(self, packet):
-        self._draw_queue.put(packet)
+        self.queue_draw(packet)
+
+    def queue_draw(self, packet):
+        """
+            All the packets for the same window go to the same draw thread,
+            so they are decoded and painted in the order they were received.
+            mmap packets must all be processed in order
+            since they release the space they use in the mmap area,
+            and the server can fall back to other encodings for any window,
+            so all the packets use the first draw thread when mmap is enabled.
+        """
+        wid = packet[1]
+        dqs = self._draw_queues
+        index = 0
+        if not self.mmap_enabled:
+            index = wid % len(dqs)
+        with self._draw_pending_lock:
+            self._draw_pending[wid] = self._draw_pending.get(wid, 0)+1
+        dqs[index].put(packet)
 
     def send_damage_sequence(self, wid, packet_sequence, width, height, decode_time, message=""):
         packet = "damage-sequence", packet_sequence, wid, width, height, decode_time, message
         drawlog("sending ack: %s", packet)
         self.send_now(*packet)
 
-    def _draw_thread_loop(self):
+    def _draw_thread_loop(self, draw_queue):
         while self.exit_code is None:
-            packet = self._draw_queue.get()
+            packet = draw_queue.get()
             if packet is None:
                 break
             try:
@@ -1402,6 +1494,14 @@ class WindowClient(StubClientMixin):
                 sleep(0)
             except Exception as e:
                 log.error("Error '%s' processing %s packet", e, packet[0], exc_info=True)
+            finally:
+                wid = packet[1]
+                with self._draw_pending_lock:
+                    pending = self._draw_pending.get(wid, 0)-1
+                    if pending>0:
+                        self._draw_pending[wid] = pending
+                    else:
+                        self._draw_pending.pop(wid, None)
         log("draw thread ended")
 
     def _do_draw(self, packet):
@@ -11,6 +11,7 @@ from xpra.buffers.membuf cimport getbuf, padbuf, MemBuf #pylint: disable=syntax-
 from xpra.buffers.membuf cimport object_as_buffer, object_as_write_buffer
 
 from libc.stdint cimport uintptr_t, uint32_t, uint16_t, uint8_t
+from libc.string cimport memcpy
 
 import struct
 from xpra.log import Logger
@@ -323,6 +324,32 @@ cdef bgradata_to_rgbx(const unsigned char* bgra, const int bgra_len):
     return memoryview(output_buf)
 
 
+def alpha_fill(buf, int index, unsigned char value=0xff):
+    """
+        Returns a copy of the 32-bit pixels with the byte at 'index' set to 'value',
+        ie: to clear the undefined 'X' channel of BGRX pixels.
+    """
+    assert len(buf) % 4 == 0, "invalid buffer size: %s is not a multiple of 4" % len(buf)
+    assert 0<=index<4, "invalid channel index %i" % index
+    cdef const unsigned char * cbuf = NULL
+    cdef Py_ssize_t cbuf_len = 0
+    assert as_buffer(buf, <const void**> &cbuf, &cbuf_len)==0, "cannot convert %s to a readable buffer" % type(buf)
+    return alphadata_fill(cbuf, cbuf_len, index, value)
+
+cdef alphadata_fill(const unsigned char* src, Py_ssize_t src_len, int index, unsigned char value):
+    if src_len <= 0:
+        return None
+    cdef MemBuf output_buf = getbuf(src_len)
+    cdef unsigned char* dst = <unsigned char*> output_buf.get_mem()
+    cdef Py_ssize_t i = index
+    with nogil:
+        memcpy(dst, src, src_len)
+        while i < src_len:
+            dst[i] = value
+            i += 4
+    return memoryview(output_buf)
+
+
 
 
 def premultiply_argb(buf):
@@ -647,6 +647,22 @@ cdef class Encoder:
         param.i_log_level = LOG_LEVEL
 
 
+    def restart(self):
+        """
+            Starts a new stream with the same context,
+            the next frame will be an IDR frame.
+            Not possible when using b-frames since we may still have delayed frames.
+        """
+        if self.context==NULL or self.b_frames or self.delayed_frames>0:
+            return False
+        self.frames = 0
+        self.frame_types = {}
+        self.last_frame_times = deque(maxlen=200)
+        self.time = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        return True
+
     def clean(self):                        #@DuplicatedSignature
         log("x264 close context %#x", <uintptr_t> self.context)
         cdef x264_t *context = self.context
@@ -850,6 +866,9 @@ cdef class Encoder:
         istrides = image.get_rowstride()
 
         x264_picture_init(&pic_in)
+        if self.frames==0:
+            #new stream, which may be using a context that was used before:
+            pic_in.i_type = X264_TYPE_IDR
 
         if self.src_format.find("RGB")>=0 or self.src_format.find("BGR")>=0:
             assert len(pixels)>0
@@ -7,13 +7,16 @@
 
 import sys
 from threading import Lock
+from collections import OrderedDict
 
 from xpra.codecs.loader import load_codec, get_codec, get_codec_error
-from xpra.util import csv, engs
+from xpra.util import csv, engs, envint
 from xpra.log import Logger
 
 log = Logger("codec", "video")
 
+SCORES_CACHE_ITEMS = envint("XPRA_VIDEO_SCORES_CACHE_ITEMS", 64)
+
 #the codec loader uses the names...
 #but we need the module name to be able to probe without loading the codec:
 CODEC_TO_MODULE = {
@@ -116,18 +119,27 @@ class VideoHelper:
         The main instance, obtained by calling getVideoHelper, can be initialized
         by the main class, using the command line arguments.
         We can also clone it to modify it (used by per client proxy encoders)
+        The clones share the video pool of the main instance, if it has one.
     """
 
-    def __init__(self, vencspecs=None, cscspecs=None, vdecspecs=None, init=False):
+    def __init__(self, vencspecs=None, cscspecs=None, vdecspecs=None, init=False, video_pool=None):
         self._video_encoder_specs = vencspecs or {}
         self._csc_encoder_specs = cscspecs or {}
         self._video_decoder_specs = vdecspecs or {}
         self.video_encoders = []
         self.csc_modules = []
         self.video_decoders = []
+        self.video_pool = video_pool
 
         self._cleanup_modules = []
 
+        #scored video pipeline options, cleared when the specs change:
+        self._scores = OrderedDict()
+        self._scores_lock = Lock()
+        self._limited_specs = None
+        self.scores_hits = 0
+        self.scores_misses = 0
+
         #bits needed to ensure we can initialize just once
         #even when called from multiple threads:
         self._initialized = init
@@ -167,6 +179,7 @@ class VideoHelper:
             self.csc_modules = []
             self.video_decoders = []
             self._initialized = False
+        self.invalidate_scores()
 
     def clone(self):
         if not self._initialized:
@@ -183,7 +196,7 @@ class VideoHelper:
         ves = deepish_clone_dict(self._video_encoder_specs)
         ces = deepish_clone_dict(self._csc_encoder_specs)
         vds = deepish_clone_dict(self._video_decoder_specs)
-        return VideoHelper(ves, ces, vds, True)
+        return VideoHelper(ves, ces, vds, True, self.video_pool)
 
     def get_info(self) -> dict:
         d = {}
@@ -215,6 +228,14 @@ class VideoHelper:
         cscm = einfo.setdefault("csc-module", {})
         for x in ALL_CSC_MODULE_OPTIONS:
             cscm["%s" % x] = modstatus(x, get_DEFAULT_CSC_MODULES(), self.csc_modules)
+        vp = self.video_pool
+        if vp:
+            d["pool"] = vp.get_info()
+        d["scores"] = {
+            "items"     : len(self._scores),
+            "hits"      : self.scores_hits,
+            "misses"    : self.scores_misses,
+            }
         return d
 
     def init(self):
@@ -246,6 +267,45 @@ class VideoHelper:
     def get_csc_specs(self, src_format):
         return self._csc_encoder_specs.get(src_format, {})
 
+    def invalidate_scores(self):
+        with self._scores_lock:
+            self._scores = OrderedDict()
+            self._limited_specs = None
+
+    def get_runtime_factors(self):
+        """ the runtime factor of the codecs limited to a number of instances can change """
+        specs = self._limited_specs
+        if specs is None:
+            specs = []
+            for all_specs in (self._video_encoder_specs, self._csc_encoder_specs):
+                for format_specs in all_specs.values():
+                    for spec_list in format_specs.values():
+                        specs += [spec for spec in spec_list if spec.max_instances>0]
+            self._limited_specs = specs
+        return tuple(spec.get_runtime_factor() for spec in specs)
+
+    def get_cached_scores(self, key):
+        """
+            Returns the pipeline scores previously calculated for this key,
+            or None if we don't have them or if they may be stale.
+        """
+        factors = self.get_runtime_factors()
+        with self._scores_lock:
+            v = self._scores.get(key)
+            if v is None or v[0]!=factors:
+                self.scores_misses += 1
+                return None
+            self.scores_hits += 1
+            self._scores.move_to_end(key)
+            return v[1]
+
+    def set_cached_scores(self, key, scores):
+        factors = self.get_runtime_factors()
+        with self._scores_lock:
+            self._scores[key] = (factors, scores)
+            while len(self._scores)>SCORES_CACHE_ITEMS:
+                self._scores.popitem(last=False)
+
     def get_decoder_specs(self, encoding):
         return self._video_decoder_specs.get(encoding, {})
 
@@ -300,6 +360,7 @@ class VideoHelper:
 
     def add_encoder_spec(self, encoding, colorspace, spec):
         self._video_encoder_specs.setdefault(encoding, {}).setdefault(colorspace, []).append(spec)
+        self.invalidate_scores()
 
 
     def init_csc_options(self):
@@ -345,6 +406,7 @@ class VideoHelper:
 
     def add_csc_spec(self, in_csc, out_csc, spec):
         self._csc_encoder_specs.setdefault(in_csc, {}).setdefault(out_csc, []).append(spec)
+        self.invalidate_scores()
 
 
     def init_video_decoders_options(self):
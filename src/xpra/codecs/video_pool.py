@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+# This file is part of Xpra.
+# Copyright (C) 2020 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+from threading import Lock
+
+from xpra.os_util import monotonic_time
+from xpra.util import envint
+from xpra.log import Logger
+
+log = Logger("codec", "video")
+
+MAX_ITEMS = envint("XPRA_VIDEO_POOL_ITEMS", 8)
+TIMEOUT = envint("XPRA_VIDEO_POOL_TIMEOUT", 10)
+CLASS_STEP = envint("XPRA_VIDEO_POOL_CLASS_STEP", 25)
+
+
+def get_pool_class(value) -> int:
+    """ speed and quality values which are close enough to share instances """
+    return max(0, min(100, int(value)))//max(1, CLASS_STEP)
+
+
+"""
+Video encoders and csc converters released by the windows of a session,
+so the next window that needs the same kind of instance can use it
+without paying for a new context.
+The key must include everything the instance was initialized with:
+the codec type, the formats, the dimensions and the speed / quality class.
+Encoders can only be pooled if they can start a new stream with a keyframe,
+which they tell us by returning True from 'restart()'.
+Idle instances are cleaned when they expire or when the pool is full.
+"""
+class VideoPool:
+
+    def __init__(self, max_items=MAX_ITEMS, timeout=TIMEOUT):
+        self.max_items = max_items
+        self.timeout = timeout
+        #(key, release time, instance), oldest first:
+        self.idle = []
+        #id(instance) : (key, instance)
+        self.leased = {}
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.closed = False
+        self.lock = Lock()
+
+    def __repr__(self):
+        return "VideoPool(%i idle, %i in use)" % (len(self.idle), len(self.leased))
+
+    def get(self, key):
+        """ returns an idle instance initialized with this key, or None """
+        with self.lock:
+            for i in range(len(self.idle)-1, -1, -1):
+                k, _, instance = self.idle[i]
+                if k==key:
+                    del self.idle[i]
+                    self.leased[id(instance)] = (key, instance)
+                    self.hits += 1
+                    return instance
+            self.misses += 1
+            return None
+
+    def add(self, key, instance):
+        """ a new instance is in use, it can be released to the pool later """
+        with self.lock:
+            if not self.closed:
+                self.leased[id(instance)] = (key, instance)
+
+    def release(self, instance) -> bool:
+        """ returns False if the instance cannot be pooled and must be cleaned by the caller """
+        with self.lock:
+            v = self.leased.pop(id(instance), None)
+        if not v or v[1] is not instance or instance.is_closed():
+            return False
+        restart = getattr(instance, "restart", None)
+        if restart and not restart():
+            return False
+        evicted = []
+        with self.lock:
+            if self.closed:
+                return False
+            self.idle.append((v[0], monotonic_time(), instance))
+            while len(self.idle)>self.max_items:
+                evicted.append(self.idle.pop(0)[2])
+        log("VideoPool.release(%s) key=%s, evicted=%s", instance, v[0], evicted)
+        self.clean(evicted)
+        return True
+
+    def expire(self):
+        """ cleans the instances which have been idle for longer than the timeout """
+        expired = []
+        cutoff = monotonic_time()-self.timeout
+        with self.lock:
+            while self.idle and self.idle[0][1]<cutoff:
+                expired.append(self.idle.pop(0)[2])
+            self.expired += len(expired)
+        if expired:
+            log("VideoPool.expire() %s", expired)
+            self.clean(expired)
+
+    def cleanup(self):
+        with self.lock:
+            self.closed = True
+            instances = [x[2] for x in self.idle]
+            self.idle = []
+            self.leased = {}
+        self.clean(instances)
+
+    def clean(self, instances):
+        for instance in instances:
+            try:
+                instance.clean()
+            except Exception:
+                log.error("Error cleaning pooled instance %s", instance, exc_info=True)
+
+    def get_info(self) -> dict:
+        total = self.hits+self.misses
+        return {
+            "idle"      : len(self.idle),
+            "in-use"    : len(self.leased),
+            "max-items" : self.max_items,
+            "timeout"   : self.timeout,
+            "hits"      : self.hits,
+            "misses"    : self.misses,
+            "expired"   : self.expired,
+            "hit-rate"  : 100*self.hits//total if total else 0,
+            }
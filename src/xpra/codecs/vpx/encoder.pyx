@@ -341,6 +341,7 @@ def get_error_string(int err):
 
 cdef class Encoder:
     cdef unsigned long frames
+    cdef unsigned long pts
     cdef vpx_codec_ctx_t *context
     cdef vpx_codec_enc_cfg_t cfg
     cdef vpx_img_fmt_t pixfmt
@@ -386,6 +387,7 @@ cdef class Encoder:
         self.bandwidth_limit = options.intget("bandwidth-limit", 0)
         self.lossless = 0
         self.frames = 0
+        self.pts = 0
         self.last_frame_times = deque(maxlen=200)
         self.pixfmt = get_vpx_colorspace(self.src_format)
         try:
@@ -563,12 +565,24 @@ cdef class Encoder:
     def __dealloc__(self):
         self.clean()
 
+    def restart(self):
+        """
+            Starts a new stream with the same context,
+            the next frame will be a keyframe.
+        """
+        if self.context==NULL:
+            return False
+        self.frames = 0
+        self.last_frame_times = deque(maxlen=200)
+        return True
+
     def clean(self):                        #@DuplicatedSignature
         if self.context!=NULL:
             vpx_codec_destroy(self.context)
             free(self.context)
             self.context = NULL
         self.frames = 0
+        self.pts = 0
         self.pixfmt = 0
         self.width = 0
         self.height = 0
@@ -670,7 +684,7 @@ cdef class Encoder:
             deadline_str = "%8.3fms" % deadline
         start = monotonic_time()
         with nogil:
-            ret = vpx_codec_encode(self.context, image, self.frames, 1, flags, deadline)
+            ret = vpx_codec_encode(self.context, image, self.pts, 1, flags, deadline)
         if ret!=0:
             free(image)
             log.error("%s codec encoding error %s: %s", self.encoding, ret, get_error_string(ret))
@@ -685,6 +699,7 @@ cdef class Encoder:
             log.error("%s invalid packet type: %s", self.encoding, PACKET_KIND.get(pkt.kind, pkt.kind))
             return None
         self.frames += 1
+        self.pts += 1
         #we copy the compressed data here, we could manage the buffer instead
         #using vpx_codec_set_cx_data_buf every time with a wrapper for freeing it,
         #but since this is compressed data, no big deal
@@ -6,7 +6,7 @@
 #cython: wraparound=False, boundscheck=False, language_level=3
 
 from libc.stdint cimport uint32_t, uintptr_t  #pylint: disable=syntax-error
-from xpra.buffers.membuf cimport getbuf, object_as_buffer, MemBuf
+from xpra.buffers.membuf cimport getbuf, object_as_buffer, object_as_write_buffer, MemBuf
 from libc.string cimport memcpy
 
 
@@ -58,6 +58,19 @@ def hybi_unmask(data, unsigned int offset, unsigned int datalen):
     dp = buf+offset+4
     return do_hybi_mask(mp, dp, datalen)
 
+def hybi_unmask_inplace(mask, data, unsigned int offset=0):
+    """
+        Unmasks the data found in the writable buffer from 'offset' to the end,
+        without making a copy.
+    """
+    cdef Py_ssize_t mlen = 0, dlen = 0
+    cdef uintptr_t mp, dp
+    assert object_as_write_buffer(data, <void **> &dp, &dlen)==0, "cannot get write buffer pointer for data %s" % type(data)
+    assert object_as_buffer(mask, <const void **> &mp, &mlen)==0, "cannot get buffer pointer for mask %s" % type(mask)
+    assert (<unsigned int> mlen)>=4, "mask buffer too small"
+    assert (<unsigned int> dlen)>=offset, "buffer too small %i for offset %i" % (dlen, offset)
+    xor_mask(<unsigned char *> mp, <unsigned char *> (dp+offset), <unsigned char *> (dp+offset), dlen-offset)
+
 def hybi_mask(mask, data):
     cdef Py_ssize_t mlen = 0, dlen = 0
     cdef uintptr_t mp, dp
@@ -71,17 +84,23 @@ cdef object do_hybi_mask(uintptr_t mp, uintptr_t dp, unsigned int datalen):
     #we skip the first 'align' bytes in the output buffer,
     #to ensure that its alignment is the same as the input data buffer
     cdef unsigned int align = (<uintptr_t> dp) & 0x3
-    cdef unsigned int initial_chars = (4-align) & 0x3
     cdef MemBuf out_buf = getbuf(datalen+align)
     op = <uintptr_t> out_buf.get_mem()
-    #char pointers:
-    cdef unsigned char *mcbuf = <unsigned char *> mp
-    cdef unsigned char *dcbuf = <unsigned char *> dp
-    cdef unsigned char *ocbuf = <unsigned char *> op
+    xor_mask(<unsigned char *> mp, <unsigned char *> dp, <unsigned char *> (op+align), datalen)
+    if align>0:
+        return memoryview(out_buf)[align:]
+    return memoryview(out_buf)
+
+cdef void xor_mask(unsigned char *mcbuf, unsigned char *dcbuf, unsigned char *ocbuf, unsigned int datalen) nogil:
+    """
+        The output buffer must have the same alignment as the input data buffer,
+        (it can be the same buffer)
+    """
+    cdef unsigned int initial_chars = (4-((<uintptr_t> dcbuf) & 0x3)) & 0x3
     cdef unsigned int i, j
     #bytes at a time until we reach the 32-bit boundary:
-    for 0 <= i < initial_chars:
-        ocbuf[align+i] = dcbuf[i] ^ mcbuf[i & 0x3]
+    for 0 <= i < min(initial_chars, datalen):
+        ocbuf[i] = dcbuf[i] ^ mcbuf[i & 0x3]
     #32-bit pointers:
     cdef uint32_t *dbuf
     cdef uint32_t *obuf
@@ -91,8 +110,8 @@ cdef object do_hybi_mask(uintptr_t mp, uintptr_t dp, unsigned int datalen):
     if datalen>initial_chars:
         uint32_steps = (datalen-initial_chars) // 4
         if uint32_steps:
-            dbuf = <uint32_t*> (dp+initial_chars)
-            obuf = <uint32_t*> (op+align+initial_chars)
+            dbuf = <uint32_t*> (dcbuf+initial_chars)
+            obuf = <uint32_t*> (ocbuf+initial_chars)
             mask_value = 0
             for 0 <= i < 4:
                 mask_value = mask_value<<8
@@ -103,7 +122,4 @@ cdef object do_hybi_mask(uintptr_t mp, uintptr_t dp, unsigned int datalen):
         last_chars = (datalen-initial_chars) & 0x3
         for 0 <= i < last_chars:
             j = datalen-last_chars+i
-            ocbuf[align+j] = dcbuf[j] ^ mcbuf[j & 0x3]
-    if align>0:
-        return memoryview(out_buf)[align:]
-    return memoryview(out_buf)
+            ocbuf[j] = dcbuf[j] ^ mcbuf[j & 0x3]
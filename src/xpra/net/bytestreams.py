@@ -32,6 +32,13 @@ SOCKET_TIMEOUT = envint("XPRA_SOCKET_TIMEOUT", 20)
 #this is more proper but would break the proxy server:
 SOCKET_SHUTDOWN = envbool("XPRA_SOCKET_SHUTDOWN", False)
 LOG_TIMEOUTS = envint("XPRA_LOG_TIMEOUTS", 1)
+SOCKET_SENDMSG = envbool("XPRA_SOCKET_SENDMSG", not WIN32)
+IOV_MAX = 1024
+if POSIX:
+    try:
+        IOV_MAX = os.sysconf("SC_IOV_MAX")
+    except (ValueError, OSError):
+        pass
 
 ABORT = {
          errno.ENXIO            : "ENXIO",
@@ -115,6 +122,9 @@ class Connection:
         self.input_readcount = 0
         self.output_bytecount = 0
         self.output_writecount = 0
+        self.output_sockoptcount = 0
+        #can we send multiple buffers with a single call to writev()?
+        self.vectored_writes = False
         self.filename = None            #only used for unix domain sockets!
         self.active = True
         self.timeout = 0
@@ -144,6 +154,14 @@ class Connection:
         #not implemented
         return b""
 
+    def writev(self, buffers):
+        """
+            Write as much as we can from the list of buffers,
+            returns the number of bytes written.
+            By default, only the first buffer is written.
+        """
+        return self.write(buffers[0])
+
     def _write(self, *args):
         """ wraps do_write with packet accounting """
         w = self.untilConcludes(*args)
@@ -173,6 +191,8 @@ class Connection:
                 "output"            : {
                                        "bytecount"      : self.output_bytecount,
                                        "writecount"     : self.output_writecount,
+                                       "sockoptcount"   : self.output_sockoptcount,
+                                       "vectored"       : self.vectored_writes,
                                        },
                 })
         return info
@@ -287,6 +307,7 @@ class SocketConnection(Connection):
             self.nodelay = False
         self.nodelay_value = None
         self.cork_value = None
+        self.vectored_writes = SOCKET_SENDMSG and hasattr(sock, "sendmsg")
         if isinstance(remote, str):
             self.filename = remote
 
@@ -297,12 +318,14 @@ class SocketConnection(Connection):
     def do_set_nodelay(self, nodelay : bool):
         self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, nodelay)
         self.nodelay_value = nodelay
+        self.output_sockoptcount += 1
         log("changed %s socket to nodelay=%s", self.socktype, nodelay)
 
     def set_cork(self, cork : bool):
         if self.cork and self.cork_value!=cork:
             self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, cork)  #@UndefinedVariable
             self.cork_value = cork
+            self.output_sockoptcount += 1
             log("changed %s socket to cork=%s", self.socktype, cork)
 
     def peek(self, n : int):
@@ -314,6 +337,17 @@ class SocketConnection(Connection):
     def write(self, buf):
         return self._write(self._socket.send, buf)
 
+    def writev(self, buffers):
+        if not self.vectored_writes:
+            return self.write(buffers[0])
+        try:
+            return self._write(self._socket.sendmsg, buffers[:IOV_MAX])
+        except NotImplementedError:
+            #ie: SSL sockets
+            log("%s.writev(..) sendmsg is not supported", self, exc_info=True)
+            self.vectored_writes = False
+            return self.write(buffers[0])
+
     def close(self):
         s = self._socket
         try:
@@ -5,18 +5,33 @@
 # Xpra is released under the terms of the GNU GPL v2, or, at your option, any
 # later version. See the file COPYING for details.
 
+import threading
 from collections import namedtuple
 
-from xpra.util import envbool
-from xpra.net.header import LZ4_FLAG, ZLIB_FLAG, LZO_FLAG, BROTLI_FLAG
+from xpra.util import envbool, envint
+from xpra.net.header import LZ4_FLAG, ZLIB_FLAG, LZO_FLAG, BROTLI_FLAG, ZSTD_FLAG
 
 
 MAX_SIZE = 256*1024*1024
 
+#use the built-in dictionary with zstd:
+ZSTD_DICTIONARY = envbool("XPRA_ZSTD_DICTIONARY", True)
+#train a dictionary from the first packets we send (0 to disable):
+ZSTD_TRAIN_SAMPLES = envint("XPRA_ZSTD_TRAIN_SAMPLES", 0)
+ZSTD_TRAIN_SIZE = envint("XPRA_ZSTD_TRAIN_SIZE", 16*1024)
+#dictionaries received from the peer that we keep:
+ZSTD_MAX_DICTIONARIES = 2
+#only small packets benefit from a dictionary:
+ZSTD_SAMPLE_MAX_SIZE = envint("XPRA_ZSTD_SAMPLE_MAX_SIZE", 4096)
+#keep the compression context between packets:
+STREAM = envbool("XPRA_COMPRESSION_STREAM", True)
+
 #all the compressors we know about, in best compatibility order:
-ALL_COMPRESSORS = ("zlib", "lz4", "lzo", "brotli", "none")
+ALL_COMPRESSORS = ("zlib", "lz4", "lzo", "brotli", "zstd", "none")
 #order for performance:
-PERFORMANCE_ORDER = ("none", "lz4", "lzo", "zlib", "brotli")
+PERFORMANCE_ORDER = ("none", "lz4", "zstd", "lzo", "zlib", "brotli")
+#the compressors which can be used in stream mode:
+STREAM_COMPRESSORS = ("lz4", "zlib")
 
 
 Compression = namedtuple("Compression", ["name", "version", "python_version", "compress", "decompress"])
@@ -54,7 +69,11 @@ def init_lzo():
         if isinstance(packet, memoryview):
             packet = packet.tobytes()
         return level | LZO_FLAG, lzo.compress(packet)
-    return Compression("lzo", lzo.LZO_VERSION_STRING, lzo.__version__, lzo_compress, lzo.decompress)
+    def lzo_decompress(data):
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        return lzo.decompress(data)
+    return Compression("lzo", lzo.LZO_VERSION_STRING, lzo.__version__, lzo_compress, lzo_decompress)
 
 def init_brotli():
     from brotli import compress, decompress, __version__
@@ -83,6 +102,46 @@ def init_zlib():
         return decompress(data)
     return Compression("zlib", None, __version__, zlib_compress, zlib_decompress)
 
+def init_zstd():
+    import zstandard
+    from zstandard import ZstdCompressor, ZstdDecompressor, ZstdCompressionDict, get_frame_parameters
+    builtin = None
+    if ZSTD_DICTIONARY:
+        from xpra.net.compression_dictionary import get_dictionary
+        builtin = ZstdCompressionDict(get_dictionary(), dict_type=zstandard.DICT_TYPE_RAWCONTENT)
+    #the zstd contexts cannot be used from multiple threads at the same time:
+    local = threading.local()
+    def zstd_compress(packet, level):
+        compressors = local.__dict__.setdefault("compressors", {})
+        c = compressors.get(level)
+        if c is None:
+            c = compressors[level] = ZstdCompressor(level=max(1, level))
+        return min(15, level) | ZSTD_FLAG, c.compress(packet)
+    def zstd_decompress(data, dictionaries=None):
+        params = get_frame_parameters(data)
+        #max_output_size only applies to frames which do not specify their size:
+        size = params.content_size
+        if size!=zstandard.CONTENTSIZE_UNKNOWN and size>MAX_SIZE:
+            sizemb = size//1024//1024
+            maxmb = MAX_SIZE//1024//1024
+            raise InvalidCompressionException("uncompressed data is too large: %iMB, limit is %iMB" % (sizemb, maxmb))
+        #frames compressed with the built-in dictionary do not have a dictionary id,
+        #and it is safe to use the dictionary for frames compressed without it:
+        dict_id = params.dict_id
+        if dict_id:
+            dict_data = (dictionaries or {}).get(dict_id)
+            if dict_data is None:
+                raise InvalidCompressionException("unknown zstd dictionary %#x" % dict_id)
+        else:
+            dict_data = builtin
+        decompressors = local.__dict__.setdefault("decompressors", {})
+        d = decompressors.get(dict_id)
+        if d is None or d[0] is not dict_data:
+            d = decompressors[dict_id] = (dict_data, ZstdDecompressor(dict_data=dict_data))
+        return d[1].decompress(data, max_output_size=MAX_SIZE)
+    version = ".".join(str(x) for x in zstandard.ZSTD_VERSION)
+    return Compression("zstd", version, zstandard.__version__, zstd_compress, zstd_decompress)
+
 def init_none():
     def nocompress(packet, _level):
         if not isinstance(packet, bytes):
@@ -130,8 +189,176 @@ def get_compression_caps() -> dict:
         #legacy format - only used for zlib:
         if x=="zlib":
             ccaps[""] = True
+        if x=="zstd":
+            ccaps[""] = True
+            #we can always receive trained dictionaries:
+            ccaps["train"] = True
+            #and we may send some:
+            ccaps["train-send"] = ZSTD_TRAIN_SAMPLES>0
+            if ZSTD_DICTIONARY:
+                from xpra.net.compression_dictionary import get_dictionary_id
+                ccaps["dictionary"] = get_dictionary_id()
+        if STREAM and x in STREAM_COMPRESSORS:
+            ccaps["stream"] = True
     return caps
 
+def get_zstd_options(caps) -> dict:
+    """
+        The zstd options we can use for compressing the packets sent to this peer.
+    """
+    options = {}
+    if ZSTD_DICTIONARY:
+        from xpra.net.compression_dictionary import get_dictionary_id
+        options["builtin"] = caps.strget("zstd.dictionary")==get_dictionary_id()
+    if ZSTD_TRAIN_SAMPLES>0 and caps.boolget("zstd.train"):
+        options["train_samples"] = ZSTD_TRAIN_SAMPLES
+    options["receive"] = caps.boolget("zstd.train-send")
+    return options
+
+
+class ZstdContext:
+    """
+        Compresses the packets sent to one peer,
+        using the built-in dictionary or a dictionary trained from the packets we send.
+        Also keeps track of the dictionaries the peer has trained and sent to us.
+    """
+
+    def __init__(self, builtin=False, train_samples=0, receive=False):
+        import zstandard
+        self.zstandard = zstandard
+        self.dictionary = None
+        if builtin:
+            from xpra.net.compression_dictionary import get_dictionary
+            self.dictionary = zstandard.ZstdCompressionDict(get_dictionary(), dict_type=zstandard.DICT_TYPE_RAWCONTENT)
+        self.train_samples = train_samples
+        self.samples = []
+        self.trained = None
+        self.pending = None
+        #each thread (ie: the compression pool workers) needs its own compressors,
+        #they all share the same dictionary:
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        #dictionaries received from the peer, by id,
+        #only when it has told us that it would send them:
+        self.receive = receive
+        self.dictionaries = {}
+
+    def __repr__(self):
+        return "ZstdContext(%s)" % (self.get_dictionary_info() or "no dictionary")
+
+    def get_dictionary_info(self) -> str:
+        if self.trained:
+            return "trained %#x" % self.trained.dict_id()
+        if self.dictionary:
+            return "built-in"
+        return ""
+
+    def get_info(self) -> dict:
+        return {
+            "dictionary"    : self.get_dictionary_info(),
+            "samples"       : len(self.samples),
+            "received"      : len(self.dictionaries),
+            }
+
+    def compress(self, packet, level):
+        with self.lock:
+            if 0<len(packet)<=ZSTD_SAMPLE_MAX_SIZE and len(self.samples)<self.train_samples:
+                self.samples.append(bytes(packet))
+            dict_data = self.trained or self.dictionary
+        compressors = self.local.__dict__.setdefault("compressors", {})
+        c = compressors.get(level)
+        if c is None or c[0] is not dict_data:
+            c = compressors[level] = (dict_data, self.zstandard.ZstdCompressor(level=max(1, level), dict_data=dict_data))
+        return min(15, level) | ZSTD_FLAG, c[1].compress(packet)
+
+    def decompress(self, data):
+        return COMPRESSION["zstd"].decompress(data, self.dictionaries)
+
+    def should_train(self) -> bool:
+        return self.train_samples>0 and len(self.samples)>=self.train_samples and not self.trained
+
+    def train(self) -> bytes:
+        """
+            Trains a new dictionary from the samples collected,
+            the dictionary must be sent to the peer before calling use_trained().
+        """
+        samples = self.samples
+        self.samples = []
+        self.train_samples = 0
+        try:
+            d = self.zstandard.train_dictionary(ZSTD_TRAIN_SIZE, samples)
+        except self.zstandard.ZstdError as e:
+            from xpra.log import Logger
+            logger = Logger("network", "protocol")
+            logger("failed to train a zstd dictionary from %i samples: %s", len(samples), e)
+            return None
+        self.pending = d
+        return d.as_bytes()
+
+    def use_trained(self):
+        with self.lock:
+            self.trained = self.pending
+            self.pending = None
+
+    def add_dictionary(self, data):
+        assert self.receive, "the peer is not meant to send dictionaries"
+        d = self.zstandard.ZstdCompressionDict(data)
+        #the peer switches to the new dictionary once it is sent,
+        #so we only need to keep the previous one for the packets already in flight:
+        dictionaries = self.dictionaries
+        dictionaries.pop(d.dict_id(), None)
+        dictionaries[d.dict_id()] = d
+        while len(dictionaries)>ZSTD_MAX_DICTIONARIES:
+            dictionaries.pop(next(iter(dictionaries)))
+
+
+def get_stream_compressor(name, level):
+    """
+        Returns a compress function which keeps its context between calls,
+        so each packet can reference the data from the packets sent before it.
+        The packets must be decompressed in the same order,
+        using the function returned by get_stream_decompressor.
+        The compression level cannot be changed once the stream has started.
+    """
+    if name=="zlib":
+        from zlib import compressobj, Z_SYNC_FLUSH
+        zlevel = max(1, level//2)
+        c = compressobj(zlevel)
+        def zlib_stream_compress(packet, _level):
+            data = c.compress(packet)+c.flush(Z_SYNC_FLUSH)
+            return zlevel + ZLIB_FLAG, data
+        return zlib_stream_compress
+    if name=="lz4":
+        from lz4.frame import LZ4FrameCompressor
+        #linked blocks can reference the previous ones,
+        #and we flush the block after each packet:
+        c = LZ4FrameCompressor(block_linked=True, auto_flush=True,
+                               compression_level=level if level>=7 else 0)
+        header = [c.begin()]
+        def lz4_stream_compress(packet, _level):
+            data = c.compress(packet)
+            if header:
+                data = header.pop()+data
+            return min(15, level) | LZ4_FLAG, data
+        return lz4_stream_compress
+    raise InvalidCompressionException("%s does not support stream mode" % name)
+
+def get_stream_decompressor(name):
+    if name=="zlib":
+        from zlib import decompressobj
+        d = decompressobj()
+        def zlib_stream_decompress(data):
+            return d.decompress(data, MAX_SIZE)
+        return zlib_stream_decompress
+    if name=="lz4":
+        from lz4.frame import LZ4FrameDecompressor
+        d = LZ4FrameDecompressor()
+        def lz4_stream_decompress(data):
+            return d.decompress(data, MAX_SIZE)
+        return lz4_stream_decompress
+    raise InvalidCompressionException("%s does not support stream mode" % name)
+
+
 def get_enabled_compressors(order=ALL_COMPRESSORS):
     return tuple(x for x in order if x in COMPRESSION)
 
@@ -192,7 +419,7 @@ class Compressible(LargeStructure):
         raise Exception("compress() not defined on %s" % self)
 
 
-def compressed_wrapper(datatype, data, level=5, zlib=False, lz4=False, lzo=False, brotli=False, none=False, can_inline=True):
+def compressed_wrapper(datatype, data, level=5, zlib=False, lz4=False, lzo=False, brotli=False, zstd=False, none=False, can_inline=True):
     size = len(data)
     if size>MAX_SIZE:
         sizemb = size//1024//1024
@@ -200,6 +427,8 @@ def compressed_wrapper(datatype, data, level=5, zlib=False, lz4=False, lzo=False
         raise Exception("uncompressed data is too large: %iMB, limit is %iMB" % (sizemb, maxmb))
     if lz4 and use("lz4"):
         algo = "lz4"
+    elif zstd and use("zstd"):
+        algo = "zstd"
     elif lzo and use("lzo"):
         algo = "lzo"
     elif brotli and use("brotli"):
@@ -220,6 +449,8 @@ class InvalidCompressionException(Exception):
 
 
 def get_compression_type(level) -> str:
+    if level & ZSTD_FLAG:
+        return "zstd"
     if level & LZ4_FLAG:
         return "lz4"
     if level & LZO_FLAG:
@@ -231,7 +462,9 @@ def get_compression_type(level) -> str:
 
 def decompress(data, level):
     #log.info("decompress(%s bytes, %s) type=%s", len(data), get_compression_type(level))
-    if level & LZ4_FLAG:
+    if level & ZSTD_FLAG:
+        algo = "zstd"
+    elif level & LZ4_FLAG:
         algo = "lz4"
     elif level & LZO_FLAG:
         algo = "lzo"
@@ -0,0 +1,60 @@
+# This file is part of Xpra.
+# Copyright (C) 2020 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+"""
+The built-in dictionary used with zstd compression.
+
+Most control packets are small and each one is compressed on its own,
+so they contain very few repeated strings that the compressor can find.
+This dictionary contains the strings found in the most common packets,
+the peers only use it if both sides have exactly the same dictionary,
+so any change to this list will produce a new dictionary id.
+"""
+
+from hashlib import sha1
+
+#the most frequently used strings are at the end,
+#since those are cheaper to reference:
+STRINGS = (
+    #capabilities and info:
+    "version", "platform", "encoding", "encodings", "compressors", "encoders",
+    "sound", "clipboard", "notifications", "keyboard", "xkbmap_", "desktop_size",
+    "screen_sizes", "dpi", "aliases", "build", "python", "uuid", "hostname",
+    "speed", "quality", "min-quality", "min-speed", "batch", "delay",
+    "client", "server", "display", "session", "window", "damage", "pixels",
+    "latency", "bandwidth", "network", "connection", "elapsed", "count", "total",
+    #window metadata:
+    "title", "class-instance", "size-constraints", "minimum-size", "maximum-size",
+    "base-size", "increment", "transient-for", "window-type",
+    "_NET_WM_WINDOW_TYPE_NORMAL", "_NET_WM_WINDOW_TYPE_DIALOG", "_NET_WM_WINDOW_TYPE_POPUP_MENU",
+    "_NET_WM_WINDOW_TYPE_DROPDOWN_MENU", "_NET_WM_WINDOW_TYPE_TOOLTIP", "_NET_WM_WINDOW_TYPE_UTILITY",
+    "maximized", "fullscreen", "iconic", "decorations", "opacity", "has-alpha",
+    "override-redirect", "pid", "command", "role", "modal", "above", "below",
+    "shaded", "sticky", "skip-taskbar", "skip-pager", "workspace", "bypass-compositor",
+    "frame", "set-initial-position", "xid", "client-machine", "icon-title",
+    "group-leader", "content-type", "focused", "requested-position", "window-metadata",
+    "new-window", "new-override-redirect", "lost-window", "map-window", "unmap-window",
+    "configure-window", "configure-override-redirect", "raise-window", "restack-window",
+    "window-icon", "window-move-resize", "window-resized", "close-window", "buffer-refresh",
+    #notifications, clipboard and others:
+    "notify_show", "notify_close", "bell", "clipboard-token", "clipboard-request",
+    "clipboard-contents", "clipboard-pending-requests", "CLIPBOARD", "PRIMARY",
+    "UTF8_STRING", "TARGETS", "text/plain", "sound-data", "info-request", "info-response",
+    "connection-data", "set-cursors", "cursor", "default", "set-deflate", "keymap-changed",
+    #input events and drawing, the most common packets:
+    "mod1", "mod2", "mod3", "mod4", "mod5", "shift", "control", "lock",
+    "key-action", "button-action", "pointer-position", "focus",
+    "rgb24", "rgb32", "png", "jpeg", "webp", "h264", "vp8", "vp9", "scroll", "mmap",
+    "BGRX", "BGRA", "RGBX", "RGBA", "RGB", "YUV420P", "rgb_format", "lz4", "zlib",
+    "flush", "window-size", "scaled_size", "csc", "draw", "damage-sequence",
+    "ping", "ping_echo",
+    )
+
+
+def get_dictionary() -> bytes:
+    return "".join(STRINGS).encode("latin1")
+
+def get_dictionary_id() -> str:
+    return sha1(get_dictionary()).hexdigest()[:16]
@@ -0,0 +1,108 @@
+# This file is part of Xpra.
+# Copyright (C) 2020 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+"""
+A small pool of threads shared by all the connections,
+used for compressing large payloads:
+the payload is split into blocks which are compressed concurrently,
+and the peer concatenates the decompressed blocks.
+"""
+
+import os
+from queue import Queue
+from threading import Event, Lock
+
+from xpra.util import envint
+from xpra.make_thread import start_thread
+from xpra.log import Logger
+
+log = Logger("network", "protocol")
+
+COMPRESS_THREADS = envint("XPRA_COMPRESS_THREADS", min(4, os.cpu_count() or 1))
+COMPRESS_BLOCK_SIZE = envint("XPRA_COMPRESS_BLOCK_SIZE", 256*1024)
+
+
+class CompressJob:
+    __slots__ = ("compress", "data", "level", "result", "error", "done")
+    def __init__(self, compress, data, level):
+        self.compress = compress
+        self.data = data
+        self.level = level
+        self.result = None
+        self.error = None
+        self.done = Event()
+
+    def run(self):
+        try:
+            self.result = self.compress(self.data, self.level)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done.set()
+
+    def get(self):
+        self.done.wait()
+        if self.error:
+            raise self.error
+        return self.result
+
+
+class CompressionPool:
+
+    def __init__(self, threads=COMPRESS_THREADS, block_size=COMPRESS_BLOCK_SIZE):
+        self.block_size = block_size
+        self.work_queue = Queue()
+        self.threads = [start_thread(self.compress_thread_loop, "compress-%i" % i, daemon=True)
+                        for i in range(threads)]
+
+    def __repr__(self):
+        return "CompressionPool(%i)" % len(self.threads)
+
+    def get_info(self) -> dict:
+        return {
+            "threads"       : len(self.threads),
+            "block-size"    : self.block_size,
+            "queue"         : self.work_queue.qsize(),
+            }
+
+    def compress_thread_loop(self):
+        while True:
+            job = self.work_queue.get()
+            if job is None:
+                return
+            job.run()
+
+    def compress_blocks(self, compress, data, level):
+        """
+            Returns a list of (level, compressed data) for each block.
+            The first block is compressed by the calling thread,
+            since it would only be waiting for the other blocks otherwise.
+        """
+        bs = self.block_size
+        if len(data)<=bs or not self.threads:
+            return [compress(data, level)]
+        jobs = [CompressJob(compress, data[i:i+bs], level) for i in range(bs, len(data), bs)]
+        log("compress_blocks(%s, %i bytes, %i) using %i blocks", compress, len(data), level, len(jobs)+1)
+        for job in jobs:
+            self.work_queue.put(job)
+        blocks = [compress(data[:bs], level)]
+        for job in jobs:
+            blocks.append(job.get())
+        return blocks
+
+    def cleanup(self):
+        for _ in self.threads:
+            self.work_queue.put(None)
+        self.threads = []
+
+
+_pool = None
+_pool_lock = Lock()
+def get_compression_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = CompressionPool()
+        return _pool
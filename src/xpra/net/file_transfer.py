@@ -8,9 +8,10 @@ import os
 import subprocess
 import hashlib
 import uuid
+from io import BytesIO
 
 from xpra.child_reaper import getChildReaper
-from xpra.os_util import monotonic_time, bytestostr, strtobytes, umask_context, POSIX, WIN32
+from xpra.os_util import monotonic_time, bytestostr, strtobytes, umask_context, load_binary_file, POSIX, WIN32
 from xpra.util import typedict, csv, nonl, envint, envbool, engs
 from xpra.scripts.config import parse_bool, parse_with_unit
 from xpra.simple_stats import std_unit
@@ -22,10 +23,14 @@ filelog = Logger("file")
 
 DELETE_PRINTER_FILE = envbool("XPRA_DELETE_PRINTER_FILE", True)
 FILE_CHUNKS_SIZE = max(0, envint("XPRA_FILE_CHUNKS_SIZE", 65536))
+#maximum number of chunks that can be sent without being acknowledged:
+FILE_CHUNKS_WINDOW = max(1, envint("XPRA_FILE_CHUNKS_WINDOW", 32))
 MAX_CONCURRENT_FILES = max(1, envint("XPRA_MAX_CONCURRENT_FILES", 10))
 PRINT_JOB_TIMEOUT = max(60, envint("XPRA_PRINT_JOB_TIMEOUT", 3600))
 SEND_REQUEST_TIMEOUT = max(300, envint("XPRA_SEND_REQUEST_TIMEOUT", 3600))
 CHUNK_TIMEOUT = 10*1000
+#block size used when reading files from disk:
+FILE_READ_SIZE = max(4096, envint("XPRA_FILE_READ_SIZE", 1024*1024))
 
 MIMETYPE_EXTS = {
                  "application/postscript"   : "ps",
@@ -45,6 +50,17 @@ def osclose(fd):
         filelog.error("Error closing file download:")
         filelog.error(" %s", e)
 
+def file_digest(filename, algo=hashlib.sha1):
+    #hash the file without loading it all in memory:
+    u = algo()
+    with open(filename, "rb") as f:
+        while True:
+            block = f.read(FILE_READ_SIZE)
+            if not block:
+                break
+            u.update(block)
+    return u
+
 def basename(filename):
     #we can't use os.path.basename,
     #because the remote end may have sent us a filename
@@ -115,6 +131,7 @@ class FileTransferAttributes:
         self.file_transfer = fta or pbool("file-transfer", file_transfer)
         self.file_size_limit = parse_with_unit("file-size-limit", file_size_limit, "B", min_value=0)
         self.file_chunks = FILE_CHUNKS_SIZE
+        self.file_chunks_window = FILE_CHUNKS_WINDOW
         pa = pask(printing)
         self.printing_ask = pa and can_ask
         self.printing = pa or pbool("printing", printing)
@@ -140,6 +157,7 @@ class FileTransferAttributes:
                 "file-size-limit"   : self.file_size_limit//1024//1024,     #legacy name (use max-file-size)
                 "max-file-size"     : self.file_size_limit,
                 "file-chunks"       : self.file_chunks,
+                "file-chunks-window": self.file_chunks_window,
                 "open-files"        : self.open_files,
                 "open-files-ask"    : self.open_files_ask,
                 "printing"          : self.printing,
@@ -157,6 +175,7 @@ class FileTransferAttributes:
                 "ask"               : self.file_transfer_ask,
                 "size-limit"        : self.file_size_limit,
                 "chunks"            : self.file_chunks,
+                "chunks-window"     : self.file_chunks_window,
                 "open"              : self.open_files,
                 "open-ask"          : self.open_files_ask,
                 "open-url"          : self.open_url,
@@ -186,6 +205,7 @@ class FileTransferHandler(FileTransferAttributes):
         self.remote_file_ask_timeout = SEND_REQUEST_TIMEOUT
         self.remote_file_size_limit = 0
         self.remote_file_chunks = 0
+        self.remote_file_chunks_window = 1
         self.pending_send_data = {}
         self.pending_send_data_timers = {}
         self.send_chunks_in_progress = {}
@@ -205,6 +225,8 @@ class FileTransferHandler(FileTransferAttributes):
             t = v[-2]
             self.source_remove(t)
         self.receive_chunks_in_progress = {}
+        for chunk_id in tuple(self.send_chunks_in_progress.keys()):
+            self.cancel_sending(chunk_id)
         for x in tuple(self.file_descriptors):
             try:
                 os.close(x)
@@ -225,6 +247,8 @@ class FileTransferHandler(FileTransferAttributes):
         self.remote_file_ask_timeout = c.intget("file-ask-timeout")
         self.remote_file_size_limit = c.intget("max-file-size") or c.intget("file-size-limit")*1024*1024
         self.remote_file_chunks = max(0, min(self.remote_file_size_limit, c.intget("file-chunks")))
+        #older versions only handle one chunk at a time:
+        self.remote_file_chunks_window = max(1, c.intget("file-chunks-window", 1))
         self.dump_remote_caps()
 
     def dump_remote_caps(self):
@@ -244,6 +268,7 @@ class FileTransferHandler(FileTransferAttributes):
             "file-transfer-ask" : self.remote_file_transfer_ask,
             "file-size-limit"   : self.remote_file_size_limit,
             "file-chunks"       : self.remote_file_chunks,
+            "file-chunks-window": self.remote_file_chunks_window,
             "open-files"        : self.remote_open_files,
             "open-files-ask"    : self.remote_open_files_ask,
             "open-url"          : self.remote_open_url,
@@ -673,6 +698,10 @@ class FileTransferHandler(FileTransferAttributes):
         self.send("open-url", url, send_id)
 
     def send_file(self, filename, mimetype, data, filesize=0, printit=False, openit=False, options=None):
+        """
+            If data is None, the contents are read from the file
+            as they are being sent.
+        """
         if printit:
             l = printlog
             if not self.printing:
@@ -702,8 +731,18 @@ class FileTransferHandler(FileTransferAttributes):
                 else:
                     ask |= self.remote_open_files_ask
                     action = "open"
-        assert len(data)>=filesize, "data is smaller then the given file size!"
-        data = data[:filesize]          #gio may null terminate it
+        if data is None:
+            if not filesize:
+                try:
+                    filesize = os.stat(filename).st_size
+                except OSError as e:
+                    l("os.stat(%s)", filename, exc_info=True)
+                    l.error("Error: cannot access file '%s'", filename)
+                    l.error(" %s", e)
+                    return False
+        else:
+            assert len(data)>=filesize, "data is smaller then the given file size!"
+            data = data[:filesize]          #gio may null terminate it
         l("send_file%s action=%s, ask=%s",
           (filename, mimetype, type(data), "%i bytes" % filesize, printit, openit, options), action, ask)
         self.dump_remote_caps()
@@ -846,26 +885,68 @@ class FileTransferHandler(FileTransferAttributes):
         l("do_send_file%s", (filename, mimetype, type(data), "%i bytes" % filesize, printit, openit, options))
         if not self.check_file_size(action, filename, filesize):
             return False
-        u = hashlib.sha1()
-        u.update(data)
+        if data is not None:
+            u = hashlib.sha1()
+            u.update(data)
+            return self.do_send_file_data(filename, mimetype, data, filesize, printit, openit, options, send_id, u.hexdigest())
+        #hashing a large file can take a while, so do it from a separate thread:
+        def hash_file():
+            try:
+                u = file_digest(filename)
+            except OSError as e:
+                l("file_digest(%s)", filename, exc_info=True)
+                l.error("Error: cannot read file '%s'", filename)
+                l.error(" %s", e)
+                return
+            self.idle_add(self.do_send_file_data, filename, mimetype, None, filesize,
+                          printit, openit, options, send_id, u.hexdigest())
+        start_thread(hash_file, "file-digest", daemon=True)
+        return True
+
+    def do_send_file_data(self, filename, mimetype, data, filesize, printit, openit, options, send_id, digest):
         absfile = os.path.abspath(filename)
-        filelog("sha1 digest(%s)=%s", absfile, u.hexdigest())
+        filelog("sha1 digest(%s)=%s", absfile, digest)
         options = options or {}
-        options["sha1"] = u.hexdigest()
+        options["sha1"] = digest
         chunk_size = min(self.file_chunks, self.remote_file_chunks)
         if 0<chunk_size<filesize:
             if len(self.send_chunks_in_progress)>=MAX_CONCURRENT_FILES:
                 raise Exception("too many file transfers in progress: %i" % len(self.send_chunks_in_progress))
-            #chunking is supported and the file is big enough
+            #chunking is supported and the file is big enough,
+            #the chunks are read from the source as they are sent:
+            if data is None:
+                try:
+                    source = open(filename, "rb")
+                except OSError as e:
+                    filelog("open(%s)", filename, exc_info=True)
+                    filelog.error("Error: cannot read file '%s'", filename)
+                    filelog.error(" %s", e)
+                    return False
+            else:
+                source = BytesIO(data)
             chunk_id = uuid.uuid4().hex
             options["file-chunk-id"] = chunk_id
             #timer to check that the other end is requesting more chunks:
-            timer = self.timeout_add(CHUNK_TIMEOUT, self._check_chunk_sending, chunk_id, 0)
-            chunk_state = [monotonic_time(), data, chunk_size, timer, 0]
+            timer = self.timeout_add(CHUNK_TIMEOUT, self._check_chunk_sending, chunk_id, -1)
+            max_window = min(self.file_chunks_window, self.remote_file_chunks_window)
+            now = monotonic_time()
+            chunk_state = [
+                now, source, filesize, chunk_size, timer,
+                #window state: current size, maximum size, minimum rtt, send times
+                1, max_window, 0, {0 : now},
+                #the last chunk sent, the last chunk acknowledged:
+                0, -1,
+                ]
             self.send_chunks_in_progress[chunk_id] = chunk_state
             cdata = ""
         else:
             #send everything now:
+            if data is None:
+                data = load_binary_file(filename)
+                if data is None:
+                    filelog.error("Error: failed to load '%s'", filename)
+                    return False
+                data = data[:filesize]
             cdata = self.compressed_wrapper("file-data", data)
             assert len(cdata)<=filesize     #compressed wrapper ensures this is true
         basefilename = os.path.basename(filename)
@@ -881,7 +962,7 @@ class FileTransferHandler(FileTransferAttributes):
         chunk_state = self.send_chunks_in_progress.get(chunk_id)
         filelog("_check_chunk_sending(%s, %s) chunk_state found: %s", chunk_id, chunk_no, bool(chunk_state))
         if chunk_state:
-            chunk_state[3] = 0         #timer has fired
+            chunk_state[4] = 0         #timer has fired
             if chunk_state[-1]==chunk_no:
                 filelog.error("Error: chunked file transfer '%s' timed out", chunk_id)
                 filelog.error(" on chunk %i", chunk_no)
@@ -891,10 +972,14 @@ class FileTransferHandler(FileTransferAttributes):
         chunk_state = self.send_chunks_in_progress.pop(chunk_id, None)
         filelog("cancel_sending(%s) chunk state found: %s", chunk_id, bool(chunk_state))
         if chunk_state:
-            timer = chunk_state[3]
+            timer = chunk_state[4]
             if timer:
-                chunk_state[3] = 0
+                chunk_state[4] = 0
                 self.source_remove(timer)
+            source = chunk_state[1]
+            if source:
+                chunk_state[1] = None
+                source.close()
 
     def _process_ack_file_chunk(self, packet):
         #the other end received our send-file or send-file-chunk,
@@ -911,28 +996,54 @@ class FileTransferHandler(FileTransferAttributes):
         if not chunk_state:
             filelog.error("Error: cannot find the file transfer id '%s'", nonl(chunk_id))
             return
-        if chunk_state[-1]!=chunk:
-            filelog.error("Error: chunk number mismatch (%i vs %i)", chunk_state, chunk)
+        acked = chunk_state[-1]
+        if acked+1!=chunk:
+            filelog.error("Error: chunk number mismatch (%i vs %i)", acked+1, chunk)
             self.cancel_sending(chunk_id)
             return
-        start_time, data, chunk_size, timer, chunk = chunk_state
-        if not data:
+        start_time, source, filesize, chunk_size, timer, window, max_window, min_rtt, send_times, sent = chunk_state[:10]
+        now = monotonic_time()
+        #adapt the window size using the round trip time of this chunk:
+        rtt = now-send_times.pop(chunk, now)
+        if min_rtt==0 or rtt<min_rtt:
+            min_rtt = rtt
+        if rtt>min_rtt*2 and rtt-min_rtt>0.01:
+            #the chunks are being queued up somewhere:
+            window = max(1, window//2)
+        else:
+            window = min(max_window, window+1)
+        if not source and sent==chunk:
             #all sent!
-            elapsed = monotonic_time()-start_time
+            elapsed = now-start_time
             filelog("%i chunks of %i bytes sent in %ims (%sB/s)",
-                    chunk, chunk_size, elapsed*1000, std_unit(chunk*chunk_size/elapsed))
+                    chunk, chunk_size, elapsed*1000, std_unit(filesize/max(0.001, elapsed)))
             self.cancel_sending(chunk_id)
             return
         assert chunk_size>0
-        #carve out another chunk:
-        cdata = self.compressed_wrapper("file-data", data[:chunk_size])
-        data = data[chunk_size:]
-        chunk += 1
         if timer:
             self.source_remove(timer)
         timer = self.timeout_add(CHUNK_TIMEOUT, self._check_chunk_sending, chunk_id, chunk)
-        self.send_chunks_in_progress[chunk_id] = [start_time, data, chunk_size, timer, chunk]
-        self.send("send-file-chunk", chunk_id, chunk, cdata, bool(data))
+        chunk_state[4:] = [timer, window, max_window, min_rtt, send_times, sent, chunk]
+        #send more chunks until the window is full:
+        while source and sent-chunk<window:
+            try:
+                data = source.read(chunk_size)
+            except OSError as e:
+                filelog("read(%i)", chunk_size, exc_info=True)
+                filelog.error("Error: failed to read file data")
+                filelog.error(" %s", e)
+                self.cancel_sending(chunk_id)
+                return
+            has_more = len(data)==chunk_size and source.tell()<filesize
+            if not has_more:
+                source.close()
+                source = None
+                chunk_state[1] = None
+            cdata = self.compressed_wrapper("file-data", data)
+            sent += 1
+            chunk_state[9] = sent
+            send_times[sent] = monotonic_time()
+            self.send("send-file-chunk", chunk_id, sent, cdata, has_more)
 
     def send(self, *parts):
         raise NotImplementedError()
@@ -15,6 +15,8 @@ FLAGS_BENCODE   = 0x0       #assume bencode if not other flag is set
 FLAGS_RENCODE   = 0x1
 FLAGS_CIPHER    = 0x2
 FLAGS_YAML      = 0x4
+FLAGS_STREAM    = 0x8       #compressed using the connection's stream compressor
+FLAGS_STREAM_RESET = 0x10   #the first chunk of a new stream, start a new decompressor
 
 #compression flags are carried in the "level" field,
 #the low bits contain the compression level, the high bits the compression algo:
@@ -22,6 +24,7 @@ ZLIB_FLAG       = 0x0       #assume zlib if no other compression flag is set
 LZ4_FLAG        = 0x10
 LZO_FLAG        = 0x20
 BROTLI_FLAG     = 0x40
+ZSTD_FLAG       = 0x80
 FLAGS_NOHEADER  = 0x10000   #never encoded, so we can use a value bigger than a byte
 
 
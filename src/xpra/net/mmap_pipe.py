@@ -7,7 +7,7 @@ import os
 from ctypes import c_ubyte, c_char, c_uint32
 
 from xpra.util import roundup
-from xpra.os_util import memoryview_to_bytes, shellsub, get_group_id, get_groups, WIN32, POSIX
+from xpra.os_util import shellsub, get_group_id, get_groups, WIN32, POSIX
 from xpra.scripts.config import FALSE_OPTIONS, TRUE_OPTIONS
 from xpra.simple_stats import std_unit
 from xpra.log import Logger
@@ -269,7 +269,7 @@ def mmap_write(mmap_area, mmap_size, data):
     #mmap_area=[&S&E-------------data-------------]
     #The first pair of 4 bytes are occupied by:
     #S=data_start index is only updated by the client and tells us where it has read up to
-    #E=data_end index is only updated here and marks where we have written up to (matches current seek)
+    #E=data_end index is only updated here and marks where we have written up to
     # '-' denotes unused/available space
     # '+' is for data we have written
     # '*' is for data we have just written in this call
@@ -278,6 +278,9 @@ def mmap_write(mmap_area, mmap_size, data):
     mmap_data_end = int_from_buffer(mmap_area, 4)
     start = max(8, mmap_data_start.value)
     end = max(8, mmap_data_end.value)
+    #copy straight from the pixel buffer into the mmap area,
+    #without going through an intermediate bytes object:
+    data = memoryview(data).cast("B")
     l = len(data)
     log("mmap: start=%i, end=%i, size of data to write=%i", start, end, l)
     if end<start:
@@ -312,8 +315,7 @@ def mmap_write(mmap_area, mmap_size, data):
         #or if data already existed:
         #[+++++++++E------------------------]
         #[+++++++++**********E--------------]
-        mmap_area.seek(end)
-        mmap_area.write(memoryview_to_bytes(data))
+        mmap_area[end:end+l] = data
         chunks = [(end, l)]
         mmap_data_end.value = end+l
     else:
@@ -322,20 +324,17 @@ def mmap_write(mmap_area, mmap_size, data):
             # still plenty of free space, don't wrap around: just start again:
             #[------------------S+++++++++E------]
             #[*******E----------S+++++++++-------]
-            mmap_area.seek(8)
-            mmap_area.write(memoryview_to_bytes(data))
+            mmap_area[8:8+l] = data
             chunks = [(8, l)]
             mmap_data_end.value = 8+l
         else:
             # split in 2 chunks: wrap around the end of the mmap buffer:
             #[------------------S+++++++++E------]
             #[******E-----------S+++++++++*******]
-            mmap_area.seek(end)
-            mmap_area.write(memoryview_to_bytes(data[:chunk]))
-            mmap_area.seek(8)
-            mmap_area.write(memoryview_to_bytes(data[chunk:]))
             l2 = l-chunk
+            mmap_area[end:end+chunk] = data[:chunk]
+            mmap_area[8:8+l2] = data[chunk:]
             chunks = [(end, chunk), (8, l2)]
             mmap_data_end.value = 8+l2
-    log("sending damage with mmap: %s", data)
+    log("sending damage with mmap: %i bytes in %s", l, chunks)
     return chunks, mmap_free_size
@@ -369,6 +369,9 @@ def get_network_caps() -> dict:
                 "digest"                : digests,
                 "salt-digest"           : salt_digests,
                 "compressors"           : get_enabled_compressors(),
+                "compression-blocks"    : True,
+                "udp-fec"               : True,
+                "udp-pacing"            : True,
                 "encoders"              : get_enabled_encoders(),
                }
     caps.update(get_crypto_caps())
@@ -11,7 +11,7 @@
 import os
 from socket import error as socket_error
 from threading import Lock, Event
-from queue import Queue
+from queue import Queue, Empty
 
 from xpra.os_util import memoryview_to_bytes, strtobytes, bytestostr, hexstr, monotonic_time
 from xpra.util import repr_ellipsized, ellipsizer, csv, envint, envbool, typedict, nonl
@@ -24,12 +24,16 @@ from xpra.net.compression import (
     InvalidCompressionException, Compressed, LevelCompressed, Compressible, LargeStructure,
     )
 from xpra.net import packet_encoding
+from xpra.net.compression_pool import get_compression_pool, COMPRESS_THREADS, COMPRESS_BLOCK_SIZE
 from xpra.net.socket_util import guess_packet_type
 from xpra.net.packet_encoding import (
     decode, sanity_checks as packet_encoding_sanity_checks,
     InvalidPacketEncodingException,
     )
-from xpra.net.header import unpack_header, pack_header, FLAGS_CIPHER, FLAGS_NOHEADER, HEADER_SIZE
+from xpra.net.header import (
+    unpack_header, pack_header,
+    FLAGS_CIPHER, FLAGS_NOHEADER, FLAGS_STREAM, FLAGS_STREAM_RESET, HEADER_SIZE, ZSTD_FLAG,
+    )
 from xpra.net.crypto import get_encryptor, get_decryptor, pad, INITIAL_PADDING
 from xpra.log import Logger
 
@@ -48,7 +52,25 @@ INLINE_SIZE = envint("XPRA_INLINE_SIZE", 32768)
 FAKE_JITTER = envint("XPRA_FAKE_JITTER", 0)
 MIN_COMPRESS_SIZE = envint("XPRA_MIN_COMPRESS_SIZE", 378)
 SEND_INVALID_PACKET = envint("XPRA_SEND_INVALID_PACKET", 0)
+#maximum number of queued packets we write together:
+WRITE_BATCH = envint("XPRA_WRITE_BATCH", 16)
+#packets spanning multiple reads are copied into a receive buffer which is re-used,
+#unless they are larger than:
+RECEIVE_BUFFER_MAX = envint("XPRA_RECEIVE_BUFFER_MAX", 32*1024*1024)
 SEND_INVALID_PACKET_DATA = strtobytes(os.environ.get("XPRA_SEND_INVALID_PACKET_DATA", b"ZZinvalid-packetZZ"))
+#these packets must be sent in order, and as quickly as possible:
+LATENCY_PACKETS = ("draw", "cursor", "pointer-position", "button-action", "key-action",
+                   "sound-data", "webcam-frame", "ping", "ping_echo")
+
+
+def view_to_bytes(v) -> bytes:
+    """
+        Returns the bytes for this buffer,
+        without copying the data when the memoryview covers a whole bytes object.
+    """
+    if isinstance(v, memoryview) and isinstance(v.obj, bytes) and len(v)==len(v.obj):
+        return v.obj
+    return memoryview_to_bytes(v)
 
 
 def sanity_checks():
@@ -125,6 +147,9 @@ class Protocol:
     INVALID = "invalid"
 
     TYPE = "xpra"
+    #packets are never dropped or re-ordered,
+    #so we can use stream compression if the peer supports it:
+    STREAM_COMPRESSION = True
 
     def __init__(self, scheduler, conn, process_packet_cb, get_packet_cb=None):
         """
@@ -157,13 +182,18 @@ class Protocol:
         self.input_stats = {}
         self.input_packetcount = 0
         self.input_raw_packetcount = 0
+        self.input_joincount = 0
+        self.receive_buffer = bytearray()
         self.output_stats = {}
         self.output_packetcount = 0
         self.output_raw_packetcount = 0
+        self.output_batchcount = 0
+        self.write_batch = WRITE_BATCH
         #initial value which may get increased by client/server after handshake:
         self.max_packet_size = 4*1024*1024
         self.abs_max_packet_size = 256*1024*1024
-        self.large_packets = [b"hello", b"window-metadata", b"sound-data", b"notify_show", b"setting-change", b"shell-reply"]
+        self.large_packets = [b"hello", b"window-metadata", b"sound-data", b"notify_show", b"setting-change", b"shell-reply",
+                              b"compression-dictionary"]
         self.send_aliases = {}
         self.receive_aliases = {}
         self._log_stats = None          #None here means auto-detect
@@ -173,6 +203,17 @@ class Protocol:
         self.compressor = "none"
         self._compress = compression.get_compressor("none")
         self.compression_level = 0
+        self.compression_stream = False
+        self._stream_compress = None
+        #the new stream compressor which has not sent anything yet:
+        self._stream_reset = None
+        self._stream_decompress = {}
+        self.compression_saved = {}
+        #the peer can re-assemble items compressed in multiple blocks:
+        self.compression_blocks = False
+        #zstd dictionary options negotiated with the peer, and the context using them:
+        self.zstd_options = {}
+        self.zstd = None
         self.cipher_in = None
         self.cipher_in_name = None
         self.cipher_in_block_size = 0
@@ -186,12 +227,18 @@ class Protocol:
         self._read_thread = make_thread(self._read_thread_loop, "read", daemon=True)
         self._read_parser_thread = None         #started when needed
         self._write_format_thread = None        #started when needed
+        self._write_bulk_thread = None          #started when needed
+        self._bulk_queue = Queue()
+        self._bulk_pending = 0                  #guarded by the write lock
+        self._bulk_ordered = 0                  #non-bulk packets queued behind them, also guarded by the write lock
+        #held while compressing with the current zstd dictionary:
+        self._dictionary_lock = Lock()
         self._source_has_more = Event()
 
     STATE_FIELDS = ("max_packet_size", "large_packets", "send_aliases", "receive_aliases",
                     "cipher_in", "cipher_in_name", "cipher_in_block_size", "cipher_in_padding",
                     "cipher_out", "cipher_out_name", "cipher_out_block_size", "cipher_out_padding",
-                    "compression_level", "encoder", "compressor")
+                    "compression_level", "encoder", "compressor", "zstd_options")
 
     def save_state(self):
         state = {}
@@ -204,7 +251,10 @@ class Protocol:
         for x in Protocol.STATE_FIELDS:
             assert x in state, "field %s is missing" % x
             setattr(self, x, state[x])
-        #special handling for compressor / encoder which are named objects:
+        #special handling for compressor / encoder which are named objects,
+        #the stream compression context cannot be transferred,
+        #so we always start again with per-packet compression:
+        self.set_zstd_options(self.zstd_options)
         self.enable_compressor(self.compressor)
         self.enable_encoder(self.encoder)
 
@@ -264,6 +314,7 @@ class Protocol:
     def parse_remote_caps(self, caps : typedict):
         for k,v in caps.dictget("aliases", {}).items():
             self.send_aliases[bytestostr(k)] = v
+        self.compression_blocks = COMPRESS_THREADS>0 and caps.boolget("compression-blocks")
 
     def get_info(self, alias_info=True) -> dict:
         info = {
@@ -275,6 +326,9 @@ class Protocol:
         c = self.compressor
         if c:
             info["compressor"] = c
+            info["compression_stream"] = self.compression_stream
+        if self.zstd:
+            info["zstd"] = self.zstd.get_info()
         e = self.encoder
         if e:
             info["encoder"] = e
@@ -293,6 +347,8 @@ class Protocol:
                        "hangup-delay"           : self.hangup_delay,
                        "packetcount"            : self.input_packetcount,
                        "raw_packetcount"        : self.input_raw_packetcount,
+                       "joincount"              : self.input_joincount,
+                       "receive-buffer"         : len(self.receive_buffer),
                        "count"                  : self.input_stats,
                        "cipher"                 : {"": self.cipher_in_name or "",
                                                    "padding"        : self.cipher_in_padding,
@@ -305,14 +361,23 @@ class Protocol:
                         "min-compress-size"     : MIN_COMPRESS_SIZE,
                         "packetcount"           : self.output_packetcount,
                         "raw_packetcount"       : self.output_raw_packetcount,
+                        "batchcount"            : self.output_batchcount,
+                        "write-batch"           : self.write_batch,
                         "count"                 : self.output_stats,
+                        "compression-saved"     : self.compression_saved,
+                        "compression-blocks"    : self.compression_blocks,
+                        "bulk-queue"            : self._bulk_queue.qsize(),
                         "cipher"                : {"": self.cipher_out_name or "",
                                                    "padding" : self.cipher_out_padding
                                                    },
                         })
+        if c and self.output_packetcount>0:
+            syscalls = c.output_writecount+getattr(c, "output_sockoptcount", 0)
+            info["output"]["syscalls-per-packet"] = round(syscalls/self.output_packetcount, 2)
         shm = self._source_has_more
         info["has_more"] = shm and shm.is_set()
-        for t in (self._write_thread, self._read_thread, self._read_parser_thread, self._write_format_thread):
+        for t in (self._write_thread, self._read_thread, self._read_parser_thread,
+                  self._write_format_thread, self._write_bulk_thread):
             if t:
                 info.setdefault("thread", {})[t.name] = t.is_alive()
         return info
@@ -382,16 +447,104 @@ class Protocol:
             return
         #log("add_packet_to_queue(%s ... %s, %s, %s)", packet[0], synchronous, has_more, wait_for_more)
         packet_type = packet[0]
-        chunks = self.encode(packet)
+        if self.is_bulk(packet):
+            self.queue_bulk_packet(packet, start_send_cb, end_send_cb, fail_cb, synchronous)
+            return
+        #the latency sensitive packets can overtake the bulk packets,
+        #but not the other packets already queued behind them:
+        if self._bulk_pending and (self._bulk_ordered or bytestostr(packet_type) not in LATENCY_PACKETS):
+            self.queue_bulk_packet(packet, start_send_cb, end_send_cb, fail_cb, synchronous, True)
+            return
+        chunks = None
+        if not self._stream_compress:
+            chunks = self.encode(packet)
         with self._write_lock:
             if self._closed:
                 return
+            if chunks is None:
+                #the stream compressor must see the packets in the order they are sent:
+                chunks = self.encode(packet)
             try:
                 self._add_chunks_to_queue(packet_type, chunks, start_send_cb, end_send_cb, fail_cb, synchronous, has_more or wait_for_more)
             except:
                 log.error("Error: failed to queue '%s' packet", packet[0])
                 log("add_chunks_to_queue%s", (chunks, start_send_cb, end_send_cb, fail_cb), exc_info=True)
                 raise
+        zstd = self.zstd
+        if zstd and zstd.should_train():
+            self.send_compression_dictionary(zstd)
+
+    def is_bulk(self, packet) -> bool:
+        """
+            Packets with large payloads to compress are encoded by the 'bulk' thread,
+            so that the latency sensitive packets (draw, cursor, pointer, etc)
+            are not stuck behind them in the format thread.
+            The other packets are queued behind them,
+            and once they are, so are the latency sensitive packets - see _add_packet_to_queue.
+            The stream compressor must see the packets in order,
+            so this is only possible when compressing each packet on its own.
+        """
+        if not self.compression_blocks or self._stream_compress or self.compression_level==0:
+            return False
+        if bytestostr(packet[0]) in LATENCY_PACKETS:
+            return False
+        for item in packet[1:]:
+            if isinstance(item, (bytes, Compressible)) and len(item)>COMPRESS_BLOCK_SIZE:
+                return True
+        return False
+
+    def queue_bulk_packet(self, packet, start_send_cb=None, end_send_cb=None, fail_cb=None, synchronous=True, ordered=False):
+        log("queue_bulk_packet(%s, ..)", packet[0])
+        if not self._write_bulk_thread:
+            self._write_bulk_thread = start_thread(self.write_bulk_thread_loop, "bulk", daemon=True)
+        with self._write_lock:
+            self._bulk_pending += 1
+            if ordered:
+                self._bulk_ordered += 1
+        self._bulk_queue.put((packet, start_send_cb, end_send_cb, fail_cb, synchronous, ordered))
+
+    def write_bulk_thread_loop(self):
+        log("write_bulk_thread_loop starting")
+        try:
+            while not self._closed:
+                item = self._bulk_queue.get()
+                if item is None or self._closed:
+                    return
+                packet, start_send_cb, end_send_cb, fail_cb, synchronous, ordered = item
+                #the zstd dictionary must not change until this packet is queued:
+                with self._dictionary_lock:
+                    chunks = None
+                    if not self._stream_compress:
+                        chunks = self.encode(packet)
+                    with self._write_lock:
+                        self._bulk_pending -= 1
+                        if ordered:
+                            self._bulk_ordered -= 1
+                        if self._closed:
+                            return
+                        if chunks is None:
+                            chunks = self.encode(packet)
+                        self._add_chunks_to_queue(packet[0], chunks, start_send_cb, end_send_cb, fail_cb, synchronous)
+        except Exception as e:
+            if self._closed:
+                return
+            self._internal_error("error in network bulk packet write/format", e, exc_info=True)
+
+    def send_compression_dictionary(self, zstd):
+        data = zstd.train()
+        if not data:
+            return
+        log("sending %i bytes zstd dictionary", len(data))
+        packet = ("compression-dictionary", Compressed("zstd-dictionary", data))
+        #this packet is compressed with the previous dictionary,
+        #the packets queued after it will use the new one,
+        #including the bulk packets which are still pending:
+        with self._dictionary_lock:
+            with self._write_lock:
+                if self._closed:
+                    return
+                self._add_chunks_to_queue(packet[0], self.encode(packet))
+            zstd.use_trained()
 
     def _add_chunks_to_queue(self, packet_type, chunks, start_send_cb=None, end_send_cb=None, fail_cb=None, synchronous=True, more=False):
         """ the write_lock must be held when calling this function """
@@ -488,7 +641,14 @@ class Protocol:
         else:
             self.enable_compressor("none")
 
+    def set_zstd_options(self, options):
+        self.zstd_options = options
+        if compression.use("zstd"):
+            self.zstd = compression.ZstdContext(**options)
+            log("set_zstd_options(%s) %s", options, self.zstd)
+
     def enable_compressor_from_caps(self, caps):
+        self.set_zstd_options(compression.get_zstd_options(caps))
         if self.compression_level==0:
             self.enable_compressor("none")
             return
@@ -496,15 +656,30 @@ class Protocol:
         log("enable_compressor_from_caps(..) options=%s", opts)
         for c in opts:      #ie: [zlib, lz4, lzo]
             if caps.boolget(c):
-                self.enable_compressor(c)
+                stream = self.STREAM_COMPRESSION and compression.STREAM and \
+                    c in compression.STREAM_COMPRESSORS and caps.boolget("%s.stream" % c)
+                self.enable_compressor(c, stream)
                 return
         log.warn("compression disabled: no matching compressor found")
         self.enable_compressor("none")
 
-    def enable_compressor(self, compressor):
-        self._compress = compression.get_compressor(compressor)
+    def enable_compressor(self, compressor, stream=False):
+        #encode() checks '_stream_compress' after '_compress',
+        #so we must update it first:
+        if stream:
+            self._stream_compress = compression.get_stream_compressor(compressor, self.compression_level)
+            #tell the peer to start a new decompressor:
+            self._stream_reset = self._stream_compress
+            self._compress = self._stream_compress
+        else:
+            self._stream_compress = None
+            if compressor=="zstd" and self.zstd:
+                self._compress = self.zstd.compress
+            else:
+                self._compress = compression.get_compressor(compressor)
         self.compressor = compressor
-        log("enable_compressor(%s): %s", compressor, self._compress)
+        self.compression_stream = stream
+        log("enable_compressor(%s, %s): %s", compressor, stream, self._compress)
 
 
     def encode(self, packet_in):
@@ -524,6 +699,8 @@ class Protocol:
         packets = []
         packet = list(packet_in)
         level = self.compression_level
+        compress = self._compress
+        stream_flag = FLAGS_STREAM if compress is self._stream_compress else 0
         size_check = LARGE_PACKET_SIZE
         min_comp_size = MIN_COMPRESS_SIZE
         for i in range(1, len(packet)):
@@ -540,7 +717,11 @@ class Protocol:
             if ti==LargeStructure:
                 packet[i] = item.data
                 continue
-            if ti==Compressible:
+            if ti==Compressible and self.compression_blocks and not stream_flag and level>0 and l>COMPRESS_BLOCK_SIZE:
+                #large enough to compress the data ourselves, using multiple blocks:
+                item = item.data
+                ti = type(item)
+            elif ti==Compressible:
                 #this is a marker used to tell us we should compress it now
                 #(used by the client for clipboard data)
                 item = item.compress()
@@ -564,11 +745,17 @@ class Protocol:
                     min_comp_size += l
                     size_check += l
             elif ti==bytes and level>0 and l>LARGE_PACKET_SIZE:
-                log.warn("Warning: found a large uncompressed item")
-                log.warn(" in packet '%s' at position %i: %s bytes", packet[0], i, len(item))
-                #add new binary packet with large item:
-                cl, cdata = self._compress(item, level)
-                packets.append((0, i, cl, cdata))
+                if l<=COMPRESS_BLOCK_SIZE:
+                    log.warn("Warning: found a large uncompressed item")
+                    log.warn(" in packet '%s' at position %i: %s bytes", packet[0], i, len(item))
+                #add new binary packets with large item:
+                if self.compression_blocks and not stream_flag:
+                    blocks = get_compression_pool().compress_blocks(compress, item, level)
+                else:
+                    blocks = (compress(item, level), )
+                for cl, cdata in blocks:
+                    packets.append((self.get_stream_flags(compress) if stream_flag else 0, i, cl, cdata))
+                self.record_compression(packet[0], l, sum(len(cdata) for _, cdata in blocks))
                 #replace this item with an empty string placeholder:
                 packet[i] = ''
             elif ti not in (str, bytes):
@@ -603,17 +790,31 @@ class Protocol:
         #compress, but don't bother for small packets:
         if level>0 and len(main_packet)>min_comp_size:
             try:
-                cl, cdata = self._compress(main_packet, level)
+                cl, cdata = compress(main_packet, level)
             except Exception as e:
                 log.error("Error compressing '%s' packet", packet_type)
                 log.error(" %s", e)
                 raise
+            if stream_flag:
+                proto_flags |= self.get_stream_flags(compress)
             packets.append((proto_flags, 0, cl, cdata))
+            self.record_compression(packet_type, len(main_packet), len(cdata))
         else:
             packets.append((proto_flags, 0, 0, main_packet))
         may_log_packet(True, packet_type, packet)
         return packets
 
+    def get_stream_flags(self, compress) -> int:
+        """ the first chunk compressed by a new stream compressor also resets the peer's decompressor """
+        if self._stream_reset is compress:
+            self._stream_reset = None
+            return FLAGS_STREAM | FLAGS_STREAM_RESET
+        return FLAGS_STREAM
+
+    def record_compression(self, packet_type, size, compressed_size):
+        saved = self.compression_saved
+        saved[packet_type] = saved.get(packet_type, 0) + size - compressed_size
+
     def set_compression_level(self, level : int):
         #this may be used next time encode() is called
         assert 0<=level<=10, "invalid compression level: %s (must be between 0 and 10" % level
@@ -650,51 +851,111 @@ class Protocol:
             log("write thread: empty marker, exiting")
             self.close()
             return False
-        return self.write_items(*items)
+        #write any other packets that are ready along with this one:
+        batch = [items]
+        exit_marker = False
+        while len(batch)<self.write_batch:
+            try:
+                items = self._write_queue.get_nowait()
+            except Empty:
+                break
+            if items is None:
+                exit_marker = True
+                break
+            batch.append(items)
+        r = self.write_batch_items(batch)
+        if exit_marker:
+            log("write thread: empty marker, exiting")
+            self.close()
+            return False
+        return r
 
     def write_items(self, buf_data, start_cb=None, end_cb=None, fail_cb=None, synchronous=True, more=False):
+        return self.write_batch_items(((buf_data, start_cb, end_cb, fail_cb, synchronous, more), ))
+
+    def write_batch_items(self, batch):
+        """
+            Writes the buffers of all the packets in the batch
+            (each item is: buf_data, start_cb, end_cb, fail_cb, synchronous, more)
+            The start and end callbacks are called with the output byte count
+            at the position of their packet in the stream.
+        """
         conn = self._conn
         if not conn:
             return False
-        if more or len(buf_data)>1:
+        buf_data = []
+        for items in batch:
+            buf_data += items[0]
+        more = batch[-1][5]
+        #with vectored writes, all the buffers are sent with a single call
+        #so we don't need to use TCP_CORK or disable TCP_NODELAY for them:
+        vectored = getattr(conn, "vectored_writes", False)
+        cork = len(buf_data)>1 and not vectored
+        if more or cork:
             conn.set_nodelay(False)
-        if len(buf_data)>1:
+        if cork:
             conn.set_cork(True)
-        if start_cb:
-            try:
-                start_cb(conn.output_bytecount)
-            except Exception:
-                if not self._closed:
-                    log.error("Error on write start callback %s", start_cb, exc_info=True)
-        self.write_buffers(buf_data, fail_cb, synchronous)
-        if len(buf_data)>1:
+        pos = conn.output_bytecount
+        for items in batch:
+            start_cb = items[1]
+            if start_cb:
+                try:
+                    start_cb(pos)
+                except Exception:
+                    if not self._closed:
+                        log.error("Error on write start callback %s", start_cb, exc_info=True)
+            pos += sum(len(buf) for buf in items[0])
+        if len(batch)==1:
+            self.write_buffers(buf_data, batch[0][3], batch[0][4])
+        else:
+            self.write_buffers(buf_data, None, True)
+            self.output_packetcount += len(batch)-1
+            self.output_batchcount += 1
+        if cork:
             conn.set_cork(False)
         if not more:
             conn.set_nodelay(True)
-        if end_cb:
-            try:
-                end_cb(self._conn.output_bytecount)
-            except Exception:
-                if not self._closed:
-                    log.error("Error on write end callback %s", end_cb, exc_info=True)
+        pos = conn.output_bytecount-sum(sum(len(buf) for buf in items[0]) for items in batch)
+        for items in batch:
+            pos += sum(len(buf) for buf in items[0])
+            end_cb = items[2]
+            if end_cb:
+                try:
+                    end_cb(pos)
+                except Exception:
+                    if not self._closed:
+                        log.error("Error on write end callback %s", end_cb, exc_info=True)
         return True
 
     def write_buffers(self, buf_data, _fail_cb, _synchronous):
         con = self._conn
         if not con:
             return
-        for buf in buf_data:
-            while buf and not self._closed:
-                written = self.con_write(con, buf)
-                #example test code, for sending small chunks very slowly:
-                #written = con.write(buf[:1024])
-                #import time
-                #time.sleep(0.05)
-                if written:
-                    buf = buf[written:]
-                    self.output_raw_packetcount += 1
+        buffers = [buf for buf in buf_data if buf]
+        while buffers and not self._closed:
+            if len(buffers)==1:
+                written = self.con_write(con, buffers[0])
+            else:
+                written = self.con_writev(con, buffers)
+            #example test code, for sending small chunks very slowly:
+            #written = con.write(buf[:1024])
+            #import time
+            #time.sleep(0.05)
+            if written:
+                self.output_raw_packetcount += 1
+                #remove what has been sent:
+                while written>0:
+                    l = len(buffers[0])
+                    if written<l:
+                        buffers[0] = memoryview(buffers[0])[written:]
+                        break
+                    written -= l
+                    buffers.pop(0)
         self.output_packetcount += 1
 
+    def con_writev(self, con, buffers):
+        return con.writev(buffers)
+
     def con_write(self, con, buf):
         return con.write(buf)
 
@@ -791,6 +1052,44 @@ class Protocol:
                 return
             self._internal_error("error in network packet reading/parsing", e, exc_info=True)
 
+    def join_read_buffers(self, read_buffers, payload_size, reuse=True):
+        """
+            Joins the first payload_size bytes from read_buffers,
+            returns this data and the list of buffers left over.
+            When 'reuse' is set, the data is a memoryview of the receive buffer,
+            which will be overwritten by the next packet:
+            it can only be used for data that is decompressed or decrypted
+            before the packet is processed.
+        """
+        pieces = []
+        pos = 0
+        while pos<payload_size:
+            buf = read_buffers.pop(0)
+            size = min(len(buf), payload_size-pos)
+            if size<len(buf):
+                #keep the left over:
+                read_buffers.insert(0, buf[size:])
+                buf = buf[:size]
+            pieces.append(buf)
+            pos += size
+        self.input_joincount += 1
+        if not reuse:
+            return b"".join(pieces), read_buffers
+        if payload_size<=RECEIVE_BUFFER_MAX:
+            if len(self.receive_buffer)<payload_size:
+                #grow it, in steps of READ_BUFFER_SIZE:
+                size = (payload_size+READ_BUFFER_SIZE-1)//READ_BUFFER_SIZE*READ_BUFFER_SIZE
+                self.receive_buffer = bytearray(min(RECEIVE_BUFFER_MAX, size))
+            rbuf = self.receive_buffer
+        else:
+            rbuf = bytearray(payload_size)
+        view = memoryview(rbuf)
+        pos = 0
+        for buf in pieces:
+            view[pos:pos+len(buf)] = buf
+            pos += len(buf)
+        return view[:payload_size], read_buffers
+
     def do_read_parse_thread_loop(self):
         """
             Process the individual network packets placed in _read_queue.
@@ -817,18 +1116,24 @@ class Protocol:
                 self.idle_add(self.close)
                 return
 
-            read_buffers.append(buf)
+            #slicing a memoryview does not copy the data:
+            read_buffers.append(memoryview(buf))
             while read_buffers:
                 #have we read the header yet?
                 if payload_size<0:
                     #try to handle the first buffer:
                     buf = read_buffers[0]
                     if not header and buf[0]!=ord("P"):
-                        self.invalid_header(self, buf, "invalid packet header byte %s" % nonl(repr_ellipsized(buf)))
+                        data = memoryview_to_bytes(buf)
+                        self.invalid_header(self, data, "invalid packet header byte %s" % nonl(repr_ellipsized(data)))
                         return
                     #how much to we need to slice off to complete the header:
                     read = min(len(buf), HEADER_SIZE-len(header))
-                    header += memoryview_to_bytes(buf[:read])
+                    if not header and read==HEADER_SIZE:
+                        #the whole header is in this buffer, no need to copy it:
+                        header = buf[:HEADER_SIZE]
+                    else:
+                        header = memoryview_to_bytes(header) + memoryview_to_bytes(buf[:read])
                     if len(header)<HEADER_SIZE:
                         #need to process more buffers to get a full header:
                         read_buffers.pop(0)
@@ -847,7 +1152,7 @@ class Protocol:
 
                     #sanity check size (will often fail if not an xpra client):
                     if data_size>self.abs_max_packet_size:
-                        self.invalid_header(self, header, "invalid size in packet header: %s" % data_size)
+                        self.invalid_header(self, memoryview_to_bytes(header), "invalid size in packet header: %s" % data_size)
                         return
 
                     if protocol_flags & FLAGS_CIPHER:
@@ -855,7 +1160,7 @@ class Protocol:
                             cryptolog.warn("Warning: received cipher block,")
                             cryptolog.warn(" but we don't have a cipher to decrypt it with,")
                             cryptolog.warn(" not an xpra client?")
-                            self.invalid_header(self, header, "invalid encryption packet flag (no cipher configured)")
+                            self.invalid_header(self, memoryview_to_bytes(header), "invalid encryption packet flag (no cipher configured)")
                             return
                         padding_size = self.cipher_in_block_size - (data_size % self.cipher_in_block_size)
                         payload_size = data_size + padding_size
@@ -878,7 +1183,7 @@ class Protocol:
                                               (size_to_check, self.max_packet_size)
                                 self.invalid(msg, packet_header)
                             return False
-                        self.timeout_add(1000, check_packet_size, payload_size, header)
+                        self.timeout_add(1000, check_packet_size, payload_size, memoryview_to_bytes(header))
 
                 #how much data do we have?
                 bl = sum(len(v) for v in read_buffers)
@@ -896,20 +1201,15 @@ class Protocol:
                     data = buf[:payload_size]
                 else:
                     #we need to aggregate chunks,
-                    #just concatenate them all:
-                    data = b"".join(read_buffers)
-                    if bl==payload_size:
-                        #nothing left:
-                        read_buffers = []
-                    else:
-                        #keep the left over:
-                        read_buffers = [data[payload_size:]]
-                        data = data[:payload_size]
+                    #compressed or encrypted data can use the receive buffer
+                    #since it is copied again when we decompress or decrypt it:
+                    reuse = compression_level>0 or bool(self.cipher_in)
+                    data, read_buffers = self.join_read_buffers(read_buffers, payload_size, reuse)
 
                 #decrypt if needed:
                 if self.cipher_in:
                     if not protocol_flags & FLAGS_CIPHER:
-                        self.invalid("unencrypted packet dropped", data)
+                        self.invalid("unencrypted packet dropped", memoryview_to_bytes(data))
                         return
                     cryptolog("received %i %s encrypted bytes with %i padding",
                               payload_size, self.cipher_in_name, padding_size)
@@ -940,9 +1240,15 @@ class Protocol:
                 #uncompress if needed:
                 if compression_level>0:
                     try:
-                        data = decompress(data, compression_level)
+                        if protocol_flags & FLAGS_STREAM:
+                            data = self.stream_decompress(data, compression_level, protocol_flags & FLAGS_STREAM_RESET)
+                        elif compression_level & ZSTD_FLAG and self.zstd:
+                            #we may need the dictionaries the peer has sent us:
+                            data = self.zstd.decompress(data)
+                        else:
+                            data = decompress(data, compression_level)
                     except InvalidCompressionException as e:
-                        self.invalid("invalid compression: %s" % e, data)
+                        self.invalid("invalid compression: %s" % e, memoryview_to_bytes(data))
                         return
                     except Exception as e:
                         ctype = compression.get_compression_type(compression_level)
@@ -955,7 +1261,7 @@ class Protocol:
                             #as this may leak crypto information:
                             msg += " %s" % e
                         del e
-                        self.gibberish(msg, data)
+                        self.gibberish(msg, memoryview_to_bytes(data))
                         return
 
                 if self._closed:
@@ -966,17 +1272,19 @@ class Protocol:
                 header = b""
                 if packet_index>0:
                     #raw packet, store it and continue:
-                    raw_packets[packet_index] = data
+                    #(the data may be a view of the receive buffer, which will be re-used)
+                    #large items may be sent in multiple blocks using the same index:
+                    raw_packets.setdefault(packet_index, []).append(view_to_bytes(data))
                     payload_size = -1
                     if len(raw_packets)>=4:
-                        self.invalid("too many raw packets: %s" % len(raw_packets), data)
+                        self.invalid("too many raw packets: %s" % len(raw_packets), raw_packets[packet_index][0])
                         return
                     continue
                 #final packet (packet_index==0), decode it:
                 try:
-                    packet = list(decode(data, protocol_flags))
+                    packet = list(decode(view_to_bytes(data), protocol_flags))
                 except InvalidPacketEncodingException as e:
-                    self.invalid("invalid packet encoding: %s" % e, data)
+                    self.invalid("invalid packet encoding: %s" % e, memoryview_to_bytes(data))
                     return
                 except ValueError as e:
                     etype = packet_encoding.get_packet_encoding_type(protocol_flags)
@@ -984,6 +1292,7 @@ class Protocol:
                     log.error(" %s", e)
                     if self._closed:
                         return
+                    data = memoryview_to_bytes(data)
                     log("failed to parse %s packet: %s", etype, hexstr(data[:128]))
                     log(" %s", e)
                     log(" data: %s", repr_ellipsized(data))
@@ -996,9 +1305,12 @@ class Protocol:
                 payload_size = -1
                 #add any raw packets back into it:
                 if raw_packets:
-                    for index,raw_data in raw_packets.items():
+                    for index,blocks in raw_packets.items():
                         #replace placeholder with the raw_data packet data:
-                        packet[index] = raw_data
+                        if len(blocks)==1:
+                            packet[index] = blocks[0]
+                        else:
+                            packet[index] = b"".join(blocks)
                     raw_packets = {}
 
                 packet_type = packet[0]
@@ -1006,6 +1318,14 @@ class Protocol:
                     packet_type = self.receive_aliases.get(packet_type)
                     if packet_type:
                         packet[0] = packet_type
+                if bytestostr(packet_type)=="compression-dictionary":
+                    if not self.zstd or not self.zstd.receive:
+                        self.invalid("unexpected compression dictionary", packet_type)
+                        return
+                    #the peer uses this dictionary for the packets that follow,
+                    #so we must add it before parsing them:
+                    self.zstd.add_dictionary(packet[1])
+                    continue
                 self.input_stats[packet_type] = self.output_stats.get(packet_type, 0)+1
                 if LOG_RAW_PACKET_SIZE:
                     log("%s: %i bytes", packet_type, HEADER_SIZE + payload_size)
@@ -1015,6 +1335,15 @@ class Protocol:
                 self._process_packet_cb(self, packet)
                 packet = None
 
+    def stream_decompress(self, data, level, reset=False):
+        #the peer flags the first chunk of each new stream,
+        #so we can create the matching decompressor on demand:
+        algo = compression.get_compression_type(level)
+        d = self._stream_decompress.get(algo)
+        if d is None or reset:
+            d = self._stream_decompress[algo] = compression.get_stream_decompressor(algo)
+        return d(data)
+
     def flush_then_close(self, last_packet, done_callback=None):    #pylint: disable=method-hidden
         """ Note: this is best effort only
             the packet may not get sent.
@@ -1166,10 +1495,12 @@ class Protocol:
         self._read_thread = None
         self._read_parser_thread = None
         self._write_format_thread = None
+        self._write_bulk_thread = None
         self._process_packet_cb = None
         self._process_read = None
         self._read_queue_put = None
         self._compress = None
+        self._stream_compress = None
         self._write_lock = None
         self._source_has_more = None
         self._conn = None       #should be redundant
@@ -1192,5 +1523,9 @@ class Protocol:
         orq = self._read_queue
         self._read_queue = exit_queue()
         force_flush_queue(orq)
+        #bulk queue:
+        obq = self._bulk_queue
+        self._bulk_queue = exit_queue()
+        force_flush_queue(obq)
         #just in case the read thread is waiting again:
         self._source_has_more.set()
@@ -255,7 +255,7 @@ def guess_packet_type(data):
         from xpra.net.header import (
             unpack_header, HEADER_SIZE,
             FLAGS_RENCODE, FLAGS_YAML,
-            LZ4_FLAG, LZO_FLAG, BROTLI_FLAG,
+            LZ4_FLAG, LZO_FLAG, BROTLI_FLAG, ZSTD_FLAG,
             )
         header = data.ljust(HEADER_SIZE, b"\0")
         _, protocol_flags, compression_level, packet_index, data_size = unpack_header(header)
@@ -269,9 +269,10 @@ def guess_packet_type(data):
             lz4 = bool(protocol_flags & LZ4_FLAG)
             lzo = bool(protocol_flags & LZO_FLAG)
             brotli = bool(protocol_flags & BROTLI_FLAG)
+            zstd = bool(protocol_flags & ZSTD_FLAG)
             #rencode and yaml are mutually exclusive,
             #so are the compressors
-            compressors = sum((lz4, lzo, brotli))
+            compressors = sum((lz4, lzo, brotli, zstd))
             if not (rencode and yaml) and not compressors>1:
                 #if compression is enabled, the compression level must be set:
                 if not compressors or compression_level>0:
@@ -3,12 +3,14 @@
 # Xpra is released under the terms of the GNU GPL v2, or, at your option, any
 # later version. See the file COPYING for details.
 
+import time
 import socket
 import struct
 import random
+from collections import deque
 
 from xpra.os_util import LINUX, monotonic_time, memoryview_to_bytes, hexstr
-from xpra.util import envint, ellipsizer
+from xpra.util import envint, envbool, envfloat, ellipsizer
 from xpra.make_thread import start_thread
 from xpra.net.protocol import Protocol, READ_BUFFER_SIZE
 from xpra.net.bytestreams import SocketConnection, can_retry
@@ -28,6 +30,29 @@ MIN_MTU = envint("XPRA_UDP_MIN_MTU", 576)
 MAX_MTU = envint("XPRA_UDP_MAX_MTU", 65536)
 assert MAX_MTU>MIN_MTU
 
+#send all the chunks of a packet with a single syscall using UDP segmentation offload:
+GSO = envbool("XPRA_UDP_GSO", LINUX)
+#from linux/udp.h:
+UDP_SEGMENT = 103
+GSO_MAX_SEGMENTS = 64
+GSO_MAX_SIZE = 65000
+#forward error correction:
+FEC = envbool("XPRA_UDP_FEC", True)
+#the loss rate (per thousand chunks) above which we start sending parity chunks:
+FEC_MIN_LOSS = envint("XPRA_UDP_FEC_MIN_LOSS", 5)
+FEC_MIN_GROUP = envint("XPRA_UDP_FEC_MIN_GROUP", 4)
+FEC_MAX_GROUP = envint("XPRA_UDP_FEC_MAX_GROUP", 32)
+#congestion control:
+PACING = envbool("XPRA_UDP_PACING", True)
+PACING_GAIN = envfloat("XPRA_UDP_PACING_GAIN", 1.25)
+PACING_BURST_MS = envint("XPRA_UDP_PACING_BURST_MS", 5)
+PACING_MAX_WAIT_MS = envint("XPRA_UDP_PACING_MAX_WAIT_MS", 5)
+MIN_PACING_RATE = envint("XPRA_UDP_MIN_PACING_RATE", 64*1024)
+#the loss rate (per thousand chunks) which we treat as congestion:
+CONGESTION_LOSS = envint("XPRA_UDP_CONGESTION_LOSS", 20)
+#re-measure the minimum round trip time this often:
+MIN_RTT_EXPIRY = 10
+
 def clamp_mtu(mtu):
     return max(MIN_MTU, min(MAX_MTU, mtu))
 
@@ -35,6 +60,72 @@ def clamp_mtu(mtu):
 #UUID, seqno, synchronous, chunk, chunks
 _header_struct = struct.Struct(b'!QQHHH')
 _header_size = _header_struct.size
+#parity chunks start with the group size,
+#and the chunk lengths are xored with the data:
+_fec_struct = struct.Struct(b'!H')
+_length_struct = struct.Struct(b'!H')
+FEC_OVERHEAD = _fec_struct.size+_length_struct.size
+_gso_struct = struct.Struct(b'=H')
+
+
+def fec_xor(chunks, width):
+    """
+        xor the chunks together,
+        each one prefixed with its length and padded to the same width
+    """
+    v = 0
+    for chunk in chunks:
+        v ^= int.from_bytes(_length_struct.pack(len(chunk))+bytes(chunk).ljust(width, b"\0"), "big")
+    return v.to_bytes(_length_struct.size+width, "big")
+
+def fec_parity(chunks, width, group_size):
+    """ the parity chunk for this group of chunks """
+    return _fec_struct.pack(group_size)+fec_xor(chunks, width)
+
+def fec_recover(parity, chunks):
+    """
+        rebuild the chunk missing from this group,
+        using the parity chunk and all the other chunks of the group
+    """
+    body = memoryview(parity)[_fec_struct.size:]
+    width = len(body)-_length_struct.size
+    v = int.from_bytes(body, "big") ^ int.from_bytes(fec_xor(chunks, width), "big")
+    data = v.to_bytes(len(body), "big")
+    l = _length_struct.unpack_from(data)[0]
+    return data[_length_struct.size:_length_struct.size+l]
+
+def fec_group_size(loss):
+    """
+        the number of chunks protected by each parity chunk,
+        a single parity chunk can only repair one chunk in each group,
+        so the groups get smaller as the loss rate increases
+    """
+    if loss<FEC_MIN_LOSS:
+        return 0
+    return max(FEC_MIN_GROUP, min(FEC_MAX_GROUP, 100//loss))
+
+def gso_batches(datagrams, max_size=GSO_MAX_SIZE):
+    """
+        split the datagrams into batches suitable for UDP segmentation offload:
+        all the datagrams in a batch have the same size,
+        except for the last one which may be smaller
+    """
+    batch = []
+    size = 0
+    for d in datagrams:
+        l = len(d)
+        if batch and (l>len(batch[0]) or size+l>max_size):
+            yield batch
+            batch = []
+            size = 0
+        batch.append(d)
+        size += l
+        if len(batch)==GSO_MAX_SEGMENTS or l<len(batch[0]):
+            yield batch
+            batch = []
+            size = 0
+    if batch:
+        yield batch
 
 
 def h(v):
@@ -48,10 +139,108 @@ class PendingPacket:
         self.last_time = start_time
         self.chunk_gap = 0
         self.chunks = chunks
+        self.parity = {}
     def __repr__(self):
         return "PendingPacket(%i: %s chunks)" % (self.seqno, len(self.chunks or b""))
 
 
+class PacingController:
+    """
+        A simple delay based congestion controller:
+        the bottleneck bandwidth is the highest delivery rate measured recently,
+        ignoring the samples taken while the sender did not have enough data
+        in flight to fill the link (ie: an idle terminal).
+        We only pace the chunks once the round trip time or the loss rate go up,
+        slower than the bottleneck bandwidth, then we ramp up again
+        until we stop pacing altogether.
+    """
+    def __init__(self):
+        self.rate = 0               #bytes per second, 0 means unlimited
+        self.next_send = 0
+        self.srtt = 0
+        self.min_rtt = 0
+        self.min_rtt_time = 0
+        self.bandwidth = 0
+        self.delivery_rates = deque(maxlen=10)
+        self.delivered = 0
+        self.delivered_time = 0
+        self.congested = False
+
+    def record_rtt(self, rtt, now):
+        if self.min_rtt==0 or rtt<=self.min_rtt or now-self.min_rtt_time>MIN_RTT_EXPIRY:
+            self.min_rtt = rtt
+            self.min_rtt_time = now
+        if self.srtt==0:
+            self.srtt = rtt
+        else:
+            self.srtt = (self.srtt*7+rtt)/8
+
+    def is_app_limited(self, inflight):
+        """ the sender is not sending enough data to fill the link we have measured """
+        return inflight<self.bandwidth*self.srtt
+
+    def record_delivery(self, delivered, now, app_limited=False):
+        """ the other end has received all the bytes up to 'delivered' """
+        if self.delivered_time and delivered>self.delivered and now>self.delivered_time:
+            rate = int((delivered-self.delivered)/(now-self.delivered_time))
+            #app limited samples can only tell us that the link is faster:
+            if not app_limited or rate>self.bandwidth:
+                self.delivery_rates.append(rate)
+                self.bandwidth = max(self.delivery_rates)
+        self.delivered = delivered
+        self.delivered_time = now
+
+    def get_queueing_delay(self):
+        return max(0, self.srtt-self.min_rtt)
+
+    def update(self, loss):
+        """ adjust the pacing rate, returns True if the network is congested """
+        if not self.bandwidth:
+            return False
+        qdelay = self.get_queueing_delay()
+        self.congested = loss>=CONGESTION_LOSS or qdelay>max(0.005, self.min_rtt/2)
+        if self.congested:
+            self.rate = max(MIN_PACING_RATE, int(self.bandwidth*0.8))
+        elif self.rate:
+            #ramp up, and stop pacing once we are well above the bottleneck bandwidth:
+            self.rate = int(self.rate*PACING_GAIN)
+            if self.rate>=self.bandwidth*2:
+                self.rate = 0
+        return self.congested
+
+    def get_batch_size(self, mtu):
+        """ how many bytes we can send in one burst """
+        if not self.rate:
+            return GSO_MAX_SIZE
+        return max(mtu*2, min(GSO_MAX_SIZE, self.rate*PACING_BURST_MS//1000))
+
+    def wait(self, size):
+        """ wait until we are allowed to send 'size' bytes """
+        rate = self.rate
+        if not rate:
+            return
+        now = monotonic_time()
+        #never block the write thread for long:
+        max_wait = PACING_MAX_WAIT_MS/1000
+        delay = min(max_wait, self.next_send-now)
+        if delay>0:
+            time.sleep(delay)
+            now += delay
+        #allow short bursts after idle periods:
+        next_send = max(now-PACING_BURST_MS/1000, self.next_send)+size/rate
+        #and don't carry over more delay than we are willing to wait for:
+        self.next_send = min(now+max_wait, next_send)
+
+    def get_info(self) -> dict:
+        return {
+            "rate"          : self.rate,
+            "bandwidth"     : self.bandwidth,
+            "srtt"          : int(1000*self.srtt),
+            "min-rtt"       : int(1000*self.min_rtt),
+            "congested"     : self.congested,
+            }
+
+
 class UDPListener:
     """
         This class is used by servers to receive UDP packets,
@@ -123,9 +312,14 @@ class UDPProtocol(Protocol):
         (or the packet data if no function is supplied).
         "udp-control" packets are used to synchronize both ends.
     """
+    #packets may be dropped or re-ordered,
+    #so each packet must be compressed on its own:
+    STREAM_COMPRESSION = False
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args)
+        #each packet is sent with its own sequence number:
+        self.write_batch = 1
         self.mtu = 0
         self.last_sequence = -1     #the most recent packet sequence we processed in full
         self.highest_sequence = -1
@@ -140,12 +334,35 @@ class UDPProtocol(Protocol):
         self.control_timer_due = 0
         self.asynchronous_send_enabled = False
         self.asynchronous_receive_enabled = False
+        #negotiated with the hello packet:
+        self.fec = False
+        self.gso = GSO
+        self.output_gso_count = 0
+        #loss rate per thousand chunks, as reported by the other end:
+        self.loss = 0
+        self.loss_raw_packetcount = 0
+        self.fec_sent = 0
+        self.fec_recovered = 0
+        #pacing:
+        self.pacing = False
+        self.pacer = PacingController()
+        self.congestion_cb = None
+        self.congestion_time = 0
+        self.send_records = {}      #seqno: (time, total bytes sent, app limited)
+        self.output_bytes = 0
+        self.last_received = None  #seqno, time
         self._process_read = self.process_read
         self.enable_encoder("bencode")
 
+    def parse_remote_caps(self, caps):
+        super().parse_remote_caps(caps)
+        self.fec = FEC and caps.boolget("udp-fec")
+        self.pacing = PACING and caps.boolget("udp-pacing")
+
     def close(self):
         Protocol.close(self)
         self.cancel_control_timer()
+        self.congestion_cb = None
 
     def accept(self):
         log("accept() enabling asynchronous packet reception")
@@ -179,8 +396,14 @@ class UDPProtocol(Protocol):
         if self._closed:
             return False
         missing = self._get_missing()
-        packet = ("udp-control", self.mtu, self.asynchronous_receive_enabled,
-                  self.last_sequence, self.highest_sequence, missing, tuple(self.cancel))
+        packet = ["udp-control", self.mtu, self.asynchronous_receive_enabled,
+                  self.last_sequence, self.highest_sequence, missing, tuple(self.cancel)]
+        lr = self.last_received
+        if self.pacing and lr:
+            #so the other end can measure the round trip time:
+            #the sequence we received last, and how long ago (in microseconds)
+            seqno, received_time = lr
+            packet.append((seqno, int(1000*1000*(monotonic_time()-received_time))))
         log("send_control() packet(%s)=%s", self.pending_packets, ellipsizer(packet))
         self._add_packet_to_queue(packet, fail_cb=self.send_control_failed, synchronous=False)
         self.cancel = set()
@@ -231,15 +454,18 @@ class UDPProtocol(Protocol):
             missing[seqno] = missing_chunks
         return missing
 
-    def process_control(self, mtu, remote_async_receive, last_seq, high_seq, missing, cancel):
-        log("process_control(%i, %i, %i, %i, %s, %s) current seq=%i",
-            mtu, remote_async_receive, last_seq, high_seq, ellipsizer(missing), cancel, self.output_packetcount)
+    def process_control(self, mtu, remote_async_receive, last_seq, high_seq, missing, cancel, timing=None):
+        log("process_control(%i, %i, %i, %i, %s, %s, %s) current seq=%i",
+            mtu, remote_async_receive, last_seq, high_seq, ellipsizer(missing), cancel, timing, self.output_packetcount)
         con = self._conn
         if not con:
             return
         if mtu and self.mtu==0:
             self.mtu = clamp_mtu(mtu)
         self.asynchronous_send_enabled = remote_async_receive
+        self.update_loss(missing)
+        if self.pacing:
+            self.update_pacing(last_seq, timing)
         #first, we can free all the packets that have been processed by the other end:
         #(resend cache and fail callback)
         if last_seq>=0:
@@ -317,6 +543,45 @@ class UDPProtocol(Protocol):
         if high_seq<self.output_packetcount:
             self.schedule_control()
 
+    def update_loss(self, missing):
+        """ estimate the loss rate from the chunks the other end is missing """
+        sent = self.output_raw_packetcount-self.loss_raw_packetcount
+        if sent<=0:
+            return
+        self.loss_raw_packetcount = self.output_raw_packetcount
+        lost = sum(len(missing_chunks) or 1 for missing_chunks in missing.values())
+        loss = min(1000, 1000*lost//sent)
+        #smooth it out:
+        self.loss = (self.loss*3+loss)//4
+
+    def update_pacing(self, last_seq, timing):
+        """
+            measure the round trip time and delivery rate,
+            then let the pacing controller adjust the send rate
+        """
+        now = monotonic_time()
+        pacer = self.pacer
+        if timing:
+            seqno, hold = timing
+            record = self.send_records.get(seqno)
+            if record:
+                pacer.record_rtt(max(0.0001, now-record[0]-hold/1000/1000), now)
+        record = self.send_records.get(last_seq)
+        if record:
+            pacer.record_delivery(record[1], now, record[2])
+            for seqno in tuple(self.send_records.keys()):
+                if seqno<=last_seq:
+                    del self.send_records[seqno]
+        if pacer.update(self.loss) and now-self.congestion_time>=1:
+            cb = self.congestion_cb
+            if cb:
+                self.congestion_time = now
+                late_pct = 100
+                if pacer.min_rtt>0:
+                    late_pct = min(100, int(100*pacer.get_queueing_delay()/pacer.min_rtt))
+                #bits per second, like the other bandwidth figures:
+                cb(late_pct, pacer.bandwidth*8)
+
 
     def process_udp_data(self, uuid, seqno, synchronous, chunk, chunks, data, _bfrom):
         """
@@ -341,9 +606,14 @@ class UDPProtocol(Protocol):
             if random.randint(0, 100) <= DROP_PCT:
                 log.warn("Warning: dropping udp packet %5i.%i", seqno, chunk)
                 return
+        parity = chunk>=chunks
+        if parity and seqno in self.can_skip:
+            #we have already processed this packet
+            return
         self.highest_sequence = max(self.highest_sequence, seqno)
+        self.last_received = seqno, monotonic_time()
         if self.pending_packets or (synchronous and seqno!=self.last_sequence+1) or chunk!=0 or chunks!=1:
-            assert 0<=chunk<chunks, "invalid chunk: %i/%i" % (chunk, chunks)
+            assert chunk>=0 and chunks>0, "invalid chunk: %i/%i" % (chunk, chunks)
             #slow path: add chunk to incomplete packet
             now = monotonic_time()
             ip = self.pending_packets.get(seqno)
@@ -355,7 +625,12 @@ class UDPProtocol(Protocol):
             else:
                 ip.last_time = now
             log("process_udp_data: sequence %i, got chunk %i/%i (%i bytes)", seqno, chunk+1, chunks, len(data))
-            ip.chunks[chunk] = data
+            if parity:
+                ip.parity[chunk-chunks] = data
+            else:
+                ip.chunks[chunk] = data
+            if ip.parity:
+                self.fec_recover(ip)
             if seqno>self.last_sequence+1:
                 #we're waiting for a packet and this is not it,
                 #make sure any gaps are marked as incomplete:
@@ -401,6 +676,23 @@ class UDPProtocol(Protocol):
         #if self.pending_packets or (seqno+1) in self.can_skip:
         self.process_pending()
 
+    def fec_recover(self, ip):
+        """ use the parity chunks to rebuild the chunks we are missing, if we can """
+        nchunks = len(ip.chunks)
+        for group, parity in tuple(ip.parity.items()):
+            group_size = _fec_struct.unpack_from(parity)[0]
+            indexes = range(group*group_size, min(nchunks, (group+1)*group_size))
+            missing = tuple(i for i in indexes if ip.chunks[i] is None)
+            if len(missing)>1:
+                #we need more chunks from this group first
+                continue
+            if missing:
+                index = missing[0]
+                ip.chunks[index] = fec_recover(parity, (ip.chunks[i] for i in indexes if i!=index))
+                self.fec_recovered += 1
+                log("fec_recover: rebuilt chunk %i of packet sequence %i", index, ip.seqno)
+            del ip.parity[group]
+
     def process_pending(self):
         """
             because of a new packet (bumped sequence number),
@@ -467,6 +759,12 @@ class UDPProtocol(Protocol):
         mtu = self.mtu or MIN_MTU
         l = len(data)
         maxpayload = mtu-_header_size
+        group_size = 0
+        if self.fec and l>maxpayload:
+            group_size = fec_group_size(self.loss)
+            if group_size:
+                #make room for the fec header in the parity chunks:
+                maxpayload -= FEC_OVERHEAD
         chunks = l // maxpayload
         if l % maxpayload > 0:
             chunks += 1
@@ -477,24 +775,62 @@ class UDPProtocol(Protocol):
         if fail_cb:
             self.fail_cb[seqno] = fail_cb
         chunk_resend_cache = self.resend_cache.setdefault(seqno, {})
+        datagrams = []
+        data_chunks = []
         while offset<l:
             assert chunk<chunks
             pl = min(maxpayload, l-offset)
             data_chunk = data[offset:offset+pl]
             udp_data = _header_struct.pack(self.uuid, seqno, synchronous, chunk, chunks) + data_chunk
             assert len(udp_data)<=mtu, "invalid payload size: %i greater than mtu %i" % (len(udp_data), mtu)
-            con.write(udp_data)
-            self.output_raw_packetcount += 1
+            datagrams.append(udp_data)
+            data_chunks.append(data_chunk)
             offset += pl
             if chunk_resend_cache is not None:
                 chunk_resend_cache[chunk] = udp_data
             chunk += 1
         assert chunk==chunks, "wrote %i chunks but expected %i" % (chunk, chunks)
+        if group_size:
+            #one parity chunk for each group of chunks,
+            #sent after the data so it can repair any chunk lost in the group:
+            for group, start in enumerate(range(0, chunks, group_size)):
+                parity = fec_parity(data_chunks[start:start+group_size], maxpayload, group_size)
+                datagrams.append(_header_struct.pack(self.uuid, seqno, synchronous, chunks+group, chunks) + parity)
+                self.fec_sent += 1
+        self.write_datagrams(con, datagrams)
+        self.output_raw_packetcount += len(datagrams)
         self.output_packetcount += 1
+        if self.pacing:
+            app_limited = self.pacer.is_app_limited(self.output_bytes-self.pacer.delivered)
+            self.output_bytes += sum(len(x) for x in datagrams)
+            self.send_records[seqno] = (monotonic_time(), self.output_bytes, app_limited)
         if not self.control_timer:
             self.schedule_control()
         return offset
 
+    def write_datagrams(self, con, datagrams):
+        """ send all the datagrams, batching them in as few syscalls as we can """
+        write_segments = getattr(con, "write_segments", None) if self.gso else None
+        pacer = self.pacer
+        for batch in gso_batches(datagrams, pacer.get_batch_size(self.mtu or MIN_MTU)):
+            pacer.wait(sum(len(x) for x in batch))
+            if write_segments and len(batch)>1:
+                try:
+                    write_segments(batch)
+                    self.output_gso_count += 1
+                    continue
+                except MTUExceeded:
+                    raise
+                except OSError as e:
+                    #ie: kernels older than 4.18
+                    log("write_datagrams(..) UDP segmentation offload failed", exc_info=True)
+                    log.warn("Warning: UDP segmentation offload is not available:")
+                    log.warn(" %s", e)
+                    self.gso = False
+                    write_segments = None
+            for udp_data in batch:
+                con.write(udp_data)
+
 
     def get_info(self, alias_info=True):
         i = super().get_info(alias_info)
@@ -504,7 +840,23 @@ class UDPProtocol(Protocol):
                 "min"   : MIN_MTU,
                 "max"   : MAX_MTU,
                 },
+            "gso"   : {
+                ""          : self.gso,
+                "batches"   : self.output_gso_count,
+                },
+            "fec"   : {
+                ""          : self.fec,
+                "loss"      : self.loss,
+                "group-size": fec_group_size(self.loss) if self.fec else 0,
+                "sent"      : self.fec_sent,
+                "recovered" : self.fec_recovered,
+                },
+            "pacing": {
+                ""          : self.pacing,
+                },
             })
+        if self.pacing:
+            i["pacing"].update(self.pacer.get_info())
         return i
 
 
@@ -555,6 +907,11 @@ class UDPSocketConnection(SocketConnection):
         they do not call connect() and so we have to specify the remote target every time)
     """
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        #we always write single datagrams:
+        self.vectored_writes = False
+
     def write(self, buf):
         #log("UDPSocketConnection: sending %i bytes to %s", len(buf), self.remote)
         try:
@@ -564,6 +921,19 @@ class UDPSocketConnection(SocketConnection):
                 raise MTUExceeded("invalid UDP payload size, cannot send %i bytes: %s" % (len(buf), e)) from None
             raise
 
+    def write_segments(self, segments):
+        """
+            Sends all the segments with a single syscall,
+            the kernel splits them into datagrams of the size of the first segment.
+        """
+        cmsg = [(socket.SOL_UDP, UDP_SEGMENT, _gso_struct.pack(len(segments[0])))]
+        try:
+            return self._socket.sendmsg(segments, cmsg, 0, self.remote)
+        except IOError as e:
+            if e.errno==EMSGSIZE:
+                raise MTUExceeded("invalid UDP segment size, cannot send %i bytes: %s" % (len(segments[0]), e)) from None
+            raise
+
     def close(self):
         """
             don't close the socket, we don't own it
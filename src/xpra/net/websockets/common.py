@@ -8,6 +8,7 @@ import uuid
 from hashlib import sha1
 from base64 import b64encode
 
+from xpra.util import envbool
 from xpra.os_util import strtobytes, bytestostr, monotonic_time
 from xpra.log import Logger
 
@@ -18,6 +19,14 @@ MAX_READ_TIME = 5
 READ_CHUNK_SIZE = 4096
 
 HEADERS_MODULES = os.environ.get("XPRA_WEBSOCKET_HEADERS_MODULES", "default").split(",")
+PERMESSAGE_DEFLATE = envbool("XPRA_WEBSOCKET_DEFLATE", True)
+
+#RFC 7692 compression extension,
+#we always disable context takeover so that each message can be inflated on its own:
+DEFLATE_EXTENSION = "permessage-deflate"
+DEFLATE_OFFER = "%s; server_no_context_takeover; client_no_context_takeover" % DEFLATE_EXTENSION
+DEFLATE_PARAMETERS = ("server_no_context_takeover", "client_no_context_takeover",
+                      "server_max_window_bits", "client_max_window_bits")
 
 
 def make_websocket_accept_hash(key):
@@ -44,11 +53,91 @@ def get_headers(host, port):
     return headers
 
 
+def parse_extensions(value):
+    """
+        Parses a 'Sec-WebSocket-Extensions' header value,
+        returns a list of (extension-name, parameters) tuples
+    """
+    extensions = []
+    for ext in bytestostr(value or "").split(","):
+        parts = [x.strip() for x in ext.split(";")]
+        if not parts[0]:
+            continue
+        params = {}
+        for param in parts[1:]:
+            if not param:
+                continue
+            k, _, v = param.partition("=")
+            params[k.strip()] = v.strip().strip('"') or None
+        extensions.append((parts[0], params))
+    return extensions
+
+def get_window_bits(params, name):
+    v = params.get(name)
+    if v is None:
+        return 15
+    bits = int(v)
+    if bits<8 or bits>15:
+        raise ValueError("invalid %s value %i" % (name, bits))
+    return bits
+
+def negotiate_deflate(value):
+    """
+        Server side of the permessage-deflate negotiation:
+        returns the window bits we should use for compressing our messages
+        and the value for the 'Sec-WebSocket-Extensions' response header,
+        or (0, None) if none of the offers are acceptable.
+    """
+    if not PERMESSAGE_DEFLATE:
+        return 0, None
+    for name, params in parse_extensions(value):
+        if name!=DEFLATE_EXTENSION:
+            continue
+        if any(k not in DEFLATE_PARAMETERS for k in params.keys()):
+            log("unsupported %s parameters: %s", name, params)
+            continue
+        try:
+            window_bits = get_window_bits(params, "server_max_window_bits")
+            get_window_bits(params, "client_max_window_bits")
+        except ValueError as e:
+            log("negotiate_deflate(%s) %s", value, e)
+            continue
+        if window_bits<9:
+            #zlib cannot compress with a window of 8 bits
+            continue
+        response = DEFLATE_OFFER
+        if "server_max_window_bits" in params:
+            response += "; server_max_window_bits=%i" % window_bits
+        return window_bits, response
+    return 0, None
+
+def get_deflate_response(value):
+    """
+        Client side of the permessage-deflate negotiation:
+        returns the window bits we should use for compressing our messages,
+        or 0 if the server did not accept our offer.
+    """
+    for name, params in parse_extensions(value):
+        if name!=DEFLATE_EXTENSION:
+            raise Exception("unexpected websocket extension '%s'" % name)
+        if "server_no_context_takeover" not in params:
+            raise Exception("websocket compression requires 'server_no_context_takeover'")
+        return get_window_bits(params, "client_max_window_bits")
+    return 0
+
+
 def client_upgrade(read, write, host, port):
+    """
+        Sends the websocket upgrade request and verifies the response,
+        returns the permessage-deflate window bits to use for compressing messages,
+        or 0 if compression was not negotiated.
+    """
     lines = [b"GET / HTTP/1.1"]
     key = b64encode(uuid.uuid4().bytes)
     headers = get_headers(host, port)
     headers[b"Sec-WebSocket-Key"] = key
+    if PERMESSAGE_DEFLATE:
+        headers[b"Sec-WebSocket-Extensions"] = DEFLATE_OFFER.encode("latin1")
     for k,v in headers.items():
         lines.append(b"%s: %s" % (k, v))
     lines.append(b"")
@@ -66,7 +155,9 @@ def client_upgrade(read, write, host, port):
         response += read(READ_CHUNK_SIZE)
     headers = parse_response_header(response)
     verify_response_headers(headers, key)
-    log("client_upgrade: done")
+    deflate = get_deflate_response(headers.get(b"sec-websocket-extensions"))
+    log("client_upgrade: done, permessage-deflate window bits=%i", deflate)
+    return deflate
 
 def parse_response_header(response):
     #parse response:
@@ -4,7 +4,7 @@
 # later version. See the file COPYING for details.
 
 from xpra.util import envbool
-from xpra.net.websockets.common import make_websocket_accept_hash
+from xpra.net.websockets.common import make_websocket_accept_hash, negotiate_deflate
 from xpra.server.http_handler import HTTPRequestHandler
 from xpra.log import Logger
 
@@ -27,6 +27,8 @@ class WebSocketRequestHandler(HTTPRequestHandler):
                  http_headers_dir="/usr/share/xpra/http-headers", script_paths=None):
         self.new_websocket_client = new_websocket_client
         self.only_upgrade = WEBSOCKET_ONLY_UPGRADE
+        #window bits for compressing messages, 0 if permessage-deflate is not used:
+        self.permessage_deflate = 0
         super().__init__(sock, addr, web_root, http_headers_dir, script_paths)
 
     def handle_websocket(self):
@@ -49,14 +51,20 @@ class WebSocketRequestHandler(HTTPRequestHandler):
         key = self.headers.get("Sec-WebSocket-Key")
         if key is None:
             raise Exception("Missing Sec-WebSocket-Key header")
-        for upgrade_string in (
+        upgrade_strings = [
             b"HTTP/1.1 101 Switching Protocols",
             b"Upgrade: websocket",
             b"Connection: Upgrade",
             b"Sec-WebSocket-Accept: %s" % make_websocket_accept_hash(key),
             b"Sec-WebSocket-Protocol: %s" % b"binary",
-            b"",
-            ):
+            ]
+        window_bits, extensions = negotiate_deflate(self.headers.get("Sec-WebSocket-Extensions"))
+        log("permessage-deflate window bits=%i, extensions=%s", window_bits, extensions)
+        if extensions:
+            self.permessage_deflate = window_bits
+            upgrade_strings.append(b"Sec-WebSocket-Extensions: %s" % extensions.encode("latin1"))
+        upgrade_strings.append(b"")
+        for upgrade_string in upgrade_strings:
             self.wfile.write(b"%s\r\n" % upgrade_string)
         self.wfile.flush()
         self.new_websocket_client(self)
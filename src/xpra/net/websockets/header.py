@@ -10,11 +10,11 @@ import struct
 from xpra.codecs.xor.cyxor import hybi_unmask   #@UnresolvedImport
 
 
-def encode_hybi_header(opcode, payload_len, has_mask=False, fin=True):
+def encode_hybi_header(opcode, payload_len, has_mask=False, fin=True, rsv1=False):
     """ Encode a HyBi style WebSocket frame """
     assert (opcode & 0x0f)==opcode, "invalid opcode %#x" % opcode
     mask_bit = 0x80*has_mask
-    b1 = opcode | (0x80 * fin)
+    b1 = opcode | (0x80 * fin) | (0x40 * rsv1)
     if payload_len <= 125:
         return struct.pack('>BB', b1, payload_len | mask_bit)
     if payload_len < 65536:
@@ -22,17 +22,24 @@ def encode_hybi_header(opcode, payload_len, has_mask=False, fin=True):
     return struct.pack('>BBQ', b1, 127 | mask_bit, payload_len)
 
 
-def decode_hybi(buf):
-    """ Decode HyBi style WebSocket packets """
-    blen = len(buf)
+def decode_hybi_header(buf, offset=0):
+    """
+        Decode the header of a HyBi style WebSocket frame starting at 'offset',
+        returns None if the buffer is too small,
+        or a tuple with: opcode, fin, rsv1, masked, header length, payload length
+        the header length includes the mask (if any),
+        which is found just before the payload.
+    """
+    blen = len(buf)-offset
     hlen = 2
     if blen < hlen:
         #log("decode_hybi_header() buffer too small: %i", blen)
         return None
 
-    b1, b2 = struct.unpack(">BB", buf[:2])
+    b1, b2 = struct.unpack_from(">BB", buf, offset)
     opcode = b1 & 0x0f
     fin = bool(b1 & 0x80)
+    rsv1 = bool(b1 & 0x40)
     masked = bool(b2 & 0x80)
     if masked:
         hlen += 4
@@ -46,18 +53,26 @@ def decode_hybi(buf):
         if blen < hlen:
             #log("decode_hybi_header() buffer too small for 126 payload: %i", blen)
             return None
-        payload_len = struct.unpack('>H', buf[2:4])[0]
+        payload_len = struct.unpack_from('>H', buf, offset+2)[0]
     elif payload_len == 127:
         hlen += 8
         if blen < hlen:
             #log("decode_hybi_header() buffer too small for 127 payload: %i", blen)
             return None
-        payload_len = struct.unpack('>Q', buf[2:10])[0]
+        payload_len = struct.unpack_from('>Q', buf, offset+2)[0]
+    return opcode, fin, rsv1, masked, hlen, payload_len
+
 
+def decode_hybi(buf):
+    """ Decode HyBi style WebSocket packets """
+    header = decode_hybi_header(buf)
+    if header is None:
+        return None
+    opcode, fin, _, masked, hlen, payload_len = header
     #log("decode_hybi_header() decoded header '%s': hlen=%i,
     #    payload_len=%i, buffer len=%i", binascii.hexlify(buf[:hlen]), hlen, payload_len, blen)
     length = hlen + payload_len
-    if blen < length:
+    if len(buf) < length:
         #log("decode_hybi_header() buffer too small for payload: %i (needed %i)", blen, length)
         return None
 
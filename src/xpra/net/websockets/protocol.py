@@ -5,10 +5,12 @@
 
 import os
 import struct
+import zlib
 
-from xpra.net.websockets.header import encode_hybi_header, decode_hybi
+from xpra.net.websockets.header import encode_hybi_header, decode_hybi_header
 from xpra.net.protocol import Protocol
-from xpra.util import first_time, envbool
+from xpra.codecs.xor.cyxor import hybi_unmask, hybi_unmask_inplace   #@UnresolvedImport
+from xpra.util import first_time, envbool, envint
 from xpra.os_util import memoryview_to_bytes
 from xpra.log import Logger
 
@@ -30,20 +32,34 @@ OPCODES = {
     }
 
 MASK = envbool("XPRA_WEBSOCKET_MASK", False)
+DEFLATE_LEVEL = envint("XPRA_WEBSOCKET_DEFLATE_LEVEL", 1)
+DEFLATE_MIN_SIZE = envint("XPRA_WEBSOCKET_DEFLATE_MIN_SIZE", 256)
+#pixel and sound data is already compressed:
+DEFLATE_SKIP_PACKETS = os.environ.get("XPRA_WEBSOCKET_DEFLATE_SKIP_PACKETS", "draw,sound-data").split(",")
+#RFC 7692: the empty uncompressed block that is removed from the end of compressed messages
+DEFLATE_TAIL = b"\x00\x00\xff\xff"
 
 
 class WebSocketProtocol(Protocol):
 
-    STATE_FIELDS = tuple(list(Protocol.STATE_FIELDS)+["legacy_frame_per_chunk"])
+    STATE_FIELDS = tuple(list(Protocol.STATE_FIELDS)+["legacy_frame_per_chunk", "ws_deflate"])
 
     TYPE = "websocket"
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.ws_data = b""
-        self.ws_payload = []
+        #incomplete frame data:
+        self.ws_data = bytearray()
+        self.ws_frame_size = 0
+        #payload of fragmented messages:
+        self.ws_payload = bytearray()
         self.ws_payload_opcode = 0
+        self.ws_payload_compressed = False
         self.ws_mask = MASK
+        #window bits used for compressing messages, 0 if permessage-deflate is disabled:
+        self.ws_deflate = self._conn.options.get("permessage-deflate", 0)
+        self.ws_deflated = 0
+        self.ws_inflated = 0
         self._process_read = self.parse_ws_frame
         self.make_chunk_header = self.make_xpra_header
         self.make_frame_header = self.make_wsframe_header
@@ -51,17 +67,42 @@ class WebSocketProtocol(Protocol):
     def __repr__(self):
         return "WebSocket(%s)" % self._conn
 
+    def get_info(self, alias_info=True) -> dict:
+        info = super().get_info(alias_info)
+        info["websocket"] = {
+            "mask"      : self.ws_mask,
+            "deflate"   : {
+                ""          : self.ws_deflate>0,
+                "window-bits"   : self.ws_deflate,
+                "deflated"  : self.ws_deflated,
+                "inflated"  : self.ws_inflated,
+                },
+            }
+        return info
+
     def close(self):
         Protocol.close(self)
-        self.ws_data = b""
-        self.ws_payload = []
+        self.ws_data = bytearray()
+        self.ws_payload = bytearray()
 
 
     def make_wsframe_header(self, packet_type, items):
         payload_len = sum(len(item) for item in items)
         log("make_wsframe_header(%s, %i items) %i bytes, ms_mask=%s",
             packet_type, len(items), payload_len, self.ws_mask)
-        header = encode_hybi_header(OPCODE_BINARY, payload_len, self.ws_mask)
+        rsv1 = False
+        if self.ws_deflate and payload_len>=DEFLATE_MIN_SIZE and packet_type not in DEFLATE_SKIP_PACKETS:
+            #no context takeover, so we use a new compressor for each message:
+            c = zlib.compressobj(DEFLATE_LEVEL, zlib.DEFLATED, -self.ws_deflate)
+            data = b"".join(c.compress(item) for item in items)+c.flush(zlib.Z_SYNC_FLUSH)
+            if data.endswith(DEFLATE_TAIL):
+                data = data[:-len(DEFLATE_TAIL)]
+            if len(data)<payload_len:
+                items[:] = [data]
+                payload_len = len(data)
+                rsv1 = True
+                self.ws_deflated += 1
+        header = encode_hybi_header(OPCODE_BINARY, payload_len, self.ws_mask, rsv1=rsv1)
         if self.ws_mask:
             from xpra.codecs.xor.cyxor import hybi_mask     #@UnresolvedImport
             mask = os.urandom(4)
@@ -71,41 +112,80 @@ class WebSocketProtocol(Protocol):
             return header+mask
         return header
 
+    def inflate(self, payload):
+        #no context takeover, so we use a new decompressor for each message:
+        d = zlib.decompressobj(-15)
+        data = d.decompress(payload, self.abs_max_packet_size)
+        if not d.unconsumed_tail:
+            data += d.decompress(DEFLATE_TAIL, self.abs_max_packet_size-len(data))
+        if d.unconsumed_tail:
+            raise Exception("compressed websocket message is too large")
+        self.ws_inflated += 1
+        return data
+
     def parse_ws_frame(self, buf):
         if not buf:
             self._read_queue_put(buf)
             return
-        if self.ws_data:
-            ws_data = self.ws_data+buf
-            self.ws_data = b""
+        ws_data = self.ws_data
+        if ws_data:
+            #appending to a bytearray does not copy the data we already have:
+            ws_data += buf
+            if len(ws_data)<self.ws_frame_size:
+                #we already know that we don't have the whole frame yet
+                return
+            data = ws_data
         else:
-            ws_data = buf
-        log("parse_ws_frame(%i bytes) total buffer is %i bytes", len(buf), len(ws_data))
-        while ws_data and not self._closed:
-            parsed = decode_hybi(ws_data)
-            if parsed is None:
-                log("parse_ws_frame(%i bytes) not enough data", len(ws_data))
+            data = buf
+        log("parse_ws_frame(%i bytes) total buffer is %i bytes", len(buf), len(data))
+        pos = 0
+        frame_size = 0
+        while pos<len(data) and not self._closed:
+            header = decode_hybi_header(data, pos)
+            if header is None:
+                frame_size = 0
+            else:
+                opcode, fin, rsv1, masked, hlen, payload_len = header
+                frame_size = hlen+payload_len
+            if header is None or len(data)-pos<frame_size:
+                log("parse_ws_frame(%i bytes) not enough data", len(data)-pos)
                 #not enough data to get a full websocket frame,
                 #save it for later:
-                self.ws_data = ws_data
-                return
-            opcode, payload, processed, fin = parsed
-            ws_data = ws_data[processed:]
+                break
+            if masked:
+                mask_pos = pos+hlen-4
+                if opcode==OPCODE_CONTINUE or not fin:
+                    #fragmented message: copy the payload once, and unmask it in place
+                    ws_payload = self.ws_payload
+                    offset = len(ws_payload)
+                    ws_payload += memoryview(data)[pos+hlen:pos+frame_size]
+                    hybi_unmask_inplace(memoryview(data)[mask_pos:mask_pos+4], ws_payload, offset)
+                    payload = None
+                else:
+                    payload = hybi_unmask(data, mask_pos, payload_len)
+            elif data is buf:
+                payload = memoryview(buf)[pos+hlen:pos+frame_size]
+            else:
+                #we must copy the payload since ws_data is going to be modified
+                payload = memoryview(data)[pos+hlen:pos+frame_size].tobytes()
+            pos += frame_size
             log("parse_ws_frame(%i bytes) payload=%i bytes, processed=%i, remaining=%i, opcode=%s, fin=%s",
-                len(buf), len(payload), processed, len(ws_data), OPCODES.get(opcode, opcode), fin)
+                len(buf), payload_len, frame_size, len(data)-pos, OPCODES.get(opcode, opcode), fin)
             if opcode==OPCODE_CONTINUE:
-                assert self.ws_payload_opcode and self.ws_payload, "continuation frame does not follow a partial frame"
-                self.ws_payload.append(payload)
+                assert self.ws_payload_opcode, "continuation frame does not follow a partial frame"
+                if payload is not None:
+                    self.ws_payload += payload
                 if not fin:
                     #wait for more
                     continue
-                #join all the frames and process the payload:
-                full_payload = b"".join(memoryview_to_bytes(v) for v in self.ws_payload)
-                self.ws_payload = []
+                #process the payload we have accumulated:
+                full_payload = self.ws_payload
+                self.ws_payload = bytearray()
                 opcode = self.ws_payload_opcode
                 self.ws_payload_opcode = 0
+                rsv1 = self.ws_payload_compressed
             else:
-                if self.ws_payload and self.ws_payload_opcode:
+                if self.ws_payload_opcode:
                     raise Exception("expected a continuation frame not %s" % OPCODES.get(opcode, opcode))
                 full_payload = payload
                 if not fin:
@@ -113,8 +193,14 @@ class WebSocketProtocol(Protocol):
                         raise Exception("cannot handle fragmented '%s' frames" % OPCODES.get(opcode, opcode))
                     #fragmented, keep this payload for later
                     self.ws_payload_opcode = opcode
-                    self.ws_payload.append(payload)
+                    self.ws_payload_compressed = rsv1
+                    if payload is not None:
+                        self.ws_payload += payload
                     continue
+            if rsv1:
+                if not self.ws_deflate or opcode not in (OPCODE_BINARY, OPCODE_TEXT):
+                    raise Exception("unexpected compressed websocket %s" % OPCODES.get(opcode, opcode))
+                full_payload = self.inflate(full_payload)
             if opcode==OPCODE_BINARY:
                 self._read_queue_put(full_payload)
             elif opcode==OPCODE_TEXT:
@@ -130,6 +216,12 @@ class WebSocketProtocol(Protocol):
             else:
                 log.warn("Warning unhandled websocket opcode '%s'", OPCODES.get(opcode, "%#x" % opcode))
                 log("payload=%r", payload)
+        #keep the data left over:
+        if data is not buf:
+            del ws_data[:pos]
+        elif pos<len(buf):
+            self.ws_data = bytearray(memoryview(buf)[pos:])
+        self.ws_frame_size = frame_size if pos<len(data) else 0
 
     def _process_ws_ping(self, payload):
         log("_process_ws_ping(%r)", payload)
@@ -569,6 +569,8 @@ OPTION_TYPES = {
                     "min-quality"       : int,
                     "speed"             : int,
                     "min-speed"         : int,
+                    "encode-threads"    : int,
+                    "decode-threads"    : int,
                     "compression_level" : int,
                     "dpi"               : int,
                     "file-size-limit"   : str,
@@ -719,7 +721,7 @@ CLIENT_OPTIONS = ["title", "username", "password", "session-name",
                   "microphone-codec", "speaker-codec",
                   "mmap", "encodings", "encoding",
                   "quality", "min-quality", "speed", "min-speed",
-                  "compression_level",
+                  "compression_level", "decode-threads",
                   "dpi", "video-scaling", "auto-refresh-delay",
                   "webcam", "mousewheel", "input-devices", "shortcut-modifiers", "pings",
                   "tray", "keyboard-sync", "cursors", "bell", "notifications",
@@ -974,6 +976,8 @@ def get_defaults():
                     "min-quality"       : 30,
                     "speed"             : 0,
                     "min-speed"         : 30,
+                    "encode-threads"    : 1,
+                    "decode-threads"    : 1,
                     "compression_level" : 1,
                     "dpi"               : 0,
                     "file-size-limit"   : "100M",
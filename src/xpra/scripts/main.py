@@ -1442,7 +1442,7 @@ def connect_to(display_desc, opts=None, debug_cb=None, ssh_fail_cb=None):
             except ImportError as e:    # pragma: no cover
                 raise InitExit(EXIT_UNSUPPORTED, "cannot handle websocket connection: %s" % e)
             else:
-                client_upgrade(conn.read, conn.write, host, port)
+                conn.options["permessage-deflate"] = client_upgrade(conn.read, conn.write, host, port)
         conn.target = get_host_target_string(display_desc)
         return conn
     raise InitException("unsupported display type: %s" % dtype)
@@ -818,6 +818,18 @@ def do_parse_cmdline(cmdline, defaults):
                       help="Use image compression with the given encoding speed,"
                       +" from 1 to 100, 0 to use automatic setting."
                       +" Default: %default.")
+    group.add_option("--encode-threads", action="store",
+                      metavar="THREADS",
+                      dest="encode_threads", type="int", default=defaults.encode_threads,
+                      help="The number of threads the server uses for encoding the windows of each client,"
+                      +" 0 to use one per CPU core."
+                      +" Default: %default.")
+    group.add_option("--decode-threads", action="store",
+                      metavar="THREADS",
+                      dest="decode_threads", type="int", default=defaults.decode_threads,
+                      help="The number of threads the client uses for decoding the window updates,"
+                      +" 0 to use one per CPU core."
+                      +" Default: %default.")
     group.add_option("--auto-refresh-delay", action="store",
                       dest="auto_refresh_delay", type="float", default=defaults.auto_refresh_delay,
                       metavar="DELAY",
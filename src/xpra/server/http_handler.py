@@ -7,10 +7,12 @@ import os
 import glob
 import posixpath
 import mimetypes
+from threading import Lock
+from collections import OrderedDict
 from urllib.parse import unquote
 from http.server import BaseHTTPRequestHandler
 
-from xpra.util import envbool, std, csv, AdHocStruct, repr_ellipsized
+from xpra.util import envint, envbool, std, csv, AdHocStruct, repr_ellipsized
 from xpra.platform.paths import get_desktop_background_paths
 from xpra.log import Logger
 
@@ -18,6 +20,8 @@ log = Logger("http")
 
 HTTP_ACCEPT_ENCODING = os.environ.get("XPRA_HTTP_ACCEPT_ENCODING", "br,gzip").split(",")
 DIRECTORY_LISTING = envbool("XPRA_HTTP_DIRECTORY_LISTING", False)
+#size of the in-memory cache of static files, in MB:
+HTTP_CACHE_SIZE = envint("XPRA_HTTP_CACHE_SIZE", 32)*1024*1024
 
 EXTENSION_TO_MIMETYPE = {
     ".wasm" : "application/wasm",
@@ -33,6 +37,7 @@ Xpra's builtin HTTP server.
 * sets cache headers on responses,
 * supports delegation to external script classes,
 * supports pre-compressed brotli and gzip, can gzip on-the-fly,
+* keeps the (compressed) static files in memory and supports ETags,
 (subclassed in WebSocketRequestHandler to add WebSocket support)
 """
 class HTTPRequestHandler(BaseHTTPRequestHandler):
@@ -41,6 +46,10 @@ class HTTPRequestHandler(BaseHTTPRequestHandler):
     server_version = "Xpra-HTTP-Server"
     http_headers_cache = {}
     http_headers_time = {}
+    #(path, mtime, size, encodings) : (content, content-encoding, etag)
+    content_cache = OrderedDict()
+    content_cache_size = 0
+    content_cache_lock = Lock()
 
     def __init__(self, sock, addr,
                  web_root="/usr/share/xpra/www/",
@@ -205,78 +214,39 @@ class HTTPRequestHandler(BaseHTTPRequestHandler):
                     self.send_error(403, "Directory listing forbidden")
                     return None
                 return self.list_directory(path).read()
-        ext = os.path.splitext(path)[1]
-        f = None
         try:
-            # Always read in binary mode. Opening files in text mode may cause
-            # newline translations, making the actual size of the content
-            # transmitted *less* than the content-length!
-            f = open(path, 'rb')
-            fs = os.fstat(f.fileno())
-            content_length = fs[6]
+            fs = os.stat(path)
             headers = {}
-            content_type = EXTENSION_TO_MIMETYPE.get(ext)
-            if not content_type:
-                if not mimetypes.inited:
-                    mimetypes.init()
-                ctype = mimetypes.guess_type(path, False)
-                if ctype and ctype[0]:
-                    content_type = ctype[0]
-            log("guess_type(%s)=%s", path, content_type)
+            content_type = self.get_content_type(path)
             if content_type:
                 headers["Content-type"] = content_type
             accept = self.headers.get('accept-encoding', '').split(",")
             accept = tuple(x.split(";")[0].strip() for x in accept)
-            content = None
             log("accept-encoding=%s", csv(accept))
-            for enc in HTTP_ACCEPT_ENCODING:
-                #find a matching pre-compressed file:
-                if enc not in accept:
-                    continue
-                compressed_path = "%s.%s" % (path, enc)     #ie: "/path/to/index.html.br"
-                if not os.path.exists(compressed_path):
-                    continue
-                if not os.path.isfile(compressed_path):
-                    log.warn("Warning: '%s' is not a file!", compressed_path)
-                    continue
-                if not os.access(compressed_path, os.R_OK):
-                    log.warn("Warning: '%s' is not readable", compressed_path)
-                    continue
-                st = os.stat(compressed_path)
-                if st.st_size==0:
-                    log.warn("Warning: '%s' is empty", compressed_path)
-                    continue
-                log("sending pre-compressed file '%s'", compressed_path)
-                #read pre-gzipped file:
-                f.close()
-                f = None
-                f = open(compressed_path, 'rb')
-                content = f.read()
-                assert content, "no data in %s" % compressed_path
+            encodings = tuple(enc for enc in HTTP_ACCEPT_ENCODING if enc in accept)
+            key = (path, fs.st_mtime, fs.st_size, encodings)
+            entry = self.get_cached_content(key)
+            if entry:
+                log("using cached content for '%s'", path)
+            else:
+                content, enc = self.load_content(path, fs.st_size, encodings)
+                etag = '"%x-%x%s"' % (int(fs.st_mtime*1000), fs.st_size, "-"+enc if enc else "")
+                entry = content, enc, etag
+                self.set_cached_content(key, entry)
+            content, enc, etag = entry
+            headers["ETag"] = etag
+            headers["Last-Modified"] = self.date_time_string(fs.st_mtime)
+            if HTTP_ACCEPT_ENCODING:
+                headers["Vary"] = "Accept-Encoding"
+            if self.etag_matches(etag):
+                self.send_response(304)
+                for k,v in headers.items():
+                    self.send_header(k, v)
+                self.end_headers()
+                return None
+            if enc:
                 headers["Content-Encoding"] = enc
-                break
-            if not content:
-                content = f.read()
-                assert len(content)==content_length, \
-                    "expected %s to contain %i bytes but read %i bytes" % (path, content_length, len(content))
-                if content_length>128 and \
-                ("gzip" in accept) and \
-                ("gzip" in HTTP_ACCEPT_ENCODING) \
-                and (ext not in (".png", )):
-                    #gzip it on the fly:
-                    import zlib
-                    assert len(content)==content_length, \
-                        "expected %s to contain %i bytes but read %i bytes" % (path, content_length, len(content))
-                    gzip_compress = zlib.compressobj(9, zlib.DEFLATED, zlib.MAX_WBITS | 16)
-                    compressed_content = gzip_compress.compress(content) + gzip_compress.flush()
-                    if len(compressed_content)<content_length:
-                        log("gzip compressed '%s': %i down to %i bytes", path, content_length, len(compressed_content))
-                        headers["Content-Encoding"] = "gzip"
-                        content = compressed_content
-            f.close()
-            f = None
             headers["Content-Length"] = len(content)
-            headers["Last-Modified"] = self.date_time_string(fs.st_mtime)
             #send back response headers:
             self.send_response(200)
             for k,v in headers.items():
@@ -295,10 +265,96 @@ class HTTPRequestHandler(BaseHTTPRequestHandler):
             except OSError:
                 log("failed to send 404 error - maybe some of the headers were already sent?", exc_info=True)
             return None
-        finally:
-            if f:
-                try:
-                    f.close()
-                except OSError:
-                    log("failed to close", exc_info=True)
         return content
+
+
+    def etag_matches(self, etag):
+        if_none_match = self.headers.get("If-None-Match")
+        if not if_none_match:
+            return False
+        tags = tuple(x.strip() for x in if_none_match.split(","))
+        #weak comparison, as per RFC 7232:
+        return "*" in tags or etag in tags or "W/"+etag in tags
+
+    def get_content_type(self, path):
+        ext = os.path.splitext(path)[1]
+        content_type = EXTENSION_TO_MIMETYPE.get(ext)
+        if not content_type:
+            if not mimetypes.inited:
+                mimetypes.init()
+            ctype = mimetypes.guess_type(path, False)
+            if ctype and ctype[0]:
+                content_type = ctype[0]
+        log("guess_type(%s)=%s", path, content_type)
+        return content_type
+
+    def load_content(self, path, content_length, encodings):
+        """
+            Returns the file contents using one of the encodings given,
+            and the encoding actually used.
+        """
+        for enc in encodings:
+            #find a matching pre-compressed file:
+            compressed_path = "%s.%s" % (path, enc)     #ie: "/path/to/index.html.br"
+            if not os.path.exists(compressed_path):
+                continue
+            if not os.path.isfile(compressed_path):
+                log.warn("Warning: '%s' is not a file!", compressed_path)
+                continue
+            if not os.access(compressed_path, os.R_OK):
+                log.warn("Warning: '%s' is not readable", compressed_path)
+                continue
+            st = os.stat(compressed_path)
+            if st.st_size==0:
+                log.warn("Warning: '%s' is empty", compressed_path)
+                continue
+            log("sending pre-compressed file '%s'", compressed_path)
+            #read pre-gzipped file:
+            with open(compressed_path, 'rb') as f:
+                content = f.read()
+            assert content, "no data in %s" % compressed_path
+            return content, enc
+        # Always read in binary mode. Opening files in text mode may cause
+        # newline translations, making the actual size of the content
+        # transmitted *less* than the content-length!
+        with open(path, 'rb') as f:
+            content = f.read()
+        assert len(content)==content_length, \
+            "expected %s to contain %i bytes but read %i bytes" % (path, content_length, len(content))
+        ext = os.path.splitext(path)[1]
+        if content_length>128 and ("gzip" in encodings) and (ext not in (".png", )):
+            #gzip it on the fly:
+            import zlib
+            gzip_compress = zlib.compressobj(9, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+            compressed_content = gzip_compress.compress(content) + gzip_compress.flush()
+            if len(compressed_content)<content_length:
+                log("gzip compressed '%s': %i down to %i bytes", path, content_length, len(compressed_content))
+                return compressed_content, "gzip"
+        return content, ""
+
+    @classmethod
+    def get_cached_content(cls, key):
+        with cls.content_cache_lock:
+            entry = cls.content_cache.get(key)
+            if entry:
+                cls.content_cache.move_to_end(key)
+            return entry
+
+    @classmethod
+    def set_cached_content(cls, key, entry):
+        size = len(entry[0])
+        if size>HTTP_CACHE_SIZE//4:
+            return
+        with cls.content_cache_lock:
+            #remove the stale versions of this file:
+            path = key[0]
+            for k in tuple(k for k in cls.content_cache.keys() if k[0]==path and k[1:3]!=key[1:3]):
+                cls.content_cache_size -= len(cls.content_cache.pop(k)[0])
+            old = cls.content_cache.pop(key, None)
+            if old:
+                cls.content_cache_size -= len(old[0])
+            cls.content_cache[key] = entry
+            cls.content_cache_size += size
+            while cls.content_cache_size>HTTP_CACHE_SIZE:
+                _, evicted = cls.content_cache.popitem(last=False)
+                cls.content_cache_size -= len(evicted[0])
@@ -5,15 +5,22 @@
 # later version. See the file COPYING for details.
 #pylint: disable-msg=E1101
 
+import os
+
 from xpra.scripts.config import parse_bool_or_int
 from xpra.codecs.codec_constants import PREFERRED_ENCODING_ORDER, PROBLEMATIC_ENCODINGS
 from xpra.codecs.loader import get_codec, has_codec, codec_versions, load_codec
 from xpra.codecs.video_helper import getVideoHelper
+from xpra.codecs.video_pool import VideoPool
 from xpra.server.mixins.stub_server_mixin import StubServerMixin
+from xpra.util import envint, envbool
 from xpra.log import Logger
 
 log = Logger("encoding")
 
+MAX_ENCODE_THREADS = envint("XPRA_MAX_ENCODE_THREADS", 8)
+VIDEO_POOL = envbool("XPRA_VIDEO_POOL", True)
+
 
 """
 Mixin for adding encodings to a server
@@ -32,6 +39,8 @@ class EncodingServer(StubServerMixin):
         self.lossless_mode_encodings = []
         self.default_encoding = None
         self.scaling_control = None
+        self.encode_threads = 1
+        self.video_pool_timer = None
 
     def init(self, opts):
         self.encoding = opts.encoding
@@ -42,13 +51,30 @@ class EncodingServer(StubServerMixin):
         self.default_min_speed = opts.min_speed
         if opts.video_scaling.lower() not in ("auto", "on"):
             self.scaling_control = parse_bool_or_int("video-scaling", opts.video_scaling)
+        self.encode_threads = opts.encode_threads
+        if self.encode_threads<=0:
+            #auto: one thread per core, up to MAX_ENCODE_THREADS
+            self.encode_threads = max(1, min(MAX_ENCODE_THREADS, os.cpu_count() or 1))
+        log("encode threads=%i", self.encode_threads)
         getVideoHelper().set_modules(video_encoders=opts.video_encoders, csc_modules=opts.csc_modules)
+        if VIDEO_POOL:
+            #video encoders and csc converters shared by all the windows:
+            getVideoHelper().video_pool = VideoPool()
 
     def setup(self):
         #always load pillow early,
         #so we have png and jpeg support before calling threaded_setup
         load_codec("enc_pillow")
         self.init_encodings()
+        vp = getVideoHelper().video_pool
+        if vp:
+            self.video_pool_timer = self.timeout_add(vp.timeout*1000, self.expire_video_pool)
+
+    def expire_video_pool(self):
+        vp = getVideoHelper().video_pool
+        if vp:
+            vp.expire()
+        return True
 
     def threaded_setup(self):
         #load video codecs:
@@ -65,7 +91,17 @@ class EncodingServer(StubServerMixin):
         self.init_encodings()
 
     def cleanup(self):
-        getVideoHelper().cleanup()
+        vpt = self.video_pool_timer
+        if vpt:
+            self.video_pool_timer = None
+            self.source_remove(vpt)
+        vh = getVideoHelper()
+        vp = vh.video_pool
+        if vp:
+            #the pooled instances must be cleaned before their modules:
+            vh.video_pool = None
+            vp.cleanup()
+        vh.cleanup()
 
 
     def get_server_features(self, _source=None):
@@ -98,6 +134,7 @@ class EncodingServer(StubServerMixin):
                                                     ))),
              "with_quality"         : [x for x in self.core_encodings if x in ("jpeg", "webp", "h264", "vp8", "vp9", "scroll")],
              "with_lossless_mode"   : self.lossless_mode_encodings,
+             "threads"              : self.encode_threads,
              }
 
     def init_encodings(self):
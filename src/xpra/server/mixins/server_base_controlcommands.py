@@ -8,7 +8,6 @@
 import os.path
 
 from xpra.util import parse_scaling_value, csv, from0to100
-from xpra.os_util import load_binary_file
 from xpra.simple_stats import std_unit
 from xpra.scripts.config import parse_bool, FALSE_OPTIONS, TRUE_OPTIONS
 from xpra.server.control_command import ArgsControlCommand, ControlError
@@ -267,22 +266,18 @@ class ServerBaseControlCommands(StubServerMixin):
                 raise ControlError("file '%s' is too large: %sB (limit is %sB)" % (
                     filename, std_unit(file_size), std_unit(self.file_transfer.file_size_limit)))
 
-        #find the file and load it:
+        #find the file:
         actual_filename = os.path.abspath(os.path.expanduser(filename))
+        if not os.path.exists(actual_filename):
+            raise ControlError("file '%s' does not exist" % filename)
         try:
             stat = os.stat(actual_filename)
             log("os.stat(%s)=%s", actual_filename, stat)
         except os.error:
             log("os.stat(%s)", actual_filename, exc_info=True)
-        else:
-            checksize(stat.st_size)
-        if not os.path.exists(actual_filename):
-            raise ControlError("file '%s' does not exist" % filename)
-        data = load_binary_file(actual_filename)
-        if data is None:
-            raise ControlError("failed to load '%s'" % actual_filename)
+            raise ControlError("failed to access '%s'" % actual_filename) from None
         #verify size:
-        file_size = len(data)
+        file_size = stat.st_size
         checksize(file_size)
         #send it to each client:
         for ss in sources:
@@ -295,7 +290,8 @@ class ServerBaseControlCommands(StubServerMixin):
                 log.warn(" client %s file size limit is %sB (file is %sB)",
                          ss, std_unit(ss.file_size_limit), std_unit(file_size))
             else:
-                ss.send_file(filename, "", data, file_size, *send_file_args)
+                #the file contents are read as they are sent:
+                ss.send_file(actual_filename, "", None, file_size, *send_file_args)
         return "%s of '%s' to %s initiated" % (command_type, filename, client_uuids)
 
 
@@ -5,9 +5,12 @@
 # later version. See the file COPYING for details.
 #pylint: disable-msg=E1101
 
-from xpra.util import typedict
+from xpra.util import typedict, envbool
 from xpra.server.mixins.stub_server_mixin import StubServerMixin
 from xpra.server.source.windows_mixin import WindowsMixin
+from xpra.server.window.encode_cache import EncodeCache
+from xpra.server.window.cursor_cache import CursorCache
+from xpra.server.window.icon_cache import IconCache
 from xpra.log import Logger
 
 log = Logger("window")
@@ -16,6 +19,10 @@ metalog = Logger("metadata")
 geomlog = Logger("geometry")
 eventslog = Logger("events")
 
+ENCODE_CACHE = envbool("XPRA_ENCODE_CACHE", True)
+CURSOR_CACHE = envbool("XPRA_CURSOR_CACHE", True)
+ICON_CACHE = envbool("XPRA_ICON_CACHE", True)
+
 def noop(*_args):
     pass
 
@@ -33,6 +40,9 @@ class WindowServer(StubServerMixin):
         self.window_filters = []
         self.window_min_size = 0, 0
         self.window_max_size = 2**15-1, 2**15-1
+        self.encode_cache = None
+        self.cursor_cache = None
+        self.icon_cache = None
 
     def init(self, opts):
         def parse_window_size(v, default_value=(0, 0)):
@@ -50,6 +60,13 @@ class WindowServer(StubServerMixin):
         minw, minh = self.window_min_size
         maxw, maxh = self.window_max_size
         self.update_size_constraints(minw, minh, maxw, maxh)
+        if ENCODE_CACHE and opts.sharing is not False:
+            #only used when multiple clients share the session:
+            self.encode_cache = EncodeCache()
+        if CURSOR_CACHE:
+            self.cursor_cache = CursorCache()
+        if ICON_CACHE:
+            self.icon_cache = IconCache()
 
     def setup(self):
         self.load_existing_windows()
@@ -70,15 +87,26 @@ class WindowServer(StubServerMixin):
         return {
             "window_refresh_config" : True,     #v4 clients assume this is available
             "window-filters"        : True,     #v4 clients assume this is available
+            "cursor.cache"          : True,
             }
 
     def get_info(self, _proto) -> dict:
-        return {
+        info = {
             "state" : {
                 "windows" : sum(int(window.is_managed()) for window in tuple(self._id_to_window.values())),
                 },
             "filters" : tuple((uuid,repr(f)) for uuid, f in self.window_filters),
             }
+        ec = self.encode_cache
+        if ec:
+            info["encode-cache"] = ec.get_info()
+        cc = self.cursor_cache
+        if cc:
+            info["cursor-cache"] = cc.get_info()
+        ic = self.icon_cache
+        if ic:
+            info["icon-cache"] = ic.get_info()
+        return info
 
     def get_ui_info(self, _proto, _client_uuids=None, wids=None, *_args) -> dict:
         """ info that must be collected from the UI thread
@@ -116,6 +144,16 @@ class WindowServer(StubServerMixin):
         if minh>0 and minh>maxh:
             maxh = minh
         self.update_size_constraints(minw, minh, maxw, maxh)
+        self.update_encode_cache()
+
+    def cleanup_protocol(self, _protocol):
+        self.update_encode_cache()
+
+    def update_encode_cache(self):
+        ec = self.encode_cache
+        if ec:
+            wsources = tuple(ss for ss in self._server_sources.values() if isinstance(ss, WindowsMixin))
+            ec.set_enabled(len(wsources)>1)
 
     def update_size_constraints(self, minw, minh, maxw, maxh):
         #subclasses may update the window models
@@ -196,6 +234,9 @@ class WindowServer(StubServerMixin):
             if isinstance(ss, WindowsMixin):
                 ss.remove_window(wid, window)
         self.client_properties.pop(wid, None)
+        ec = self.encode_cache
+        if ec:
+            ec.remove_window(wid)
         return wid
 
     def _add_new_window_common(self, window):
@@ -138,4 +138,4 @@ def mmap_send(mmap, mmap_size, image, rgb_formats, supports_transparency):
     if mmap_data is None:
         return None
     #replace pixels with mmap info:
-    return mmap_data, mmap_free_size, len(data)
+    return mmap_data, mmap_free_size, len(data), elapsed
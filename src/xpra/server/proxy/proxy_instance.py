@@ -4,6 +4,7 @@
 # Xpra is released under the terms of the GNU GPL v2, or, at your option, any
 # later version. See the file COPYING for details.
 
+import os
 import socket
 from time import sleep, time
 from queue import Queue
@@ -14,6 +15,7 @@ from xpra.net.compression import Compressed, compressed_wrapper
 from xpra.net.protocol import Protocol
 from xpra.codecs.loader import load_codec, get_codec
 from xpra.codecs.image_wrapper import ImageWrapper
+from xpra.codecs.argb.argb import alpha_fill #@UnresolvedImport
 from xpra.codecs.video_helper import getVideoHelper, PREFERRED_ENCODER_ORDER
 from xpra.scripts.config import parse_number, parse_bool
 from xpra.os_util import (
@@ -34,6 +36,9 @@ enclog = Logger("encoding")
 
 
 PROXY_QUEUE_SIZE = envint("XPRA_PROXY_QUEUE_SIZE", 10)
+#number of threads used for re-encoding the windows, 0 for one per core:
+PROXY_ENCODE_THREADS = envint("XPRA_PROXY_ENCODE_THREADS", 0)
+MAX_PROXY_ENCODE_THREADS = envint("XPRA_MAX_PROXY_ENCODE_THREADS", 4)
 #for testing only: passthrough as RGB:
 PASSTHROUGH_RGB = envbool("XPRA_PROXY_PASSTHROUGH_RGB", False)
 VIDEO_TIMEOUT = 5                  #destroy video encoder after N seconds of idle state
@@ -80,8 +85,10 @@ class ProxyInstance:
         self.client_challenge_packet = None
         self.exit = False
         self.lost_windows = None
-        self.encode_queue = None            #holds draw packets to encode
-        self.encode_thread = None
+        #holds draw packets to encode,
+        #all the packets for a given window go to the same queue:
+        self.encode_queues = ()
+        self.encode_threads = []
         self.video_encoding_defs = None
         self.video_encoders = None
         self.video_encoders_last_used_time = None
@@ -111,8 +118,13 @@ class ProxyInstance:
         self.server_protocol.enable_default_encoder()
 
         self.lost_windows = set()
-        self.encode_queue = Queue()
-        self.encode_thread = start_thread(self.encode_loop, "encode")
+        n = PROXY_ENCODE_THREADS
+        if n<=0:
+            n = max(1, min(MAX_PROXY_ENCODE_THREADS, os.cpu_count() or 1))
+        self.encode_queues = tuple(Queue() for _ in range(n))
+        for i, encode_queue in enumerate(self.encode_queues):
+            name = "encode" if n==1 else "encode-%i" % i
+            self.encode_threads.append(start_thread(self.encode_loop, name, args=(encode_queue,)))
 
         self.start_network_threads()
         if self.caps.boolget("ping-echo-sourceid"):
@@ -480,11 +492,11 @@ class ProxyInstance:
             #mark it as lost so we can drop any current/pending frames
             self.lost_windows.add(wid)
             #queue it so it gets cleaned safely (for video encoders mostly):
-            self.encode_queue.put(packet)
+            self.queue_encode(wid, packet)
             #and fall through so tell the client immediately
         elif packet_type=="draw":
-            #use encoder thread:
-            self.encode_queue.put(packet)
+            #use the encode thread for this window:
+            self.queue_encode(packet[1], packet)
             #which will queue the packet itself when done:
             return
         #we do want to reformat cursor packets...
@@ -554,19 +566,25 @@ class ProxyInstance:
         self.queue_client_packet(packet)
 
 
+    def queue_encode(self, wid, packet):
+        #the packets for the same window must be processed in order:
+        eq = self.encode_queues
+        eq[wid % len(eq)].put(packet)
+
     def stop_encode_thread(self):
-        #empty the encode queue:
-        q = self.encode_queue
-        if q:
-            q.put_nowait(None)
+        #empty the encode queues:
+        eq = self.encode_queues
+        if eq:
+            for q in eq:
+                q.put_nowait(None)
             q = Queue()
             q.put(None)
-            self.encode_queue = q
+            self.encode_queues = (q, )
 
-    def encode_loop(self):
+    def encode_loop(self, encode_queue):
         """ thread for slower encoding related work """
         while not self.exit:
-            packet = self.encode_queue.get()
+            packet = encode_queue.get()
             if packet is None:
                 return
             try:
@@ -630,11 +648,8 @@ class ProxyInstance:
                 Xindex = rgb_format.upper().find("X")
                 if Xindex>=0 and len(rgb_format)==4:
                     #force clear alpha (which may be garbage):
-                    newdata = bytearray(pixels)
-                    for i in range(len(pixels)/4):
-                        newdata[i*4+Xindex] = chr(255)
+                    cdata = alpha_fill(pixels, Xindex)
                     packet[9] = client_options.intget("rowstride", 0)
-                    cdata = bytes(newdata)
                 else:
                     cdata = pixels
                 new_client_options = {"rgb_format" : rgb_format}
@@ -741,7 +756,7 @@ class ProxyInstance:
                 continue
             enclog("timeout_video_encoders() wid=%s, idle_time=%s", wid, idle_time)
             if idle_time and idle_time>VIDEO_TIMEOUT:
-                self.encode_queue.put(["check-video-timeout", wid])
+                self.queue_encode(wid, ["check-video-timeout", wid])
         return True     #run again
 
     def _find_video_encoder(self, video_encoding, rgb_format):
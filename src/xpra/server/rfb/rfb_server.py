@@ -109,7 +109,7 @@ class RFBServer:
         log("rfb handle sharing: accepted=%s, share count=%s, disconnected=%s", accepted, share_count, disconnected)
         if not accepted:
             return
-        source = RFBSource(proto, proto.share)
+        source = RFBSource(proto, self.timeout_add, self.source_remove, proto.share)
         if server_features.input_devices:
             source.keyboard_config = self.get_keyboard_config()
             self.set_keymap(source)
@@ -163,25 +163,32 @@ class RFBServer:
             is_mod = source.keyboard_config.is_modifier(keycode)
             self._handle_key(wid, bool(pressed), keyname, keyval, keycode, modifiers, is_mod, True)
 
-    def _process_rfb_SetEncodings(self, _proto, packet):
+    def _process_rfb_SetEncodings(self, proto, packet):
         n, encodings = packet[2:4]
         known_encodings = [RFBEncoding.ENCODING_STR.get(x) for x in encodings if x in RFBEncoding.ENCODING_STR]
         log("%i encodings: %s", n, csv(known_encodings))
         unknown_encodings = [x for x in encodings if x not in RFBEncoding.ENCODING_STR]
         if unknown_encodings:
             log("%i unknown encodings: %s", len(unknown_encodings), csv(unknown_encodings))
+        source = self.get_server_source(proto)
+        if source:
+            source.set_encodings(encodings)
 
     def _process_rfb_SetPixelFormat(self, _proto, packet):
         log("RFB: SetPixelFormat %s", packet)
         #w, h, bpp, depth, bigendian, truecolor, rmax, gmax, bmax, rshift, bshift, gshift = packet
 
-    def _process_rfb_FramebufferUpdateRequest(self, _proto, packet):
+    def _process_rfb_FramebufferUpdateRequest(self, proto, packet):
         #pressed, _, _, keycode = packet[1:5]
         inc, x, y, w, h = packet[1:6]
         log("RFB: FramebufferUpdateRequest inc=%s, geometry=%s", inc, (x, y, w, h))
+        source = self.get_server_source(proto)
+        if not source:
+            return
         if not inc:
             model = self._get_rfb_desktop_model()
-            self.refresh_window_area(model, x, y, w, h)
+            source.damage(self._window_to_id[model], model, x, y, w, h)
+        source.request_update()
 
     def _process_rfb_ClientCutText(self, _proto, packet):
         #l = packet[4]
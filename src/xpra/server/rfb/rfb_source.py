@@ -4,23 +4,57 @@
 # Xpra is released under the terms of the GNU GPL v2, or, at your option, any
 # later version. See the file COPYING for details.
 
+import zlib
 import struct
+from math import sqrt
+from collections import deque
 from threading import Event
 
 from xpra.net.protocol import PACKET_JOIN_SIZE
-from xpra.os_util import memoryview_to_bytes, strtobytes
-from xpra.util import AtomicInteger
+from xpra.server.rfb.rfb_const import RFBEncoding
+from xpra.server.window.batch_config import DamageBatchConfig, NRECS
+from xpra.server.window.batch_delay_calculator import get_low_limit, update_batch_delay
+from xpra.server.cystats import queue_inspect   #@UnresolvedImport
+from xpra.rectangle import rectangle, add_rectangle, merge_all   #@UnresolvedImport
+from xpra.os_util import memoryview_to_bytes, strtobytes, monotonic_time
+from xpra.util import AtomicInteger, envint, envbool, csv
 from xpra.log import Logger
 
 log = Logger("rfb")
+scrolllog = Logger("rfb", "scroll")
 
 counter = AtomicInteger()
 
+ZRLE_TILE_SIZE = 64
+ZLIB_LEVEL = max(0, min(9, envint("XPRA_RFB_ZLIB_LEVEL", 3)))
+COPYRECT = envbool("XPRA_RFB_COPYRECT", True)
+#only try to detect scrolling for areas larger than this many pixels:
+SCROLL_MIN_PIXELS = envint("XPRA_RFB_SCROLL_MIN_PIXELS", 128*128)
+SCROLL_MIN_PERCENT = envint("XPRA_RFB_SCROLL_MIN_PERCENT", 30)
+#merge the damage regions if there are more than this many:
+MAX_RECTANGLES = envint("XPRA_RFB_MAX_RECTANGLES", 20)
+#the cost of sending an extra rectangle, expressed in pixels:
+SMALL_PACKET_COST = envint("XPRA_RFB_SMALL_PACKET_COST", 4096)
+#don't send a new update if there are this many packets waiting:
+MAX_BACKLOG = envint("XPRA_RFB_MAX_BACKLOG", 2)
+
+ScrollData = None
+if COPYRECT:
+    try:
+        from xpra.server.window.motion import ScrollData    #@UnresolvedImport
+    except ImportError as e:
+        log("no scroll detection: %s", e)
+
+#the encodings we can send, in our order of preference:
+PIXEL_ENCODINGS = (RFBEncoding.ZRLE, RFBEncoding.RAW)
+
 
 class RFBSource:
 
-    def __init__(self, protocol, share=False):
+    def __init__(self, protocol, timeout_add, source_remove, share=False):
         self.protocol = protocol
+        self.timeout_add = timeout_add
+        self.source_remove = source_remove
         self.close_event = Event()
         self.log_disconnect = True
         self.ui_client = True
@@ -29,14 +63,58 @@ class RFBSource:
         self.uuid = "RFB%5i" % counter.increase()
         self.lock = False
         self.keyboard_config = None
+        self.encodings = ()
+        self.encoding = RFBEncoding.RAW
+        self.copyrect = False
+        self.zlib_compressor = None
+        self.scroll_data = None
+        self.scroll_area = None
+        #damage batching:
+        self.window = None
+        self.window_dimensions = 0, 0
+        self.damage_regions = []
+        self.damage_time = 0
+        self.update_requested = False
+        self.update_timer = None
+        self.updates_sent = 0
+        self.batch = DamageBatchConfig()
+        #(time, value) records used for calculating the batch delay:
+        self.write_backlog = deque(maxlen=NRECS)
+        self.pixels_sent = deque(maxlen=NRECS)
 
     def get_info(self) -> dict:
         return {
             "protocol"  : "rfb",
             "uuid"      : self.uuid,
             "share"     : self.share,
+            "encoding"  : RFBEncoding.ENCODING_STR.get(self.encoding, self.encoding),
+            "copyrect"  : self.copyrect,
+            "batch"     : self.batch.get_info(),
+            "damage"    : {
+                "regions"   : len(self.damage_regions),
+                "requested" : self.update_requested,
+                "updates"   : self.updates_sent,
+                },
             }
 
+    def set_encodings(self, encodings):
+        """
+            The client sends the list of encodings it supports,
+            in its order of preference.
+        """
+        self.encodings = tuple(encodings)
+        self.encoding = RFBEncoding.RAW
+        for encoding in self.encodings:
+            if encoding in PIXEL_ENCODINGS:
+                self.encoding = encoding
+                break
+        self.copyrect = ScrollData is not None and RFBEncoding.COPYRECT in self.encodings
+        if not self.copyrect:
+            self.free_scroll_data()
+        log("set_encodings(%s) using %s, copyrect=%s",
+            csv(RFBEncoding.ENCODING_STR.get(x, x) for x in self.encodings),
+            RFBEncoding.ENCODING_STR.get(self.encoding), self.copyrect)
+
     def get_window_info(self, _wids):
         return {}
 
@@ -45,6 +123,11 @@ class RFBSource:
 
     def close(self):
         self.close_event.set()
+        self.cancel_update_timer()
+        self.damage_regions = []
+        self.window = None
+        self.free_scroll_data()
+        self.zlib_compressor = None
 
     def ping(self):
         pass
@@ -74,32 +157,270 @@ class RFBSource:
     def update_mouse(self, *args):
         log("update_mouse%s", args)
 
-    def damage(self, _wid, window, x, y, w, h, options=None):
-        polling = options and options.get("polling", False)
-        p = self.protocol
-        if polling and p is None or p.queue_size()>=2:
-            #very basic RFB update rate control,
-            #if there are packets waiting already
-            #we'll just process the next polling update instead:
+    def damage(self, wid, window, x, y, w, h, options=None):
+        """
+            Accumulate the damage,
+            it will be sent when the client requests an update.
+        """
+        log("damage%s", (wid, window, x, y, w, h, options))
+        if self.is_closed():
             return
-        img = window.get_image(x, y, w, h)
-        window.acknowledge_changes()
-        log("damage: %s", img)
-        if not img or self.is_closed():
+        now = monotonic_time()
+        if window is not self.window:
+            self.window = window
+            self.damage_regions = []
+            self.reset_scroll_data()
+        self.window_dimensions = window.get_dimensions()
+        if not self.damage_regions:
+            self.damage_time = now
+        add_rectangle(self.damage_regions, rectangle(x, y, w, h))
+        self.batch.last_event = now
+        self.may_schedule_update()
+
+    def request_update(self):
+        """
+            The client sent a FramebufferUpdateRequest.
+        """
+        self.update_requested = True
+        self.may_schedule_update()
+
+    def may_schedule_update(self):
+        if not self.update_requested or not self.damage_regions or self.update_timer or self.is_closed():
             return
-        fbupdate = struct.pack(b"!BBH", 0, 0, 1)
-        encoding = 0    #Raw
-        rect = struct.pack(b"!HHHHi", x, y, w, h, encoding)
-        if img.get_rowstride()!=w*4:
-            img.restride(w*4)
-        pixels = img.get_pixels()
-        assert len(pixels)>=4*w*h
-        pixels = pixels[:4*w*h]
-        if len(pixels)<=PACKET_JOIN_SIZE:
-            self.send(fbupdate+rect+memoryview_to_bytes(pixels))
-        else:
-            self.send(fbupdate+rect)
-            self.send(pixels)
+        now = monotonic_time()
+        delay = self.batch.delay
+        self.batch.last_delays.append((now, delay))
+        #the delay starts from the first damage event:
+        elapsed = int(1000*(now-self.damage_time))
+        self.update_timer = self.timeout_add(max(0, delay-elapsed), self.send_update)
+
+    def cancel_update_timer(self):
+        ut = self.update_timer
+        if ut:
+            self.update_timer = None
+            self.source_remove(ut)
+
+    def send_update(self):
+        self.update_timer = None
+        p = self.protocol
+        if not p or self.is_closed() or not self.damage_regions:
+            return False
+        if p.queue_size()>=MAX_BACKLOG:
+            #the client has not received the previous update yet,
+            #keep accumulating damage and try again later:
+            log("send_update() %i packets waiting, delaying update", p.queue_size())
+            self.update_timer = self.timeout_add(max(self.batch.min_delay, self.batch.delay), self.send_update)
+            return False
+        now = monotonic_time()
+        regions = self.get_update_regions()
+        self.damage_regions = []
+        self.batch.last_actual_delays.append((now, int(1000*(now-self.damage_time))))
+        nrects, pixels = self.send_regions(self.window, regions)
+        if not nrects:
+            #nothing was sent, so the request is still pending
+            return False
+        self.update_requested = False
+        self.updates_sent += 1
+        self.pixels_sent.append((now, pixels))
+        self.write_backlog.append((now, p.queue_size()))
+        self.update_batch_delay()
+        return False
+
+    def get_update_regions(self):
+        regions = self.damage_regions
+        if len(regions)<=1:
+            return regions
+        pixel_count = sum(r.width*r.height for r in regions)
+        packet_cost = pixel_count+SMALL_PACKET_COST*len(regions)
+        merged = merge_all(regions)
+        merged_packet_cost = merged.width*merged.height+SMALL_PACKET_COST
+        log("get_update_regions() %i regions, packet_cost=%i, merged=%s, merged_packet_cost=%i",
+            len(regions), packet_cost, merged, merged_packet_cost)
+        if merged_packet_cost<=packet_cost or len(regions)>MAX_RECTANGLES:
+            return [merged]
+        return regions
+
+    def update_batch_delay(self):
+        low_limit = get_low_limit(False, self.window_dimensions)
+        factors = [
+            queue_inspect("write-queue", self.write_backlog),
+            queue_inspect("damage-pixels", self.pixels_sent, div=low_limit, smoothing=sqrt),
+            ]
+        update_batch_delay(self.batch, factors, self.batch.min_delay)
+
+    def send_regions(self, window, regions):
+        """
+            Sends all the regions using a single FramebufferUpdate,
+            returns the number of rectangles and pixels sent.
+        """
+        nrects = 0
+        data = []
+        npixels = 0
+        scroll_region = None
+        if self.copyrect:
+            #only the largest region is used for scroll detection,
+            #so the other regions don't reset the area we are tracking:
+            scroll_region = max(regions, key=lambda r : r.width*r.height, default=None)
+        for region in regions:
+            x, y, w, h = region.get_geometry()
+            img = window.get_image(x, y, w, h)
+            log("send_regions: %s", img)
+            if not img:
+                continue
+            if img.get_rowstride()!=w*4:
+                img.restride(w*4)
+            pixels = img.get_pixels()
+            assert len(pixels)>=4*w*h
+            pixels = pixels[:4*w*h]
+            rects, repaint = (), ((0, h), )
+            if region is scroll_region:
+                #only repaint the lines that have not been scrolled:
+                rects, repaint = self.scroll_rects(pixels, x, y, w, h) or (rects, repaint)
+            elif self.scroll_data:
+                #the client's framebuffer is about to be modified:
+                self.scroll_data.invalidate(x, y, w, h)
+            data += rects
+            nrects += len(rects)+len(repaint)
+            for sy, sh in repaint:
+                data += self.encode_rect(pixels[sy*w*4:(sy+sh)*w*4], x, y+sy, w, sh, img.get_pixel_format())
+                npixels += w*sh
+        window.acknowledge_changes()
+        if not nrects:
+            return 0, 0
+        fbupdate = struct.pack(b"!BBH", 0, 0, nrects)
+        #merge the small chunks:
+        chunk = fbupdate
+        for v in data:
+            if len(chunk)+len(v)<=PACKET_JOIN_SIZE:
+                chunk += memoryview_to_bytes(v)
+                continue
+            if chunk:
+                self.send(chunk)
+            if len(v)<=PACKET_JOIN_SIZE:
+                chunk = memoryview_to_bytes(v)
+            else:
+                chunk = b""
+                self.send(v)
+        if chunk:
+            self.send(chunk)
+        return nrects, npixels
+
+    def encode_rect(self, pixels, x, y, w, h, pixel_format="BGRX"):
+        """
+            Returns the rectangle header and data as a list of buffers.
+        """
+        if self.encoding==RFBEncoding.ZRLE and pixel_format in ("BGRX", "BGRA"):
+            data = self.zrle_encode(pixels, w, h)
+            return [struct.pack(b"!HHHHiI", x, y, w, h, RFBEncoding.ZRLE, len(data)), data]
+        return [struct.pack(b"!HHHHi", x, y, w, h, RFBEncoding.RAW), pixels]
+
+    def zrle_encode(self, pixels, w, h):
+        """
+            The client's pixel format is 32bpp with a depth of 24,
+            so each pixel is sent as a 3 byte CPIXEL.
+            Tiles are either solid or raw,
+            and they are all compressed using the connection's zlib stream.
+        """
+        #strip the unused byte:
+        rgb = bytearray(w*h*3)
+        for i in range(3):
+            rgb[i::3] = pixels[i::4]
+        rgb = memoryview(rgb)
+        rowstride = w*3
+        tiles = []
+        T = ZRLE_TILE_SIZE
+        for ty in range(0, h, T):
+            th = min(T, h-ty)
+            for tx in range(0, w, T):
+                tw = min(T, w-tx)
+                start = ty*rowstride+tx*3
+                if tw==w:
+                    tile = rgb[start:start+th*rowstride].tobytes()
+                else:
+                    tile = b"".join(rgb[start+i*rowstride:start+i*rowstride+tw*3] for i in range(th))
+                pixel = tile[:3]
+                if tile==pixel*(tw*th):
+                    #solid tile:
+                    tiles.append(b"\1"+pixel)
+                else:
+                    tiles.append(b"\0"+tile)
+        c = self.zlib_compressor
+        if c is None:
+            #a single zlib stream is used for the lifetime of the connection:
+            c = self.zlib_compressor = zlib.compressobj(ZLIB_LEVEL)
+        return c.compress(b"".join(tiles))+c.flush(zlib.Z_SYNC_FLUSH)
+
+    def scroll_rects(self, pixels, x, y, w, h):
+        """
+            Use the scroll detection to find the lines we can copy
+            from the client's framebuffer.
+            Returns the CopyRect headers and the list of regions
+            that still need to be painted, or None.
+        """
+        area = (x, y, w, h)
+        sd = self.scroll_data
+        if w*h<SCROLL_MIN_PIXELS:
+            if sd:
+                #the client's framebuffer is about to be modified:
+                sd.invalidate(x, y, w, h)
+            return None
+        if sd is None:
+            #the same instance is used for all the updates of this window:
+            sd = self.scroll_data = ScrollData()
+        elif area!=self.scroll_area:
+            #start tracking this area instead,
+            #the reference checksums are for a different one:
+            sd.free()
+        self.scroll_area = area
+        try:
+            sd.update(pixels, x, y, w, h, w*4, 4)
+            sd.calculate(min(1000, (100-SCROLL_MIN_PERCENT)*h//100))
+            scroll, count = sd.get_best_match()
+            if scroll==0 or count*100<h*SCROLL_MIN_PERCENT:
+                return None
+            v = sd.get_scroll_values()
+        except Exception:
+            scrolllog.error("Error during scrolling detection", exc_info=True)
+            self.free_scroll_data()
+            return None
+        if not v:
+            return None
+        #only use the best scroll distance,
+        #so the copies never overwrite each other's source lines
+        #as long as we process them in the right order:
+        line_defs = v[0].get(scroll)
+        if not line_defs:
+            return None
+        copied = [False]*h
+        rects = []
+        for line, count in sorted(line_defs.items(), reverse=scroll>0):
+            for i in range(line+scroll, line+scroll+count):
+                copied[i] = True
+            rects.append(struct.pack(b"!HHHHiHH", x, y+line+scroll, w, count, RFBEncoding.COPYRECT, x, y+line))
+        regions = []
+        start = None
+        for i in range(h+1):
+            if i<h and not copied[i]:
+                if start is None:
+                    start = i
+            elif start is not None:
+                regions.append((start, i-start))
+                start = None
+        scrolllog("scroll_rects%s scroll=%i, %i copies, repaint=%s", area, scroll, len(rects), regions)
+        return rects, regions
+
+    def reset_scroll_data(self):
+        sd = self.scroll_data
+        if sd:
+            sd.free()
+        self.scroll_area = None
+
+    def free_scroll_data(self):
+        sd = self.scroll_data
+        if sd:
+            self.scroll_data = None
+            sd.free()
+        self.scroll_area = None
 
     def send_clipboard(self, text):
         nocr = strtobytes(text.replace("\r", ""))
@@ -1365,6 +1365,10 @@ class ServerCore:
                 from xpra.net.websockets.protocol import WebSocketProtocol
                 wslog("new_websocket_client(%s) socket=%s", wsh, sock)
                 newsocktype = "ws%s" % ["","s"][int(is_ssl)]
+                if wsh.permessage_deflate:
+                    #(don't modify the listener's socket options)
+                    conn.options = dict(conn.options)
+                    conn.options["permessage-deflate"] = wsh.permessage_deflate
                 self.make_protocol(newsocktype, conn, socket_options, WebSocketProtocol)
             scripts = self.get_http_scripts()
             conn.socktype = "wss" if is_ssl else "ws"
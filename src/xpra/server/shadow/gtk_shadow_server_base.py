@@ -81,8 +81,8 @@ class GTKShadowServerBase(ShadowServerBase, GTKServerBase):
 
     def refresh(self):
         log("refresh() mapped=%s, capture=%s", self.mapped, self.capture)
+        self.refresh_timer = None
         if not self.mapped:
-            self.refresh_timer = None
             return False
         if self.capture:
             try:
@@ -90,6 +90,7 @@ class GTKShadowServerBase(ShadowServerBase, GTKServerBase):
                     #capture doesn't have any screen updates,
                     #so we can skip calling damage
                     #(this shortcut is only used with nvfbc)
+                    self.schedule_refresh(False)
                     return False
             except TransientCodecException as e:
                 log("refresh()", exc_info=True)
@@ -103,9 +104,11 @@ class GTKShadowServerBase(ShadowServerBase, GTKServerBase):
                 log.warn(" %s", e)
                 self.recreate_window_models()
                 return False
-        for window in self._id_to_window.values():
-            self.refresh_window(window)
-        return True
+        changed = False
+        for window in tuple(self._id_to_window.values()):
+            changed |= self.refresh_window_tiles(window)
+        self.schedule_refresh(changed)
+        return False
 
 
     ############################################################################
@@ -122,6 +125,7 @@ class GTKShadowServerBase(ShadowServerBase, GTKServerBase):
         for model in tuple(self._window_to_id.keys()):
             self._remove_window(model)
         self.cleanup_capture()
+        self.tile_hashes = {}
         for model in self.makeRootWindowModels():
             self._add_new_window(model)
 
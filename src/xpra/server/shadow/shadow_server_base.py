@@ -21,6 +21,11 @@ mouselog = Logger("mouse")
 cursorlog = Logger("cursor")
 
 REFRESH_DELAY = envint("XPRA_SHADOW_REFRESH_DELAY", 50)
+MAX_REFRESH_DELAY = envint("XPRA_SHADOW_MAX_REFRESH_DELAY", 1000)
+#how far the refresh delay can back off, as a multiple of the refresh delay:
+REFRESH_BACKOFF = envint("XPRA_SHADOW_REFRESH_BACKOFF", 4)
+TILE_HASH = envbool("XPRA_SHADOW_TILE_HASH", True)
+TILE_SIZE = envint("XPRA_SHADOW_TILE_SIZE", 64)
 NATIVE_NOTIFIER = envbool("XPRA_NATIVE_NOTIFIER", True)
 POLL_POINTER = envint("XPRA_POLL_POINTER", 20)
 CURSORS = envbool("XPRA_CURSORS", True)
@@ -28,6 +33,14 @@ SAVE_CURSORS = envbool("XPRA_SAVE_CURSORS", False)
 NOTIFY_STARTUP = envbool("XPRA_SHADOW_NOTIFY_STARTUP", True)
 
 
+TileHash = None
+if TILE_HASH:
+    try:
+        from xpra.server.shadow.tile_hash import TileHash
+    except ImportError as e:
+        log("no tile hash: %s", e)
+
+
 SHADOWSERVER_BASE_CLASS = object
 if server_features.rfb:
     from xpra.server.rfb.rfb_server import RFBServer
@@ -45,6 +58,8 @@ class ShadowServerBase(SHADOWSERVER_BASE_CLASS):
         self.sharing = True
         self.refresh_delay = REFRESH_DELAY
         self.refresh_timer = None
+        self.current_refresh_delay = REFRESH_DELAY
+        self.tile_hashes = {}
         self.notifications = False
         self.notifier = None
         self.pointer_last_position = None
@@ -77,6 +92,7 @@ class ShadowServerBase(SHADOWSERVER_BASE_CLASS):
             self.stop_refresh(wid)
         self.cleanup_notifier()
         self.cleanup_capture()
+        self.tile_hashes = {}
 
     def cleanup_capture(self):
         capture = self.capture
@@ -124,6 +140,11 @@ class ShadowServerBase(SHADOWSERVER_BASE_CLASS):
         return {
             "sharing"       : self.sharing,
             "refresh-delay" : self.refresh_delay,
+            "current-refresh-delay" : self.current_refresh_delay,
+            "tile-hash"     : {
+                "enabled"   : TileHash is not None,
+                "tile-size" : TILE_SIZE,
+                },
             "pointer-last-position" : self.pointer_last_position,
             }
 
@@ -223,9 +244,36 @@ class ShadowServerBase(SHADOWSERVER_BASE_CLASS):
         if wid not in self.mapped:
             self.mapped.append(wid)
         if not self.refresh_timer:
+            self.current_refresh_delay = self.refresh_delay
             self.refresh_timer = self.timeout_add(self.refresh_delay, self.refresh)
         self.start_poll_pointer()
 
+    def schedule_refresh(self, changed=True):
+        """
+            Used by refresh implementations that reschedule themselves:
+            the delay doubles every time nothing has changed,
+            up to REFRESH_BACKOFF times the refresh delay (and no more than MAX_REFRESH_DELAY).
+        """
+        if changed:
+            delay = self.refresh_delay
+        else:
+            max_delay = min(MAX_REFRESH_DELAY, self.refresh_delay*REFRESH_BACKOFF)
+            delay = min(max(self.refresh_delay, max_delay), self.current_refresh_delay*2)
+        self.current_refresh_delay = delay
+        self.refresh_timer = self.timeout_add(delay, self.refresh)
+
+    def expedite_refresh(self):
+        """
+            The screen has changed,
+            make sure we don't wait for a backed off refresh timer.
+        """
+        if not self.mapped:
+            return
+        if self.refresh_timer and self.current_refresh_delay<=self.refresh_delay:
+            return
+        self.cancel_refresh_timer()
+        self.schedule_refresh(True)
+
     def set_refresh_delay(self, v):
         assert 0<v<10000
         self.refresh_delay = v
@@ -255,6 +303,34 @@ class ShadowServerBase(SHADOWSERVER_BASE_CLASS):
     def refresh(self):
         raise NotImplementedError()
 
+    def refresh_window_tiles(self, window):
+        """
+            Only refresh the tiles of the window that have changed,
+            returns True if there were any.
+        """
+        if not TileHash:
+            self.refresh_window(window)
+            return True
+        th = self.tile_hashes.get(window)
+        if th is None:
+            th = self.tile_hashes[window] = TileHash(TILE_SIZE)
+        ww, wh = window.get_dimensions()
+        image = window.get_image(0, 0, ww, wh)
+        if image is None:
+            #we can't tell what has changed:
+            th.invalidate()
+            self.refresh_window(window)
+            return True
+        try:
+            regions = th.update(image.get_pixels(), image.get_width(), image.get_height(),
+                                image.get_rowstride(), image.get_bytesperpixel())
+        finally:
+            image.free()
+        log("refresh_window_tiles(%s) regions=%s", window, regions)
+        for r in regions:
+            self.refresh_window_area(window, r.x, r.y, r.width, r.height)
+        return bool(regions)
+
 
     ############################################################################
     # pointer polling
@@ -375,6 +451,20 @@ class ShadowServerBase(SHADOWSERVER_BASE_CLASS):
             log.info(" unknown client desktop size")
         return self.get_root_window_size()
 
+    #user input is likely to change the screen,
+    #so don't wait for a backed off refresh timer:
+    def _process_key_action(self, proto, packet):
+        super()._process_key_action(proto, packet)
+        self.expedite_refresh()
+
+    def _process_button_action(self, proto, packet):
+        super()._process_button_action(proto, packet)
+        self.expedite_refresh()
+
+    def _process_pointer_position(self, proto, packet):
+        super()._process_pointer_position(proto, packet)
+        self.expedite_refresh()
+
     def _process_desktop_size(self, proto, packet):
         #just record the screen size info in the source
         ss = self.get_server_source(proto)
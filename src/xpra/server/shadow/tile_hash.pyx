@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+# This file is part of Xpra.
+# Copyright (C) 2020 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+#cython: auto_pickle=False, boundscheck=False, wraparound=False, cdivision=True, language_level=3
+
+from xpra.util import envbool
+from xpra.log import Logger
+log = Logger("shadow")
+
+from xpra.buffers.membuf cimport memalign, object_as_buffer, xxh3      #pylint: disable=syntax-error
+from xpra.rectangle import rectangle, merge_all
+
+from libc.stdint cimport uint8_t, uint16_t, uint32_t, uint64_t
+from libc.stdlib cimport free
+
+
+cdef int DEBUG = envbool("XPRA_TILE_HASH_DEBUG", False)
+
+#mixes the checksums of the rows of a tile:
+cdef uint64_t PRIME = 0x100000001b3
+
+
+cdef class TileHash:
+    """
+        Keeps a checksum for each tile of the picture,
+        so we can find which tiles have changed since the last update.
+    """
+
+    cdef uint64_t *checksums
+    cdef uint16_t tile_size
+    cdef uint16_t width
+    cdef uint16_t height
+    cdef uint16_t cols
+    cdef uint16_t rows
+    cdef readonly uint32_t updates
+    cdef readonly uint32_t tiles_changed
+
+    def __cinit__(self, uint16_t tile_size=64):
+        assert tile_size>0, "invalid tile size"
+        self.tile_size = tile_size
+
+    def __repr__(self):
+        return "TileHash(%ix%i)" % (self.width, self.height)
+
+    def get_info(self) -> dict:
+        return {
+            "tile-size"     : self.tile_size,
+            "tiles"         : self.cols*self.rows,
+            "updates"       : self.updates,
+            "tiles-changed" : self.tiles_changed,
+            }
+
+    def update(self, pixels, uint16_t width, uint16_t height, uint32_t rowstride, uint8_t bpp=4):
+        """
+            Checksum each tile of the new picture,
+            and return the list of rectangles that have changed,
+            adjacent tiles are merged together.
+            The first picture (or a new picture size) is returned as a single rectangle.
+        """
+        assert width>0 and height>0, "invalid dimensions: %ix%i" % (width, height)
+        cdef uint8_t *buf = NULL
+        cdef Py_ssize_t buf_len = 0
+        cdef Py_ssize_t min_buf_len = rowstride*(height-1)+width*bpp
+        assert object_as_buffer(pixels, <const void**> &buf, &buf_len)==0
+        assert buf_len>=min_buf_len, "buffer length=%i is too small for %ix%i with rowstride %i, should be %i" % (buf_len, width, height, rowstride, min_buf_len)
+        assert width*bpp<=rowstride, "invalid row length: %ix%i=%i but rowstride is %i" % (width, bpp, width*bpp, rowstride)
+        self.updates += 1
+        cdef uint16_t ts = self.tile_size
+        cdef int full = self.checksums==NULL or width!=self.width or height!=self.height
+        if full:
+            self.free()
+            self.width = width
+            self.height = height
+            self.cols = (width+ts-1)//ts
+            self.rows = (height+ts-1)//ts
+            self.checksums = <uint64_t*> memalign(self.cols*self.rows*sizeof(uint64_t))
+            assert self.checksums!=NULL, "checksum memory allocation failed"
+        cdef uint16_t cols = self.cols
+        cdef uint16_t rows = self.rows
+        cdef uint64_t *checksums = self.checksums
+        cdef uint64_t *tmp = <uint64_t*> memalign(cols*sizeof(uint64_t))
+        assert tmp!=NULL, "checksum memory allocation failed"
+        #each row of tiles gives us a list of (start-col, end-col) runs of changed tiles,
+        #vertically adjacent runs with identical columns are merged:
+        runs = {}
+        regions = []
+        cdef uint16_t row, col, y, ty, th, tw, start
+        cdef uint64_t v
+        cdef uint8_t *rowbuf
+        cdef uint32_t changed = 0
+        try:
+            for row in range(rows):
+                ty = row*ts
+                th = min(ts, height-ty)
+                with nogil:
+                    for col in range(cols):
+                        tw = min(ts, width-col*ts)
+                        rowbuf = buf + ty*rowstride + col*ts*bpp
+                        v = 0
+                        for y in range(th):
+                            v = (v ^ <uint64_t> xxh3(rowbuf, tw*bpp)) * PRIME
+                            rowbuf += rowstride
+                        tmp[col] = v
+                if full:
+                    for col in range(cols):
+                        checksums[row*cols+col] = tmp[col]
+                    continue
+                new_runs = {}
+                col = 0
+                while col<cols:
+                    if checksums[row*cols+col]==tmp[col]:
+                        col += 1
+                        continue
+                    start = col
+                    while col<cols and checksums[row*cols+col]!=tmp[col]:
+                        checksums[row*cols+col] = tmp[col]
+                        col += 1
+                    changed += col-start
+                    r = rectangle(start*ts, ty, min(col*ts, width)-start*ts, th)
+                    prev = runs.get((start, col))
+                    if prev:
+                        r = merge_all([prev, r])
+                    new_runs[(start, col)] = r
+                #runs that did not continue on this row are complete:
+                for k, r in runs.items():
+                    if k not in new_runs:
+                        regions.append(r)
+                runs = new_runs
+        finally:
+            free(tmp)
+        if full:
+            self.tiles_changed += cols*rows
+            return [rectangle(0, 0, width, height)]
+        regions += list(runs.values())
+        self.tiles_changed += changed
+        if DEBUG:
+            log("%s.update(..) %i tiles changed: %s", self, changed, regions)
+        return regions
+
+    def invalidate(self):
+        self.free()
+
+    def __dealloc__(self):
+        self.free()
+
+    def free(self):
+        cdef void* ptr = <void*> self.checksums
+        if ptr:
+            self.checksums = NULL
+            free(ptr)
@@ -9,12 +9,15 @@ import os
 from xpra.net.compression import Compressed
 from xpra.server.source.stub_source_mixin import StubSourceMixin
 from xpra.os_util import get_machine_id, get_user_uuid, bytestostr, POSIX
-from xpra.util import csv, envbool, flatten_dict, typedict, XPRA_AUDIO_NOTIFICATION_ID
+from xpra.util import csv, envbool, envint, flatten_dict, typedict, XPRA_AUDIO_NOTIFICATION_ID
 from xpra.log import Logger
 
 log = Logger("sound")
 
 NEW_STREAM_SOUND = envbool("XPRA_NEW_STREAM_SOUND", True)
+SHARED_SOUND_SOURCE = envbool("XPRA_SHARED_SOUND_SOURCE", True)
+#drop sound buffers when the client already has this many packets waiting to be sent:
+SOUND_QUEUE_LIMIT = envint("XPRA_SOUND_QUEUE_LIMIT", 50)
 
 
 class AudioMixin(StubSourceMixin):
@@ -172,9 +175,12 @@ class AudioMixin(StubSourceMixin):
         try:
             from xpra.sound.wrapper import start_sending_sound
             plugins = self.sound_properties.strtupleget("plugins")
+            #clients using the same pipeline can share it,
+            #unless we're going to modify the volume (ie: fade in):
+            shared = SHARED_SOUND_SOURCE and volume==1.0
             ss = start_sending_sound(plugins, self.sound_source_plugin,
                                      None, codec, volume, True, [codec],
-                                     self.pulseaudio_server, self.pulseaudio_id)
+                                     self.pulseaudio_server, self.pulseaudio_id, shared)
             self.sound_source = ss
             log("start_sending_sound() sound source=%s", ss)
             if not ss:
@@ -284,6 +290,13 @@ class AudioMixin(StubSourceMixin):
             log("sound buffer dropped: old sequence number: %s (current is %s)",
                 sound_source.sequence, self.sound_source_sequence)
             return
+        #don't drop the first 10 buffers
+        can_drop_packet = (sound_source.info or {}).get("buffer_count", 0)>10
+        if can_drop_packet and SOUND_QUEUE_LIMIT>0:
+            queued = self.get_queue_size()
+            if queued>SOUND_QUEUE_LIMIT:
+                log("sound buffer dropped: %i packets queued already", queued)
+                return
         if packet_metadata:
             if not self.sound_bundle_metadata:
                 #client does not support bundling, send packet metadata as individual packets before the main packet:
@@ -293,8 +306,6 @@ class AudioMixin(StubSourceMixin):
             else:
                 #the packet metadata is compressed already:
                 packet_metadata = Compressed("packet metadata", packet_metadata, can_inline=True)
-        #don't drop the first 10 buffers
-        can_drop_packet = (sound_source.info or {}).get("buffer_count", 0)>10
         self.send_sound_data(sound_source, data, metadata, packet_metadata, can_drop_packet)
 
     def send_sound_data(self, sound_source, data, metadata, packet_metadata=None, can_drop_packet=False):
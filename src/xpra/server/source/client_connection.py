@@ -47,9 +47,11 @@ When we don't, then send packets from the 'packet_queue'. (compressed pixels or
 See 'next_packet'.
 
 The UI thread calls damage(), which goes into WindowSource and eventually (batching may be involved)
-adds the damage pixels ready for processing to the encode_work_queue,
-items are picked off by the separate 'encode' thread (see 'encode_loop')
+adds the damage pixels ready for processing to one of the encode work queues,
+items are picked off by the separate 'encode' threads (see 'encode_loop')
 and added to the damage_packet_queue.
+All the work items for a given window always go to the same encode thread,
+so that windows can be encoded concurrently but each window's packets remain in order.
 """
 
 class ClientConnection(StubSourceMixin):
@@ -76,8 +78,10 @@ class ClientConnection(StubSourceMixin):
         #this queue will hold functions to call to compress data (pixels, clipboard)
         #items placed in this queue are picked off by the "encode" thread,
         #the functions should add the packets they generate to the 'packet_queue'
-        self.encode_work_queue = None
-        self.encode_thread = None
+        #(there is one queue per encode thread, see 'encode_threads')
+        self.encode_work_queues = ()
+        self.encode_workers = []
+        self.encode_threads = 1
         self.ordinary_packets = []
         self.socket_dir = socket_dir
         self.unix_socket_paths = unix_socket_paths
@@ -239,29 +243,49 @@ class ClientConnection(StubSourceMixin):
     #
     # The encode thread loop management:
     #
-    def start_queue_encode(self, item):
-        #start the encode work queue:
+    def start_queue_encode(self, item, wid=0):
+        #start the encode work queues:
         #holds functions to call to compress data (pixels, clipboard)
-        #items placed in this queue are picked off by the "encode" thread,
+        #items placed in these queues are picked off by the "encode" threads,
         #the functions should add the packets they generate to the 'packet_queue'
-        self.encode_work_queue = Queue()
-        self.queue_encode = self.encode_work_queue.put
-        self.queue_encode(item)
-        self.encode_thread = start_thread(self.encode_loop, "encode")
+        n = max(1, self.encode_threads)
+        self.encode_work_queues = tuple(Queue() for _ in range(n))
+        self.queue_encode = self.do_queue_encode
+        self.queue_encode(item, wid)
+        for i, work_queue in enumerate(self.encode_work_queues):
+            name = "encode" if n==1 else "encode-%i" % i
+            self.encode_workers.append(start_thread(self.encode_loop, name, args=(work_queue,)))
+
+    def do_queue_encode(self, item, wid=0):
+        ewq = self.encode_work_queues
+        if item is None:
+            #end of queue marker, for all the encode threads:
+            for work_queue in ewq:
+                work_queue.put(None)
+            return
+        if getattr(self, "mmap_size", 0)>0:
+            #the mmap area is a ring buffer which must be written to
+            #and sent from a single thread, in order:
+            ewq[0].put(item)
+            return
+        #all the items for the same window go to the same encode thread,
+        #so they are processed in the order they were queued:
+        ewq[wid % len(ewq)].put(item)
 
     def encode_queue_size(self) -> int:
-        ewq = self.encode_work_queue
-        if ewq is None:
-            return 0
-        return ewq.qsize()
+        return sum(self.encode_queue_sizes())
+
+    def encode_queue_sizes(self) -> tuple:
+        return tuple(work_queue.qsize() for work_queue in self.encode_work_queues)
 
-    def call_in_encode_thread(self, *fn_and_args):
+    def call_in_encode_thread(self, *fn_and_args, wid=0):
         """
             This is used by WindowSource to queue damage processing to be done in the 'encode' thread.
             The 'encode_and_send_cb' will then add the resulting packet to the 'packet_queue' via 'queue_packet'.
+            The window id is used for selecting the encode thread.
         """
         self.statistics.compression_work_qsizes.append((monotonic_time(), self.encode_queue_size()))
-        self.queue_encode(fn_and_args)
+        self.queue_encode(fn_and_args, wid)
 
     def queue_packet(self, packet, wid=0, pixels=0,
                      start_send_cb=None, end_send_cb=None, fail_cb=None, wait_for_more=False):
@@ -280,16 +304,16 @@ class ClientConnection(StubSourceMixin):
         if p:
             p.source_has_more()
 
-    def encode_loop(self):
+    def encode_loop(self, work_queue):
         """
             This runs in a separate thread and calls all the function callbacks
-            which are added to the 'encode_work_queue'.
+            which are added to its encode 'work_queue'.
             Must run until we hit the end of queue marker,
             to ensure all the queued items get called,
             those that are marked as optional will be skipped when is_closed()
         """
         while True:
-            fn_and_args = self.encode_work_queue.get(True)
+            fn_and_args = work_queue.get(True)
             if fn_and_args is None:
                 return              #empty marker
             #some function calls are optional and can be skipped when closing:
@@ -337,6 +361,10 @@ class ClientConnection(StubSourceMixin):
         kwargs["will_have_more"] = True
         self.send(*parts, **kwargs)
 
+    def get_queue_size(self) -> int:
+        """ the number of non-damage packets waiting to be sent """
+        return len(self.ordinary_packets)
+
     def send_async(self, *parts, **kwargs):
         kwargs["synchronous"] = False
         self.send(*parts, **kwargs)
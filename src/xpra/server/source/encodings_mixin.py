@@ -84,6 +84,7 @@ class EncodingsMixin(StubSourceMixin):
         self.default_min_quality    = server.default_min_quality
         self.default_speed          = server.default_speed
         self.default_min_speed      = server.default_min_speed
+        self.encode_threads         = server.encode_threads
 
     def cleanup(self):
         self.cancel_recalculate_timer()
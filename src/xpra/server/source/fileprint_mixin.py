@@ -53,7 +53,7 @@ class FilePrintMixin(FileTransferHandler, StubSourceMixin):
     def init_from(self, _protocol, server):
         self.init_attributes()
         #copy attributes
-        for x in ("file_transfer", "file_transfer_ask", "file_size_limit", "file_chunks",
+        for x in ("file_transfer", "file_transfer_ask", "file_size_limit", "file_chunks", "file_chunks_window",
                   "printing", "printing_ask", "open_files", "open_files_ask",
                   "open_url", "open_url_ask",
                   "file_ask_timeout", "open_command"):
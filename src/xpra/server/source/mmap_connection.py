@@ -130,11 +130,19 @@ class MMAP_Connection(StubSourceMixin):
         return caps
 
     def get_info(self) -> dict:
-        return {
-            "mmap" : {
-                "supported"     : self.supports_mmap,
-                "enabled"       : self.mmap is not None,
-                "size"          : self.mmap_size,
-                "filename"      : self.mmap_filename or "",
-                },
+        info = {
+            "supported"     : self.supports_mmap,
+            "enabled"       : self.mmap is not None,
+            "size"          : self.mmap_size,
+            "filename"      : self.mmap_filename or "",
             }
+        stats = getattr(self, "statistics", None)
+        if stats and stats.mmap_pixels_sent:
+            elapsed = stats.mmap_write_time or 0.000000001
+            info.update({
+                "bytes"         : stats.mmap_bytes_sent,
+                "pixels"        : stats.mmap_pixels_sent,
+                "write-time"    : int(1000*stats.mmap_write_time),
+                "mpixels-per-second" : int(stats.mmap_pixels_sent/elapsed/1000/1000),
+                })
+        return {"mmap" : info}
@@ -38,6 +38,8 @@ class GlobalPerformanceStatistics:
         # mmap state:
         self.mmap_size = 0
         self.mmap_bytes_sent = 0
+        self.mmap_pixels_sent = 0
+        self.mmap_write_time = 0                            #total time spent copying pixels to the mmap area
         self.mmap_free_size = 0                             #how much of the mmap space is left (may be negative if we failed to write the last chunk)
         # queue statistics:
         self.compression_work_qsizes = d()                  #size of the compression_work_queue before we add a new record to it
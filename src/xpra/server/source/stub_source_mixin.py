@@ -74,7 +74,7 @@ class StubSourceMixin:
         This dummy implementation makes it easier to test without a network connection.
         """
 
-    def queue_encode(self, item):
+    def queue_encode(self, item, wid=0):
         pass
 
     def send_more(self, *parts, **kwargs):
@@ -82,3 +82,9 @@ class StubSourceMixin:
 
     def send_async(self, *parts, **kwargs):
         pass
+
+    def get_queue_size(self) -> int:
+        return 0
+
+    def encode_queue_sizes(self) -> tuple:
+        return ()
@@ -7,9 +7,13 @@
 
 import os
 from io import BytesIO
+from functools import partial
+from collections import OrderedDict
 
 from xpra.server.source.stub_source_mixin import StubSourceMixin
 from xpra.server.window.metadata import make_window_metadata
+from xpra.server.window.cursor_cache import get_cursor_hash
+from xpra.server.window.icon_cache import ClientIcons
 from xpra.net.compression import Compressed
 from xpra.os_util import monotonic_time, strtobytes, bytestostr
 from xpra.util import typedict, envint, envbool, DEFAULT_METADATA_SUPPORTED, XPRA_BANDWIDTH_NOTIFICATION_ID
@@ -52,18 +56,27 @@ class WindowsMixin(StubSourceMixin):
         self.get_window_id = None
         self.window_filters = []
         self.readonly = False
+        self.encode_cache = None
+        self.cursor_cache = None
+        self.icon_cache = None
         #duplicated from encodings:
         self.global_batch_config = None
         #duplicated from clientconnection:
         self.statistics = None
 
-    def init_from(self, _protocol, server):
+    def init_from(self, protocol, server):
         self.get_transient_for  = server.get_transient_for
         self.get_focus          = server.get_focus
         self.get_cursor_data_cb = server.get_cursor_data
         self.get_window_id      = server.get_window_id
         self.window_filters     = server.window_filters
         self.readonly           = server.readonly
+        self.encode_cache       = server.encode_cache
+        self.cursor_cache       = server.cursor_cache
+        self.icon_cache         = server.icon_cache
+        if hasattr(protocol, "congestion_cb"):
+            #the udp transport measures the bandwidth available:
+            protocol.congestion_cb = self.transport_congestion_event
 
     def init_state(self):
         #WindowSource for each Window ID
@@ -73,6 +86,10 @@ class WindowsMixin(StubSourceMixin):
         self.suspended = False
         self.send_cursors = False
         self.cursor_encodings = ()
+        #the cursors the client holds, in the same order as the client's cache:
+        self.client_cursor_cache_size = 0
+        self.client_cursors = OrderedDict()
+        self.client_icons = None
         self.send_bell = False
         self.send_windows = True
         self.pointer_grabs = False
@@ -137,6 +154,10 @@ class WindowsMixin(StubSourceMixin):
         self.pointer_grabs = c.boolget("pointer.grabs")
         self.send_cursors = self.send_windows and c.boolget("cursors")
         self.cursor_encodings = c.strtupleget("encodings.cursor")
+        self.client_cursor_cache_size = c.intget("cursor.cache", 0)
+        icon_cache_size = c.intget("encoding.icons.cache", 0)
+        if icon_cache_size>0:
+            self.client_icons = ClientIcons(icon_cache_size)
         self.send_bell = c.boolget("bell")
         self.system_tray = c.boolget("system_tray")
         self.metadata_supported = c.strtupleget("metadata.supported", DEFAULT_METADATA_SUPPORTED)
@@ -144,8 +165,8 @@ class WindowsMixin(StubSourceMixin):
         self.window_min_size = c.inttupleget("window.min-size", (0, 0))
         self.window_max_size = c.inttupleget("window.max-size", (0, 0))
         self.window_restack = c.boolget("window.restack", False)
-        log("cursors=%s (encodings=%s), bell=%s",
-            self.send_cursors, self.cursor_encodings, self.send_bell)
+        log("cursors=%s (encodings=%s, cache=%i), bell=%s",
+            self.send_cursors, self.cursor_encodings, self.client_cursor_cache_size, self.send_bell)
         #window filters:
         try:
             for object_name, property_name, operator, value in c.tupleget("window-filters"):
@@ -188,7 +209,10 @@ class WindowsMixin(StubSourceMixin):
         if pqpixels:
             pqpi["current"] = pqpixels[-1]
         info = {"damage"    : {
-                               "compression_queue"      : {"size" : {"current" : self.encode_queue_size()}},
+                               "compression_queue"      : {
+                                   "size"       : {"current" : self.encode_queue_size()},
+                                   "threads"    : self.encode_queue_sizes(),
+                                   },
                                "packet_queue"           : {"size" : {"current" : len(self.packet_queue)}},
                                "packet_queue_pixels"    : pqpi,
                                },
@@ -268,18 +292,24 @@ class WindowsMixin(StubSourceMixin):
         w, h, _xhot, _yhot, serial, pixels, name = cursor_data[2:9]
         #compress pixels if needed:
         encoding = "raw"
+        cursor_hash = ""
         if pixels is not None:
             #convert bytearray to string:
             cpixels = strtobytes(pixels)
-            if "png" in self.cursor_encodings:
-                from PIL import Image
-                cursorlog("do_send_cursor() loading %i bytes of cursor pixel data for %ix%i cursor named '%s'",
-                          len(cpixels), w, h, bytestostr(name))
-                img = Image.frombytes("RGBA", (w, h), cpixels, "raw", "BGRA", w*4, 1)
-                buf = BytesIO()
-                img.save(buf, "PNG")
-                pngdata = buf.getvalue()
-                buf.close()
+            cc = self.cursor_cache
+            if cc or self.client_cursor_cache_size>0:
+                cursor_hash = get_cursor_hash(w, h, cpixels)
+            if cursor_hash and cursor_hash in self.client_cursors:
+                #the client already has it, just send the reference:
+                self.client_cursors.move_to_end(cursor_hash)
+                cpixels = b""
+                encoding = "cached"
+            elif "png" in self.cursor_encodings:
+                pngdata = cc.get(cursor_hash, "png") if cc else None
+                if pngdata is None:
+                    pngdata = self.png_cursor(w, h, cpixels, name)
+                    if cc:
+                        cc.set(cursor_hash, "png", pngdata)
                 cpixels = Compressed("png cursor", pngdata, can_inline=True)
                 encoding = "png"
                 if SAVE_CURSORS:
@@ -292,11 +322,29 @@ class WindowsMixin(StubSourceMixin):
                 cursorlog("do_send_cursor(..) pixels=%s ", cpixels)
                 encoding = "raw"
             cursor_data[7] = cpixels
+            if cursor_hash and encoding!="cached" and self.client_cursor_cache_size>0:
+                #the client will keep this one:
+                self.client_cursors[cursor_hash] = True
+                while len(self.client_cursors)>self.client_cursor_cache_size:
+                    self.client_cursors.popitem(last=False)
         cursorlog("do_send_cursor(..) %sx%s %s cursor name='%s', serial=%#x with delay=%s (cursor_encodings=%s)",
                   w, h, (encoding or "empty"), bytestostr(name), serial, delay, self.cursor_encodings)
         args = [encoding] + list(cursor_data[:9]) + [cursor_sizes[0]] + list(cursor_sizes[1])
+        if self.client_cursor_cache_size>0:
+            args.append(cursor_hash)
         self.send_more("cursor", *args)
 
+    def png_cursor(self, w, h, pixels, name):
+        from PIL import Image
+        cursorlog("png_cursor() loading %i bytes of cursor pixel data for %ix%i cursor named '%s'",
+                  len(pixels), w, h, bytestostr(name))
+        img = Image.frombytes("RGBA", (w, h), pixels, "raw", "BGRA", w*4, 1)
+        buf = BytesIO()
+        img.save(buf, "PNG")
+        pngdata = buf.getvalue()
+        buf.close()
+        return pngdata
+
     def send_empty_cursor(self):
         cursorlog("send_empty_cursor(..)")
         self.last_cursor_sent = None
@@ -550,7 +598,7 @@ class WindowsMixin(StubSourceMixin):
                               self.idle_add, self.timeout_add, self.source_remove,
                               ww, wh,
                               self.record_congestion_event, self.encode_queue_size,
-                              self.call_in_encode_thread, self.queue_packet, self.compressed_wrapper,
+                              partial(self.call_in_encode_thread, wid=wid), self.queue_packet, self.compressed_wrapper,
                               self.statistics,
                               wid, window, batch_config, self.auto_refresh_delay,
                               av_sync, av_sync_delay,
@@ -560,7 +608,8 @@ class WindowsMixin(StubSourceMixin):
                               self.window_icon_encodings, self.encoding_options, self.icons_encoding_options,
                               self.rgb_formats,
                               self.default_encoding_options,
-                              mmap, mmap_size, bandwidth_limit, self.jitter)
+                              mmap, mmap_size, bandwidth_limit, self.jitter,
+                              self.encode_cache, self.icon_cache, self.client_icons)
             self.window_sources[wid] = ws
             if len(self.window_sources)>1:
                 #re-distribute bandwidth:
@@ -584,6 +633,10 @@ class WindowsMixin(StubSourceMixin):
         s = self.statistics
         if s:
             s.damage_last_events.append((wid, monotonic_time(), w*h))
+        ec = self.encode_cache
+        if ec:
+            #the window contents may have changed:
+            ec.damage(wid)
         ws = self.make_window_source(wid, window)
         ws.damage(x, y, w, h, damage_options)
 
@@ -604,6 +657,10 @@ class WindowsMixin(StubSourceMixin):
             ws.damage_packet_acked(damage_packet_sequence, width, height, decode_time, message)
             self.may_recalculate(wid, width*height)
 
+    def transport_congestion_event(self, late_pct, send_speed):
+        for window_source in self.all_window_sources():
+            window_source.networksend_congestion_event("transport congestion", late_pct, send_speed)
+
 #
 # Methods used by WindowSource:
 #
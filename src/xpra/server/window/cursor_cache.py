@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+# This file is part of Xpra.
+# Copyright (C) 2020 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+import hashlib
+from threading import Lock
+from collections import OrderedDict
+
+from xpra.util import envint
+
+MAX_ITEMS = envint("XPRA_CURSOR_CACHE_ITEMS", 64)
+
+
+def get_cursor_hash(w : int, h : int, pixels) -> str:
+    """ identifies the cursor pixels, clients use it as a reference """
+    csum = hashlib.sha1(b"%ix%i:" % (w, h))
+    csum.update(pixels)
+    return csum.hexdigest()
+
+
+"""
+Encoded cursors shared by all the clients of a session.
+
+Applications tend to switch between the same few cursors,
+so we keep the compressed form of the recent cursors,
+indexed by the hash of their pixels and the encoding used.
+"""
+class CursorCache:
+
+    def __init__(self, max_items=MAX_ITEMS):
+        self.max_items = max_items
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    def __repr__(self):
+        return "CursorCache(%i items)" % len(self.items)
+
+    def get(self, cursor_hash : str, encoding : str):
+        with self.lock:
+            key = (cursor_hash, encoding)
+            v = self.items.get(key)
+            if v is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.items.move_to_end(key)
+            return v
+
+    def set(self, cursor_hash : str, encoding : str, data):
+        with self.lock:
+            self.items[(cursor_hash, encoding)] = data
+            while len(self.items)>self.max_items:
+                self.items.popitem(last=False)
+
+    def get_info(self) -> dict:
+        return {
+            "items"     : len(self.items),
+            "max-items" : self.max_items,
+            "hits"      : self.hits,
+            "misses"    : self.misses,
+            }
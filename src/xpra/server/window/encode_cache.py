@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+# This file is part of Xpra.
+# Copyright (C) 2020 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+from threading import Lock
+from collections import OrderedDict
+
+from xpra.util import envint
+from xpra.log import Logger
+
+log = Logger("encoding")
+
+MAX_ITEMS = envint("XPRA_ENCODE_CACHE_ITEMS", 256)
+MAX_SIZE = envint("XPRA_ENCODE_CACHE_SIZE", 64)*1024*1024
+
+
+"""
+Encoded pictures shared by all the clients of a session.
+
+When multiple clients share the same session,
+each one captures and compresses the same window contents.
+The window sources use this cache to re-use the compressed data
+when the pixels and the encoding parameters are identical.
+
+The pixels are identified by the window's damage sequence:
+this sequence is incremented every time the window is damaged,
+so two captures of the same area made with the same damage sequence
+contain the same pixels.
+"""
+class EncodeCache:
+
+    def __init__(self, max_items=MAX_ITEMS, max_size=MAX_SIZE):
+        self.max_items = max_items
+        self.max_size = max_size
+        self.enabled = False
+        self.damage_sequences = {}
+        self.items = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = Lock()
+
+    def __repr__(self):
+        return "EncodeCache(%i items)" % len(self.items)
+
+    def set_enabled(self, enabled : bool):
+        log("EncodeCache.set_enabled(%s)", enabled)
+        self.enabled = enabled
+        if not enabled:
+            self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.items = OrderedDict()
+            self.size = 0
+
+    def damage(self, wid : int):
+        #called from the UI thread whenever the window contents may have changed
+        self.damage_sequences[wid] = self.damage_sequences.get(wid, 0)+1
+
+    def get_damage_sequence(self, wid : int) -> int:
+        return self.damage_sequences.get(wid, 0)
+
+    def remove_window(self, wid : int):
+        self.damage_sequences.pop(wid, None)
+        with self.lock:
+            for key in tuple(k for k in self.items.keys() if k[0]==wid):
+                self.size -= len(self.items.pop(key)[1])
+
+    def get(self, key):
+        """
+            The key must start with the window id and the damage sequence.
+            Returns the encoder's return value, or None.
+        """
+        with self.lock:
+            v = self.items.get(key)
+            if v is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.items.move_to_end(key)
+        coding, data, client_options, outw, outh, outstride, bpp = v
+        #the client options are modified when making the packet, so use a copy:
+        return coding, data, client_options.copy(), outw, outh, outstride, bpp
+
+    def set(self, key, value):
+        coding, data, client_options, outw, outh, outstride, bpp = value
+        size = len(data)
+        if size>self.max_size//4:
+            #too big to be worth keeping
+            return
+        with self.lock:
+            old = self.items.pop(key, None)
+            if old:
+                self.size -= len(old[1])
+            self.items[key] = (coding, data, client_options.copy(), outw, outh, outstride, bpp)
+            self.size += size
+            while self.items and (len(self.items)>self.max_items or self.size>self.max_size):
+                _, evicted = self.items.popitem(last=False)
+                self.size -= len(evicted[1])
+                self.evictions += 1
+
+    def get_info(self) -> dict:
+        return {
+            "enabled"   : self.enabled,
+            "items"     : len(self.items),
+            "size"      : self.size,
+            "max-items" : self.max_items,
+            "max-size"  : self.max_size,
+            "hits"      : self.hits,
+            "misses"    : self.misses,
+            "evictions" : self.evictions,
+            }
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# This file is part of Xpra.
+# Copyright (C) 2020 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+import hashlib
+from threading import Lock
+from collections import OrderedDict
+
+from xpra.util import envint
+
+MAX_ITEMS = envint("XPRA_ICON_CACHE_ITEMS", 64)
+
+
+def get_icon_hash(w : int, h : int, pixel_format : str, pixels) -> str:
+    csum = hashlib.sha1(b"%ix%i:%s:" % (w, h, pixel_format.encode()))
+    csum.update(pixels)
+    return csum.hexdigest()
+
+
+"""
+Window icons shared by all the windows and all the clients of a session.
+
+Many windows use the same icon (ie: terminals),
+so we keep the scaled and encoded form of the recent icons,
+indexed by the hash of the source pixels and the client's icon sizes.
+"""
+class IconCache:
+
+    def __init__(self, max_items=MAX_ITEMS):
+        self.max_items = max_items
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    def __repr__(self):
+        return "IconCache(%i items)" % len(self.items)
+
+    def get(self, key):
+        """ returns the width, height and png data, or None """
+        with self.lock:
+            v = self.items.get(key)
+            if v is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.items.move_to_end(key)
+            return v
+
+    def set(self, key, w : int, h : int, data):
+        with self.lock:
+            self.items[key] = (w, h, data)
+            while len(self.items)>self.max_items:
+                self.items.popitem(last=False)
+
+    def get_info(self) -> dict:
+        return {
+            "items"     : len(self.items),
+            "max-items" : self.max_items,
+            "hits"      : self.hits,
+            "misses"    : self.misses,
+            }
+
+
+"""
+The icons a client holds, in the same order as the client's own cache,
+so we can send a reference to an icon instead of its data.
+The lock must be held until the packet has been queued,
+so the packets reach the client in the order we update this list.
+"""
+class ClientIcons:
+
+    def __init__(self, size : int):
+        self.size = size
+        self.hashes = OrderedDict()
+        self.lock = Lock()
+
+    def __repr__(self):
+        return "ClientIcons(%i / %i)" % (len(self.hashes), self.size)
+
+    def use(self, icon_hash : str) -> bool:
+        """ returns True if the client has this icon already """
+        if icon_hash not in self.hashes:
+            return False
+        self.hashes.move_to_end(icon_hash)
+        return True
+
+    def add(self, icon_hash : str):
+        self.hashes[icon_hash] = True
+        while len(self.hashes)>self.size:
+            self.hashes.popitem(last=False)
@@ -87,6 +87,8 @@ def get_env_encodings(etype, valid_options=()):
 TRANSPARENCY_ENCODINGS = get_env_encodings("TRANSPARENCY", ("webp", "png", "rgb32"))
 LOSSLESS_ENCODINGS = get_env_encodings("LOSSLESS", ("rgb", "png", "png/P", "png/L"))
 REFRESH_ENCODINGS = get_env_encodings("REFRESH", ("webp", "png", "rgb24", "rgb32"))
+#stateless picture encodings, which can be shared with other clients:
+CACHE_ENCODINGS = get_env_encodings("CACHE", ("webp", "png", "png/P", "png/L", "jpeg", "rgb24", "rgb32"))
 
 
 class DelayedRegions:
@@ -127,8 +129,9 @@ class WindowSource(WindowIconSource):
                     encoding_options, icons_encoding_options,
                     rgb_formats,
                     default_encoding_options,
-                    mmap, mmap_size, bandwidth_limit, jitter):
-        super().__init__(window_icon_encodings, icons_encoding_options)
+                    mmap, mmap_size, bandwidth_limit, jitter,
+                    encode_cache, icon_cache, client_icons):
+        super().__init__(window_icon_encodings, icons_encoding_options, icon_cache, client_icons)
         self.idle_add = idle_add
         self.timeout_add = timeout_add
         self.source_remove = source_remove
@@ -146,6 +149,7 @@ class WindowSource(WindowIconSource):
         self.call_in_encode_thread = call_in_encode_thread  #callback to add damage data which is ready to compress to the damage processing queue
         self.queue_packet = queue_packet                #callback to add a network packet to the outgoing queue
         self.compressed_wrapper = compressed_wrapper    #callback utility for making compressed wrappers
+        self.encode_cache = encode_cache                #encoded pictures shared with other clients (may be None)
         self.wid = wid
         self.window = window                            #only to be used from the UI thread!
         self.global_statistics = statistics             #shared/global statistics from ClientConnection
@@ -383,6 +387,8 @@ class WindowSource(WindowIconSource):
         self._fixed_speed = -1
         self._fixed_min_speed = 0
         #
+        self.encode_cache = None
+        #
         self._damage_delayed = None
         self._sequence = 1
         self._damage_cancelled = 0
@@ -1821,6 +1827,7 @@ class WindowSource(WindowIconSource):
             return
 
         rgb_request_time = monotonic_time()
+        options = self.add_damage_sequence(options)
         image = self.window.get_image(x, y, w, h)
         if image is None:
             log("process_damage_region: no pixel data for window %s, wid=%s", self.window, self.wid)
@@ -1842,6 +1849,42 @@ class WindowSource(WindowIconSource):
                 self.wid, w, h, coding, 1000*(now-damage_time), 1000*(now-rgb_request_time))
 
 
+    def add_damage_sequence(self, options):
+        """
+            Records the window's damage sequence with the damage options,
+            so that the encoded result can be shared using the encode cache.
+            This runs in the UI thread, just before capturing the pixels.
+        """
+        ec = self.encode_cache
+        if not ec or not ec.enabled:
+            return options
+        #use a copy since the same options may be used for later captures:
+        options = dict(options)
+        options["damage-sequence"] = ec.get_damage_sequence(self.wid)
+        return options
+
+    def get_encode_cache_key(self, coding, image, options):
+        """
+            The key identifies the pixels (window id, damage sequence and region)
+            and all the attributes that affect the output of the encoder.
+        """
+        ec = self.encode_cache
+        if not ec or not ec.enabled or coding not in CACHE_ENCODINGS:
+            return None
+        damage_sequence = options.get("damage-sequence")
+        if damage_sequence is None:
+            return None
+        quality = options.get("quality") or self.get_quality(coding)
+        speed = options.get("speed") or self.get_speed(coding)
+        crs = self.client_render_size
+        return (self.wid, damage_sequence,
+                image.get_target_x(), image.get_target_y(), image.get_width(), image.get_height(),
+                image.get_pixel_format(), coding, quality, speed, self._current_quality, self._current_speed,
+                options.get("transparency", True), self.supports_transparency, self.encoding=="grayscale",
+                tuple(self.rgb_formats), self.rgb_zlib, self.rgb_lz4, self.rgb_lzo,
+                self.full_csc_modes.strtupleget("webp"), self.content_type,
+                tuple(crs) if crs else None, self.window_dimensions)
+
     def make_data_packet_cb(self, w, h, damage_time, process_damage_time, image, coding, sequence, options, flush):
         """ This function is called from the damage data thread!
             Extra care must be taken to prevent access to X11 functions on window.
@@ -2333,11 +2376,20 @@ class WindowSource(WindowIconSource):
                 log("make_data_packet: skipped, sequence no %i is cancelled", sequence)
                 return None
             raise Exception("BUG: no encoder not found for %s" % coding)
-        ret = encoder(coding, image, options)
+        ret = None
+        cache_key = self.get_encode_cache_key(coding, image, options)
+        if cache_key:
+            ret = self.encode_cache.get(cache_key)
         if ret is None:
-            log("%s%s returned None", encoder, (coding, image, options))
-            #something went wrong.. nothing we can do about it here!
-            return  None
+            ret = encoder(coding, image, options)
+            if ret is None:
+                log("%s%s returned None", encoder, (coding, image, options))
+                #something went wrong.. nothing we can do about it here!
+                return  None
+            if cache_key:
+                self.encode_cache.set(cache_key, ret)
+        else:
+            compresslog("make_data_packet: using cached %s data for %s", coding, cache_key[:6])
 
         coding, data, client_options, outw, outh, outstride, bpp = ret
         coding = bytestostr(coding)
@@ -2446,9 +2498,12 @@ class WindowSource(WindowIconSource):
         v = mmap_send(self._mmap, self._mmap_size, image, self.rgb_formats, self.supports_transparency)
         if v is None:
             return None
-        mmap_info, mmap_free_size, written = v
-        self.global_statistics.mmap_bytes_sent += written
-        self.global_statistics.mmap_free_size = mmap_free_size
+        mmap_info, mmap_free_size, written, elapsed = v
+        gs = self.global_statistics
+        gs.mmap_bytes_sent += written
+        gs.mmap_pixels_sent += image.get_width()*image.get_height()
+        gs.mmap_write_time += elapsed
+        gs.mmap_free_size = mmap_free_size
         #the data we send is the index within the mmap area:
         client_options = {"rgb_format" : image.get_pixel_format()}
         return "mmap", mmap_info, client_options, image.get_width(), image.get_height(), image.get_rowstride(), 32
@@ -20,9 +20,10 @@ from xpra.server.window.window_source import (
 from xpra.rectangle import rectangle, merge_all          #@UnresolvedImport
 from xpra.server.window.motion import ScrollData                    #@UnresolvedImport
 from xpra.server.window.video_subregion import VideoSubregion, VIDEO_SUBREGION
-from xpra.server.window.video_scoring import get_pipeline_score
+from xpra.server.window.video_scoring import get_pipeline_score, MIN_FPS_COST
 from xpra.codecs.codec_constants import PREFERRED_ENCODING_ORDER, EDGE_ENCODING_ORDER
 from xpra.codecs.loader import has_codec
+from xpra.codecs.video_pool import get_pool_class
 from xpra.util import parse_scaling_value, engs, envint, envbool, csv, roundup, print_nested_dict, first_time, typedict
 from xpra.os_util import monotonic_time, bytestostr
 from xpra.log import Logger
@@ -45,6 +46,9 @@ MAX_NONVIDEO_PIXELS = envint("XPRA_MAX_NONVIDEO_PIXELS", 1024*4)
 MIN_VIDEO_FPS = envint("XPRA_MIN_VIDEO_FPS", 10)
 MIN_VIDEO_EVENTS = envint("XPRA_MIN_VIDEO_EVENTS", 20)
 ENCODE_QUEUE_MIN_GAP = envint("XPRA_ENCODE_QUEUE_MIN_GAP", 5)
+SCORE_CACHE = envbool("XPRA_SCORE_CACHE", True)
+#speed and quality values are rounded down to a multiple of this value for scoring:
+SCORE_STEP = max(1, envint("XPRA_SCORE_STEP", 5))
 
 VIDEO_TIMEOUT = envint("XPRA_VIDEO_TIMEOUT", 10)
 VIDEO_NODETECT_TIMEOUT = envint("XPRA_VIDEO_NODETECT_TIMEOUT", 10*60)
@@ -123,6 +127,8 @@ class WindowVideoSource(WindowSource):
         self.video_max_size = self.encoding_options.inttupleget("video_max_size", (8192, 8192), 2, 2)
         self.video_subregion = VideoSubregion(self.timeout_add, self.source_remove, self.refresh_subregion, self.auto_refresh_delay)
         self.video_stream_file = None
+        #video encoders and csc converters shared with other windows (may be None):
+        self.video_pool = self.video_helper.video_pool
 
     def init_encoders(self):
         WindowSource.init_encoders(self)
@@ -335,18 +341,29 @@ class WindowVideoSource(WindowSource):
 
     def csc_clean(self, csce):
         if csce:
-            csce.clean()
+            vp = self.video_pool
+            if vp and vp.release(csce):
+                #the pool owns it now, another window may use it:
+                if self._csc_encoder is csce:
+                    self._csc_encoder = None
+            else:
+                csce.clean()
 
     def ve_clean(self, ve):
         self.cancel_video_encoder_timer()
         if ve:
-            ve.clean()
+            vp = self.video_pool
+            pooled = vp and vp.release(ve)
+            if not pooled:
+                ve.clean()
             #only send eos if this video encoder is still current,
             #(otherwise, sending the new stream will have taken care of it already,
             # and sending eos then would close the new stream, not the old one!)
             if self.supports_eos and self._video_encoder==ve:
                 log("sending eos for wid %i", self.wid)
                 self.queue_packet(("eos", self.wid))
+            if pooled and self._video_encoder is ve:
+                self._video_encoder = None
             if SAVE_VIDEO_STREAMS:
                 self.close_video_stream_file()
 
@@ -879,6 +896,7 @@ class WindowVideoSource(WindowSource):
             return
 
         rgb_request_time = monotonic_time()
+        options = self.add_damage_sequence(options)
         image = self.window.get_image(x, y, w, h)
         if image is None:
             log("process_damage_region: no pixel data for window %s, wid=%s", self.window, self.wid)
@@ -1248,6 +1266,8 @@ class WindowVideoSource(WindowSource):
             score (best solution comes first).
             Because this function is expensive to call, we cache the results.
             This allows it to run more often from the timer thread.
+            The video helper also keeps the scores for all the windows,
+            indexed by every value that can affect them.
 
             Can be called from any thread.
         """
@@ -1280,10 +1300,48 @@ class WindowVideoSource(WindowSource):
                 #not the video region, or not really video content, raise quality a bit:
                 target_q = int(sqrt(target_q/100.0)*100)
                 scorelog("raising quality for video encoding of non-video region")
+        #quantize, so we can re-use the scores more often:
+        target_q = target_q//SCORE_STEP*SCORE_STEP
+        min_q = min_q//SCORE_STEP*SCORE_STEP
+        target_s = target_s//SCORE_STEP*SCORE_STEP
+        min_s = min_s//SCORE_STEP*SCORE_STEP
         scorelog("get_video_pipeline_options%s speed: %s (min %s), quality: %s (min %s)",
                  (encodings, width, height, src_format), target_s, min_s, target_q, min_q)
         vmw, vmh = self.video_max_size
-        ffps = self.get_video_fps(width, height)
+        #the fps only affects the score below MIN_FPS_COST:
+        ffps = min(MIN_FPS_COST, self.get_video_fps(width, height))
+        vs = self.video_subregion
+        detection = bool(vs) and vs.detection
+        #the scaling we would use for each encoder size limit:
+        csc_can_scale = any(csc_spec.can_scale for csc_specs in vh.get_csc_specs(src_format).values() for csc_spec in csc_specs)
+        scalings = {}
+        for encoding in encodings:
+            for colorspace_specs in vh.get_encoder_specs(encoding).values():
+                for encoder_spec in colorspace_specs:
+                    max_size = min(encoder_spec.max_w, vmw), min(encoder_spec.max_h, vmh)
+                    if max_size not in scalings and (csc_can_scale or encoder_spec.can_scale):
+                        scalings[max_size] = self.calculate_scaling(width, height, *max_size)
+        #must copy reference to those objects because of threading races:
+        csce = self._csc_encoder
+        ve = self._video_encoder
+        cache_key = None
+        if SCORE_CACHE:
+            cache_key = (
+                tuple(encodings), width, height, src_format,
+                target_q, min_q, target_s, min_s,
+                tuple(sorted(scalings.items())), ffps, detection, self.is_shadow,
+                tuple(self.full_csc_modes.strtupleget(encoding) for encoding in encodings),
+                #the current pipeline lowers the cost of the options that can re-use it:
+                csce and (type(csce), csce.get_dst_format(), csce.get_src_width(), csce.get_src_height()),
+                ve and (ve.get_type(), ve.get_src_format(), ve.get_width(), ve.get_height()),
+                )
+            scores = vh.get_cached_scores(cache_key)
+            if scores is not None:
+                scorelog("get_video_pipeline_options%s using cached scores", (encodings, width, height, src_format))
+                self.last_pipeline_params = (encodings, width, height, src_format)
+                self.last_pipeline_scores = scores
+                self.last_pipeline_time = monotonic_time()
+                return scores
         scores = []
         for encoding in encodings:
             #these are the CSC modes the client can handle for this encoding:
@@ -1318,21 +1376,17 @@ class WindowVideoSource(WindowSource):
                         scorelog(" no matches for %s (%s and %s) - %s",
                                  encoder_spec, encoder_spec.output_colorspaces, supported_csc_modes, info)
                         continue
-                    max_w = min(encoder_spec.max_w, vmw)
-                    max_h = min(encoder_spec.max_h, vmh)
                     if (csc_spec and csc_spec.can_scale) or encoder_spec.can_scale:
-                        scaling = self.calculate_scaling(width, height, max_w, max_h)
+                        scaling = scalings[min(encoder_spec.max_w, vmw), min(encoder_spec.max_h, vmh)]
                     else:
                         scaling = (1, 1)
                     score_delta = encoding_score_delta
                     if self.is_shadow and enc_in_format in ("NV12", "YUV420P", "YUV422P") and scaling==(1, 1):
                         #avoid subsampling with shadow servers:
                         score_delta -= 40
-                    vs = self.video_subregion
-                    detection = bool(vs) and vs.detection
                     score_data = get_pipeline_score(enc_in_format, csc_spec, encoder_spec, width, height, scaling,
                                                     target_q, min_q, target_s, min_s,
-                                                    self._csc_encoder, self._video_encoder,
+                                                    csce, ve,
                                                     score_delta, ffps, detection)
                     if score_data:
                         scores.append(score_data)
@@ -1360,6 +1414,8 @@ class WindowVideoSource(WindowSource):
         else:
             self.last_pipeline_params = (encodings, width, height, src_format)
             self.last_pipeline_scores = s
+            if cache_key:
+                vh.set_cached_scores(cache_key, s)
         self.last_pipeline_time = monotonic_time()
         return s
 
@@ -1701,6 +1757,7 @@ class WindowVideoSource(WindowSource):
                       enc_in_format, encoder_scaling, enc_width, enc_height, encoder_spec):
         speed = self._current_speed
         quality = self._current_quality
+        vp = self.video_pool
         min_w = 1
         min_h = 1
         max_w = 16384
@@ -1717,9 +1774,15 @@ class WindowVideoSource(WindowSource):
             #so make sure it never degrades quality
             csc_speed = min(speed, 100-quality/2.0)
             csc_start = monotonic_time()
-            csce = csc_spec.make_instance()
-            csce.init_context(csc_width, csc_height, src_format,
-                                   enc_width, enc_height, enc_in_format, csc_speed)
+            csc_key = ("csc", csc_spec.codec_type, src_format, csc_width, csc_height,
+                       enc_in_format, enc_width, enc_height, get_pool_class(csc_speed))
+            csce = vp.get(csc_key) if vp else None
+            if not csce:
+                csce = csc_spec.make_instance()
+                csce.init_context(csc_width, csc_height, src_format,
+                                       enc_width, enc_height, enc_in_format, csc_speed)
+                if vp:
+                    vp.add(csc_key, csce)
             csc_end = monotonic_time()
             csclog("setup_pipeline: csc=%s, info=%s, setup took %.2fms",
                   csce, csce.get_info(), (csc_end-csc_start)*1000.0)
@@ -1740,12 +1803,25 @@ class WindowVideoSource(WindowSource):
         enc_start = monotonic_time()
         #FIXME: filter dst_formats to only contain formats the encoder knows about?
         dst_formats = tuple(bytestostr(x) for x in self.full_csc_modes.strtupleget(encoder_spec.encoding))
-        ve = encoder_spec.make_instance()
         options = typedict(self.encoding_options)
         options.update(self.get_video_encoder_options(encoder_spec.encoding, width, height))
-        ve.init_context(enc_width, enc_height, enc_in_format,
-                        dst_formats, encoder_spec.encoding,
-                        quality, speed, encoder_scaling, options)
+        ve_key = ("encoder", encoder_spec.codec_type, encoder_spec.encoding, enc_in_format,
+                  enc_width, enc_height, encoder_scaling, dst_formats,
+                  get_pool_class(speed), get_pool_class(quality),
+                  repr(sorted((bytestostr(k), repr(v)) for k,v in options.items())))
+        ve = vp.get(ve_key) if vp else None
+        if ve:
+            #restarted when it was released, so the next frame starts a new stream:
+            ve.set_encoding_speed(speed)
+            ve.set_encoding_quality(quality)
+        else:
+            ve = encoder_spec.make_instance()
+            ve.init_context(enc_width, enc_height, enc_in_format,
+                            dst_formats, encoder_spec.encoding,
+                            quality, speed, encoder_scaling, options)
+            #only encoders which can start a new stream can be re-used:
+            if vp and hasattr(ve, "restart"):
+                vp.add(ve_key, ve)
         #record new actual limits:
         self.actual_scaling = scaling
         self.width_mask = width_mask
@@ -13,6 +13,7 @@ from PIL import Image
 
 from xpra.os_util import monotonic_time, load_binary_file, memoryview_to_bytes
 from xpra.net import compression
+from xpra.server.window.icon_cache import get_icon_hash
 from xpra.util import envbool, envint, csv
 from xpra.log import Logger
 
@@ -34,9 +35,11 @@ class WindowIconSource:
 
     fallback_window_icon = False
 
-    def __init__(self, window_icon_encodings, icons_encoding_options):
+    def __init__(self, window_icon_encodings, icons_encoding_options, icon_cache=None, client_icons=None):
         self.window_icon_encodings = window_icon_encodings
         self.icons_encoding_options = icons_encoding_options    #icon caps
+        self.icon_cache = icon_cache                            #encoded icons shared with other windows (may be None)
+        self.client_icons = client_icons                        #the icons the client holds already (may be None)
 
         self.has_png = PNG_ICONS and ("png" in self.window_icon_encodings)
         self.has_default = DEFAULT_ICONS and ("default" in self.window_icon_encodings)
@@ -187,6 +190,40 @@ class WindowIconSource:
         log("compress_and_send_window_icon() %ix%i in %s format, %i bytes for wid=%i",
             w, h, pixel_format, len(pixel_data), self.wid)
         assert pixel_format in ("BGRA", "RGBA", "png"), "invalid window icon format %s" % pixel_format
+        icon_hash = ""
+        ic = self.icon_cache
+        ci = self.client_icons
+        if ic or ci:
+            icon_hash = get_icon_hash(w, h, pixel_format, pixel_data)
+        if ci:
+            with ci.lock:
+                if ci.use(icon_hash):
+                    packet = ("window-icon", self.wid, w, h, "cached", icon_hash)
+                    log("queuing window icon reference: %s", packet)
+                    self.queue_packet(packet, wait_for_more=True)
+                    return
+        key = (icon_hash, self.window_icon_size, self.window_icon_max_size)
+        cached = ic.get(key) if ic else None
+        if cached:
+            w, h, pixel_data = cached
+            log("using cached window icon %s", icon_hash)
+        else:
+            w, h, pixel_data = self.encode_window_icon(w, h, pixel_format, pixel_data)
+            if ic:
+                ic.set(key, w, h, pixel_data)
+        wrapper = compression.Compressed("png", pixel_data)
+        packet = ("window-icon", self.wid, w, h, wrapper.datatype, wrapper)
+        log("queuing window icon update: %s", packet)
+        if ci:
+            #the client will keep this one:
+            with ci.lock:
+                ci.add(icon_hash)
+                self.queue_packet(packet+(icon_hash, ), wait_for_more=True)
+            return
+        self.queue_packet(packet, wait_for_more=True)
+
+    def encode_window_icon(self, w, h, pixel_format, pixel_data):
+        """ returns the png data for the icon, scaled down if needed """
         if pixel_format=="BGRA":
             #BGRA data is always unpremultiplied
             #(that's what we get from NetWMIcons)
@@ -198,7 +235,7 @@ class WindowIconSource:
         #or if we must downscale it (bigger than what the client is willing to deal with),
         #or if we want to save window icons
         must_scale = w>max_w or h>max_h
-        log("compress_and_send_window_icon: %sx%s (max-size=%s, standard-size=%s), pixel_format=%s",
+        log("encode_window_icon: %sx%s (max-size=%s, standard-size=%s), pixel_format=%s",
             w, h, self.window_icon_max_size, self.window_icon_size, pixel_format)
         must_convert = pixel_format!="png"
         log(" must convert=%s, must scale=%s", must_convert, must_scale)
@@ -234,10 +271,7 @@ class WindowIconSource:
             pixel_data = output.getvalue()
             output.close()
             w, h = image.size
-        wrapper = compression.Compressed("png", pixel_data)
-        packet = ("window-icon", self.wid, w, h, wrapper.datatype, wrapper)
-        log("queuing window icon update: %s", packet)
-        self.queue_packet(packet, wait_for_more=True)
+        return w, h, pixel_data
 
 
     def choose_icon(self, icons, max_w=1024, max_h=1024):
@@ -334,6 +334,177 @@ class source_subprocess_wrapper(sound_subprocess_wrapper):
         return "source_subprocess_wrapper(%s)" % proc
 
 
+#the capture pipelines shared by the clients,
+#indexed by plugin, options, codecs and volume:
+shared_sources = {}
+
+def get_shared_source(plugin, options, codecs, volume):
+    key = (plugin, format_element_options(options), tuple(codecs), volume)
+    source = shared_sources.get(key)
+    if source:
+        log("using existing %s", source)
+    else:
+        source = shared_source(key, plugin, options, codecs, volume)
+        shared_sources[key] = source
+    return source
+
+
+class shared_source:
+    """ A single capture and encoding subprocess,
+        the signals are forwarded to every client attached to it.
+    """
+    SIGNALS = ("new-stream", "new-buffer", "info", "exit", "error")
+
+    def __init__(self, key, plugin, options, codecs, volume):
+        self.key = key
+        self.plugin = plugin
+        self.options = options
+        self.codecs = codecs
+        self.volume = volume
+        self.wrapper = source_subprocess_wrapper(plugin, options, codecs, volume, options)
+        self.clients = []
+        self.started = False
+        #the codec of the stream, once it has started:
+        self.stream_codec = None
+        #the stream headers bundled with the first buffer,
+        #which the clients joining later also need:
+        self.packet_metadata = None
+        for signal in self.SIGNALS:
+            self.wrapper.connect(signal, self.forward, signal)
+
+    def __repr__(self):
+        return "shared_source(%s, %i clients)" % (self.wrapper, len(self.clients))
+
+    def forward(self, _wrapper, signal, *args):
+        if signal=="new-stream":
+            self.stream_codec = args[0] if args else None
+            self.packet_metadata = None
+        elif signal=="new-buffer":
+            if self.packet_metadata is None and args[2]:
+                self.packet_metadata = list(args[2])
+        elif signal=="exit" and shared_sources.get(self.key) is self:
+            del shared_sources[self.key]
+        for client in tuple(self.clients):
+            if signal=="new-buffer":
+                #each client adds its own sequence number to the metadata:
+                data, metadata, packet_metadata = args[:3]
+                if client.needs_headers:
+                    client.needs_headers = False
+                    if not packet_metadata:
+                        packet_metadata = self.packet_metadata or ()
+                client.fire(signal, data, dict(metadata), packet_metadata, *args[3:])
+            else:
+                client.fire(signal, *args)
+
+    def add(self, client):
+        if self.stream_codec:
+            #the stream has already started, so this client missed the signal,
+            #and the headers sent with the first buffer.
+            #(the client's callbacks are connected before it is started,
+            #and it must get the signal before any buffer)
+            client.needs_headers = True
+            client.fire("new-stream", self.stream_codec)
+        self.clients.append(client)
+        if not self.started:
+            self.started = True
+            self.wrapper.start()
+
+    def remove(self, client):
+        if client in self.clients:
+            self.clients.remove(client)
+        if not self.clients:
+            if shared_sources.get(self.key) is self:
+                del shared_sources[self.key]
+            if self.started:
+                self.wrapper.cleanup()
+
+    def set_volume(self, volume):
+        """ only used when there is a single client """
+        key = self.key[:-1]+(volume, )
+        if shared_sources.get(self.key) is self:
+            del shared_sources[self.key]
+        self.key = key
+        self.volume = volume
+        shared_sources[key] = self
+        self.wrapper.set_volume(volume)
+
+
+class shared_source_client:
+    """ Looks like a source_subprocess_wrapper to the client,
+        but the sound buffers come from a shared_source.
+        Changing the volume moves the client to a pipeline using this volume,
+        unless it is the only client of the current one.
+    """
+    def __init__(self, source, codec, volume):
+        self.source = source
+        self.codec = codec
+        self.volume = volume
+        self.sequence = 0
+        self.buffer_count = 0
+        self.needs_headers = False
+        self.signal_callbacks = {}
+
+    def __repr__(self):
+        return "shared_source_client(%s)" % self.source
+
+    @property
+    def info(self):
+        #the buffer count is used for deciding which buffers can be dropped,
+        #so it must be our own and not the total for the shared pipeline:
+        info = dict(self.source.wrapper.info or {})
+        info["buffer_count"] = self.buffer_count
+        return info
+
+    @property
+    def codec_description(self):
+        return self.source.wrapper.codec_description
+
+    def connect(self, signal, cb, *args):
+        self.signal_callbacks.setdefault(signal, []).append((cb, list(args)))
+
+    def fire(self, signal, *args):
+        if signal=="new-buffer":
+            self.buffer_count += 1+len(args[2])
+        for cb, cb_args in self.signal_callbacks.get(signal, ()):
+            try:
+                cb(self, *(cb_args+list(args)))
+            except Exception:
+                log.error("Error processing %s signal with %s", signal, cb, exc_info=True)
+
+    def start(self):
+        self.source.add(self)
+
+    def cleanup(self):
+        self.signal_callbacks = {}
+        self.source.remove(self)
+
+    def get_state(self):
+        return self.source.wrapper.get_state()
+
+    def get_info(self) -> dict:
+        info = dict(self.source.wrapper.get_info())
+        info["shared"] = len(self.source.clients)
+        info["buffer_count"] = self.buffer_count
+        return info
+
+    def set_volume(self, v):
+        if v==self.volume:
+            return
+        self.volume = v
+        source = self.source
+        key = source.key[:-1]+(v, )
+        if source.clients==[self] and key not in shared_sources:
+            source.set_volume(v)
+            return
+        #don't modify the volume for the other clients:
+        source.remove(self)
+        self.source = get_shared_source(source.plugin, source.options, source.codecs, v)
+        self.source.add(self)
+
+    def get_volume(self):
+        return self.volume
+
+
 class sink_subprocess_wrapper(sound_subprocess_wrapper):
 
     def __init__(self, plugin, codec, volume, element_options):
@@ -363,9 +534,9 @@ class sink_subprocess_wrapper(sound_subprocess_wrapper):
         return "sink_subprocess_wrapper(%s)" % proc
 
 
-def start_sending_sound(plugins, sound_source_plugin, device, codec, volume, want_monitor_device, remote_decoders, remote_pulseaudio_server, remote_pulseaudio_id):
+def start_sending_sound(plugins, sound_source_plugin, device, codec, volume, want_monitor_device, remote_decoders, remote_pulseaudio_server, remote_pulseaudio_id, shared=False):
     log("start_sending_sound%s",
-        (plugins, sound_source_plugin, device, codec, volume, want_monitor_device, remote_decoders, remote_pulseaudio_server, remote_pulseaudio_id))
+        (plugins, sound_source_plugin, device, codec, volume, want_monitor_device, remote_decoders, remote_pulseaudio_server, remote_pulseaudio_id, shared))
     try:
         #info about the remote end:
         PAInfo = namedtuple("PAInfo", "pulseaudio_server,pulseaudio_id,remote_decoders")
@@ -379,7 +550,10 @@ def start_sending_sound(plugins, sound_source_plugin, device, codec, volume, wan
         log("parsed '%s':", sound_source_plugin)
         log("plugin=%s", plugin)
         log("options=%s", options)
-        return source_subprocess_wrapper(plugin, options, remote_decoders, volume, options)
+        if not shared:
+            return source_subprocess_wrapper(plugin, options, remote_decoders, volume, options)
+        source = get_shared_source(plugin, options, remote_decoders, volume)
+        return shared_source_client(source, codec, volume)
     except Exception as e:
         log.error("error setting up sound: %s", e, exc_info=True)
         return None
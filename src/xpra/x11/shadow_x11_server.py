@@ -5,6 +5,8 @@
 # Xpra is released under the terms of the GNU GPL v2, or, at your option, any
 # later version. See the file COPYING for details.
 
+from gi.repository import GObject
+
 from xpra.x11.x11_server_core import X11ServerCore
 from xpra.os_util import monotonic_time, _is_Wayland, get_loaded_kernel_modules
 from xpra.util import (
@@ -15,15 +17,25 @@ from xpra.server.shadow.gtk_shadow_server_base import GTKShadowServerBase
 from xpra.server.shadow.gtk_root_window_model import GTKImageCapture
 from xpra.server.shadow.shadow_server_base import ShadowServerBase
 from xpra.x11.bindings.ximage import XImageBindings     #@UnresolvedImport
-from xpra.gtk_common.error import xsync, xlog
+from xpra.x11.bindings.window_bindings import X11WindowBindings #@UnresolvedImport
+from xpra.x11.gtk_x11.gdk_bindings import add_event_receiver, remove_event_receiver
+from xpra.gtk_common.gobject_util import one_arg_signal
+from xpra.gtk_common.error import xsync, xlog, xswallow
+from xpra.rectangle import rectangle, add_rectangle, merge_all  #@UnresolvedImport
 from xpra.scripts.main import saved_env
 from xpra.log import Logger
 
 log = Logger("x11", "shadow")
 
 XImage = XImageBindings()
+X11Window = X11WindowBindings()
 
 USE_XSHM = envbool("XPRA_XSHM", True)
+XDAMAGE = envbool("XPRA_SHADOW_XDAMAGE", True)
+#beyond this number of rectangles, we just use the bounding box:
+MAX_DAMAGE_RECTANGLES = envint("XPRA_SHADOW_MAX_DAMAGE_RECTANGLES", 50)
+#smaller areas are captured with XGetImage rather than a full XShm image:
+XGETIMAGE_MAX_PIXELS = envint("XPRA_SHADOW_XGETIMAGE_MAX_PIXELS", 512*512)
 POLL_CURSOR = envint("XPRA_POLL_CURSOR", 20)
 USE_NVFBC = envbool("XPRA_NVFBC", True)
 USE_NVFBC_CUDA = envbool("XPRA_NVFBC_CUDA", True)
@@ -41,6 +53,7 @@ if USE_NVFBC:
 class XImageCapture:
     def __init__(self, xwindow):
         self.xshm = None
+        self.xshm_grabbed = False
         self.xwindow = xwindow
         assert USE_XSHM and XImage.has_XShm(), "no XShm support"
         if _is_Wayland(saved_env):
@@ -69,6 +82,7 @@ class XImageCapture:
         self.close_xshm()
 
     def refresh(self):
+        self.xshm_grabbed = False
         if self.xshm:
             #discard to ensure we will call XShmGetImage next time around
             self.xshm.discard()
@@ -87,11 +101,17 @@ class XImageCapture:
         if self.xshm is None:
             log("no xshm, cannot get image")
             return None
+        #if we haven't grabbed the full XShm image yet,
+        #small areas are cheaper to capture on their own:
+        partial = not self.xshm_grabbed and width*height<=XGETIMAGE_MAX_PIXELS
         try:
             start = monotonic_time()
             with xsync:
-                log("X11 shadow get_image, xshm=%s", self.xshm)
+                log("X11 shadow get_image, xshm=%s, partial=%s", self.xshm, partial)
+                if partial:
+                    return XImage.get_ximage(self.xwindow, x, y, width, height)
                 image = self.xshm.get_image(self.xwindow, x, y, width, height)
+                self.xshm_grabbed = True
                 return image
         except Exception as e:
             self._err(e)
@@ -99,7 +119,79 @@ class XImageCapture:
         finally:
             end = monotonic_time()
             log("X11 shadow captured %s pixels at %i MPixels/s using %s",
-                width*height, (width*height/(end-start))//1024//1024, ["GTK", "XSHM"][USE_XSHM])
+                width*height, (width*height/(end-start))//1024//1024, ["XSHM", "XGetImage"][partial])
+
+
+class XDamageMonitor(GObject.GObject):
+    """
+    Accumulates the areas of the root window reported by XDamage,
+    so the shadow server only needs to capture the regions that have changed.
+    """
+
+    __gsignals__ = {
+        "xpra-damage-event" : one_arg_signal,
+        }
+
+    def __init__(self, window, callback):
+        super().__init__()
+        self.window = window
+        self.xid = window.get_xid()
+        self.callback = callback
+        self.damage_handle = None
+        self.regions = []
+        self.events = 0
+        self.refreshes = 0
+
+    def __repr__(self):
+        return "XDamageMonitor(%#x)" % self.xid
+
+    def setup(self):
+        with xsync:
+            X11Window.ensure_XDamage_support()
+            self.damage_handle = X11Window.XDamageCreate(self.xid)
+        log("%s damage handle=%#x", self, self.damage_handle)
+        add_event_receiver(self.window, self)
+
+    def clean(self):
+        remove_event_receiver(self.window, self)
+        dh = self.damage_handle
+        if dh:
+            self.damage_handle = None
+            with xswallow:
+                X11Window.XDamageDestroy(dh)
+        self.regions = []
+
+    def do_xpra_damage_event(self, event):
+        self.events += 1
+        add_rectangle(self.regions, rectangle(event.x, event.y, event.width, event.height))
+        if len(self.regions)>MAX_DAMAGE_RECTANGLES:
+            self.regions = [merge_all(self.regions)]
+        self.callback()
+
+    def take_regions(self):
+        """
+            Returns the areas damaged since the last call,
+            and clears the damage so that we get new events for them.
+        """
+        regions = self.regions
+        self.regions = []
+        dh = self.damage_handle
+        if regions and dh:
+            self.refreshes += 1
+            #subtract before capturing, so that changes made
+            #while we capture will generate new damage events:
+            with xswallow:
+                X11Window.XDamageSubtract(dh)
+        return regions
+
+    def get_info(self) -> dict:
+        return {
+            "events"    : self.events,
+            "refreshes" : self.refreshes,
+            "regions"   : len(self.regions),
+            }
+
+GObject.type_register(XDamageMonitor)
 
 
 def setup_capture(window):
@@ -136,6 +228,7 @@ class ShadowX11Server(GTKShadowServerBase, X11ServerCore):
         GTKShadowServerBase.__init__(self)
         X11ServerCore.__init__(self)
         self.session_type = "shadow"
+        self.damage_monitor = None
 
     def init(self, opts):
         GTKShadowServerBase.init(self, opts)
@@ -155,7 +248,51 @@ class ShadowX11Server(GTKShadowServerBase, X11ServerCore):
 
 
     def setup_capture(self):
-        return setup_capture(self.root)
+        capture = setup_capture(self.root)
+        if XDAMAGE and isinstance(capture, (XImageCapture, GTKImageCapture)):
+            dm = XDamageMonitor(self.root, self.expedite_refresh)
+            try:
+                dm.setup()
+            except Exception as e:
+                log("setup_capture()", exc_info=True)
+                log.warn("Warning: XDamage is not available, using polling:")
+                log.warn(" %s", e)
+                dm.clean()
+            else:
+                self.damage_monitor = dm
+        return capture
+
+    def cleanup_capture(self):
+        dm = self.damage_monitor
+        if dm:
+            self.damage_monitor = None
+            dm.clean()
+        super().cleanup_capture()
+
+
+    def refresh(self):
+        dm = self.damage_monitor
+        if not dm:
+            return super().refresh()
+        self.refresh_timer = None
+        if not self.mapped:
+            return False
+        regions = dm.take_regions()
+        log("refresh() damaged regions=%s", regions)
+        if not regions:
+            #nothing has changed, check again later:
+            self.schedule_refresh(False)
+            return False
+        if self.capture:
+            self.capture.refresh()
+        for window in self._id_to_window.values():
+            wx, wy, ww, wh = window.geometry
+            for r in regions:
+                i = r.intersection(wx, wy, ww, wh)
+                if i:
+                    self.refresh_window_area(window, i.x-wx, i.y-wy, i.width, i.height)
+        self.schedule_refresh(True)
+        return False
 
 
     def client_startup_complete(self, ss):
@@ -220,6 +357,9 @@ class ShadowX11Server(GTKShadowServerBase, X11ServerCore):
     def get_info(self, proto, *_args):
         info = X11ServerCore.get_info(self, proto)
         merge_dicts(info, ShadowServerBase.get_info(self, proto))
+        dm = self.damage_monitor
+        if dm:
+            info["xdamage"] = dm.get_info()
         info.setdefault("features", {})["shadow"] = True
         info.setdefault("server", {})["type"] = "Python/gtk3/x11-shadow"
         return info